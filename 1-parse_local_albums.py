@@ -2,39 +2,24 @@
 This script is pretty specific to my music library, which is organized like: /Artist - Album/01 - Track.mp3
 
 The goal is to export a CSV of all the albums in my library, so that I can use that to query the Spotify API for album ID's.
+
+Same as `music-sync scan`; the stage itself lives in music_sync/commands/local.py.
 """
 
 #%%
-import os
-import pandas as pd
-
-from dotenv import load_dotenv
-
-load_dotenv()
+from music_sync.commands import local
+from music_sync.context import Context
 
-local_music_dir = os.environ["LOCAL_MUSIC_PATH"]
+ctx = Context()
 
 #%%
-# First: I need to get all the artists and albums in my music library
-# I'll just parse the directory names
-
-albums = os.listdir(local_music_dir)
-albums_df = pd.DataFrame(albums, columns=["folder"])
-
-albums_df["artist"] = albums_df["folder"].apply(lambda x: x.split("-")[0].strip())
-albums_df["album"] = albums_df.apply(lambda x: x["folder"][len(x["artist"]) + 2:].strip(), axis=1)
+# Parse the directory names into data/albums.csv and the local_albums table.
+# The manifest from the last run means we only look at folders that were
+# added, removed or renamed since then.
+albums_df, changes_df = local.scan(ctx)
 
 albums_df
 
 #%%
-
-# Clean up ", The" albums
-mask = albums_df["artist"].str.endswith(", The")
-albums_df.loc[mask, "artist"] = "The " + albums_df.loc[mask]["artist"].str.replace(", The", "")
-
-albums_df
-
-
-#%%
-# Save "Albums" csv
-albums_df.to_csv("data/albums.csv", index=False)
+# What changed since the last scan
+changes_df
@@ -0,0 +1,22 @@
+"""
+Runs the Spotify match-and-like pipeline (script 2) for several accounts at once.
+
+Each account has its own albums.csv (from script 1) and its own login, set in
+.env as SPOTIFY_LIBRARIES=alice=data/alice/albums.csv,bob=data/bob/albums.csv
+
+Artist searches, discographies and album matches are shared: each unique artist
+is looked up once no matter how many libraries it's in. Only the follows and
+saves are done per account. Same as `music-sync spotify multi`.
+"""
+
+#%%
+from music_sync.commands import spotify as stages
+from music_sync.context import Context
+
+# Each stage journals its progress to data/journal/. Set resume=False to start over.
+ctx = Context(resume=True)
+
+#%%
+# Logs in as each user, then writes data/albums_join_multi.csv for review
+albums = stages.multi(ctx)
+albums
@@ -0,0 +1,8 @@
+"""
+Local stand-in for the Spotify / Tidal APIs, a synthetic library generator, and a
+benchmark harness for the matching and sync paths. Nothing here needs a real account.
+
+    python -m bench.library /tmp/music --albums 10000
+    python -m bench.server --albums 10000 --latency 0.05 --rate-limit 50
+    python -m bench.run --albums 10000 --latency 0.05 --rate-limit 50
+"""
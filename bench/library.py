@@ -0,0 +1,96 @@
+"""
+Synthetic music library: deterministic `Artist - Album` names for a given size and seed.
+
+The stand-in server builds its catalog from the same names, so every local album
+has a (possibly differently spelled) counterpart to match against.
+
+    python -m bench.library /tmp/music --albums 10000
+"""
+
+import argparse
+import os
+import random
+import zlib
+from functools import lru_cache
+from typing import List, Tuple
+
+SYLLABLES = [
+    "ka", "lo", "mi", "ra", "ven", "tor", "sel", "an", "dri", "ko", "ba", "lu",
+    "ne", "sha", "gor", "fi", "el", "mon", "tre", "zu", "pa", "rin", "ost", "ye",
+]
+WORDS = [
+    "night", "river", "glass", "summer", "echo", "fire", "paper", "ghost", "city",
+    "golden", "blue", "wild", "silent", "electric", "heart", "road", "ocean", "dust",
+    "dream", "winter", "stone", "light", "shadow", "young", "broken", "sweet", "north",
+]
+ACCENTED = {"e": "é", "o": "ö", "a": "á"}
+
+
+def artist_name(rng: random.Random) -> str:
+    name = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 3))).capitalize()
+    if rng.random() < 0.4:
+        name += " " + "".join(rng.choice(SYLLABLES) for _ in range(2)).capitalize()
+    if rng.random() < 0.15:
+        name = "The " + name
+    if rng.random() < 0.05:
+        name = name.replace("e", ACCENTED["e"], 1)
+    return name
+
+
+def album_title(rng: random.Random) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 4))).title()
+
+
+@lru_cache(maxsize=8)
+def synthetic_library(albums: int, seed: int = 1) -> Tuple[Tuple[str, Tuple[str, ...]], ...]:
+    """((artist, (album, ...)), ...) with `albums` albums in total, 1-8 per artist."""
+    rng = random.Random(seed)
+    library = []
+    seen = set()
+    remaining = albums
+    while remaining > 0:
+        name = artist_name(rng)
+        if name in seen:
+            name = f"{name} {len(library)}"
+        seen.add(name)
+
+        titles = []
+        for _ in range(min(remaining, rng.randint(1, 8))):
+            title = album_title(rng)
+            while title in titles:
+                title = album_title(rng)
+            titles.append(title)
+
+        library.append((name, tuple(titles)))
+        remaining -= len(titles)
+
+    return tuple(library)
+
+
+def folder_names(albums: int, seed: int = 1) -> List[str]:
+    folders = []
+    for artist, titles in synthetic_library(albums, seed):
+        # Some folders use the "Beatles, The" spelling, like a real library
+        if artist.startswith("The ") and zlib.crc32(artist.encode()) % 2:
+            artist = artist[len("The "):] + ", The"
+        folders += [f"{artist} - {title}" for title in titles]
+    return folders
+
+
+def write_library(path: str, albums: int, seed: int = 1) -> int:
+    os.makedirs(path, exist_ok=True)
+    folders = folder_names(albums, seed)
+    for folder in folders:
+        os.makedirs(os.path.join(path, folder), exist_ok=True)
+    return len(folders)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create empty `Artist - Album` folders for a synthetic library.")
+    parser.add_argument("path")
+    parser.add_argument("--albums", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    count = write_library(args.path, args.albums, args.seed)
+    print(f"Created {count} album folders in {args.path}")
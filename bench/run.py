@@ -0,0 +1,247 @@
+"""
+End-to-end throughput benchmark against the local stand-in server.
+
+Builds a synthetic library, starts bench.server on a free port, points spotipy
+(and tidalapi, if it's installed) at it, and runs each pipeline stage the way
+the numbered scripts do: scan, artist search, discography fetch, match, follow,
+save, saved-album read, track fetch and playlist sync. For every stage it
+reports wall time, the number of requests the server saw, and requests/sec, so
+changes to concurrency, batching or caching show up as numbers.
+
+    python -m bench.run --albums 10000 --latency 0.05 --rate-limit 50 --json data/bench.json
+"""
+
+import argparse
+import json
+import os
+import re
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+import pandas as pd
+import requests
+import spotipy
+
+from bench.library import write_library
+from bench.server import start_server
+from music_sync.cache import ResponseCache
+from music_sync.editions import collapse_editions
+from music_sync.lookup import AlbumLookup
+from music_sync.matching import match_albums
+from music_sync.metrics import Metrics
+from music_sync.playlist import sync_sharded
+from music_sync.ratelimit import RateLimiter
+from music_sync.scanner import scan_library
+from music_sync.spotify import SpotifyClient
+from music_sync.workers import chunker, map_concurrent
+
+
+class Bench:
+    def __init__(self, server, metrics: Optional[Metrics] = None):
+        self.server = server
+        self.metrics = metrics
+        self.results: List[Dict] = []
+
+    def requests(self) -> int:
+        with self.server.stats_lock:
+            return self.server.stats["total"]
+
+    def throttled(self) -> int:
+        with self.server.stats_lock:
+            return self.server.stats["throttled"]
+
+    @contextmanager
+    def stage(self, name: str, items: int = 0):
+        requests, throttled = self.requests(), self.throttled()
+        start = time.perf_counter()
+        yield
+        elapsed = time.perf_counter() - start
+
+        result = {
+            "stage": name,
+            "items": items,
+            "seconds": round(elapsed, 3),
+            "requests": self.requests() - requests,
+            "throttled": self.throttled() - throttled,
+        }
+        result["requests_per_second"] = round(result["requests"] / elapsed, 1) if elapsed else None
+        self.results.append(result)
+        if self.metrics is not None:
+            self.metrics.export(re.sub(r"\W+", "_", name).strip("_"))
+        print(f"{name:<30} {elapsed:8.2f}s {result['requests']:8d} req {result['requests_per_second'] or 0:8.1f} req/s {result['throttled']:6d} 429s")
+
+    def summary(self) -> Dict:
+        return {
+            "seconds": round(sum(result["seconds"] for result in self.results), 3),
+            "requests": sum(result["requests"] for result in self.results),
+            "stages": self.results,
+        }
+
+
+def spotify_stages(bench: Bench, albums: pd.DataFrame, spotify: SpotifyClient, workers: int) -> pd.DataFrame:
+    sp = spotify.sp
+
+    artists = albums[["artist"]].drop_duplicates().reset_index(drop=True)
+    with bench.stage("spotify search", len(artists)):
+        results = map_concurrent(lambda name: spotify.search_artist(name, limit=1), artists["artist"].tolist(), workers=workers)
+    artists["artist_id"] = [items[0]["id"] if items else None for items in results]
+
+    artist_ids = artists["artist_id"].dropna().tolist()
+    albums = albums.merge(artists, on="artist", how="left")
+    wanted = albums.dropna(subset=["artist_id"]).groupby("artist_id")
+    lookup = AlbumLookup(spotify)
+    with bench.stage("spotify album lookup", len(artist_ids)):
+        found = map_concurrent(
+            lambda artist_id: lookup.albums(artist_id, wanted.get_group(artist_id)["artist"].iloc[0], wanted.get_group(artist_id)["album"].tolist()),
+            artist_ids,
+            workers=workers,
+        )
+    print(lookup.report())
+
+    listed = sum(len(items) for items in found)
+    catalog = pd.DataFrame([
+        {"artist_id": artist_id, "album_id": album["id"], "name": album["name"]}
+        for artist_id, items in zip(artist_ids, found)
+        for album in collapse_editions(items)
+    ])
+    print(f"Catalog: {len(catalog)} albums, from {listed} listed editions.")
+    with bench.stage("match", len(albums)):
+        albums = match_albums(albums, catalog, artist_col="artist_id")
+    albums = albums.merge(
+        catalog.drop_duplicates(["artist_id", "name"]).rename(columns={"name": "album_name_best_match"}),
+        on=["artist_id", "album_name_best_match"],
+        how="left",
+    )
+
+    with bench.stage("spotify follow", len(artist_ids)):
+        map_concurrent(lambda ids: spotify.call(sp.user_follow_artists, ids), list(chunker(artist_ids, 50)), workers=workers)
+    with bench.stage("spotify followed read"):
+        spotify.followed_artists()
+
+    album_ids = albums["album_id"].dropna().drop_duplicates().tolist()
+    with bench.stage("spotify save", len(album_ids)):
+        map_concurrent(lambda ids: spotify.call(sp.current_user_saved_albums_add, ids), list(chunker(album_ids, 50)), workers=workers)
+    with bench.stage("spotify saved read", len(album_ids)):
+        saved = spotify.saved_albums()
+
+    with bench.stage("spotify album tracks", len(saved)):
+        tracks = spotify.tracks_for_albums([album["id"] for album in saved], workers=workers)
+    album_tracks = [(album["id"], [track["id"] for track in tracks.get(album["id"], [])]) for album in saved]
+    track_count = sum(len(track_ids) for _, track_ids in album_tracks)
+
+    with bench.stage("playlist sync", track_count):
+        sync_sharded(spotify, "My CDs", album_tracks, workers=workers)
+    with bench.stage("playlist sync (no-op)", track_count):
+        sync_sharded(spotify, "My CDs", album_tracks, workers=workers)
+
+    matched = albums["album_id"].notna().sum()
+    print(f"Matched {matched} of {len(albums)} local albums.")
+    return albums
+
+
+def tidal_stages(bench: Bench, albums: pd.DataFrame, base_url: str, limiter: RateLimiter, workers: int, spotify: SpotifyClient):
+    import tidalapi
+
+    from music_sync.identifiers import resolve_tidal_albums
+    from music_sync.tidal import TidalClient, failures
+
+    session = tidalapi.Session()
+    session.config.api_v1_location = f"{base_url}/tidal/v1/"
+    session.config.openapi_v2_location = f"{base_url}/tidal/v2/"
+    session.load_oauth_session("Bearer", "bench-token")
+    tidal = TidalClient(session, limiter=limiter, workers=workers, metrics=bench.metrics)
+
+    names = albums["artist"].drop_duplicates().tolist()
+    with bench.stage("tidal search", len(names)):
+        results = tidal.search_artists(names)
+    artist_ids = [matches[0]["id"] for matches in results if not isinstance(matches, Exception) and matches]
+
+    with bench.stage("tidal discography", len(artist_ids)):
+        discographies = tidal.artists_albums(artist_ids)
+
+    with bench.stage("tidal favorite artists", len(artist_ids)):
+        favorited_artists = tidal.add_favorite_artists(artist_ids)
+
+    album_ids = [result["albums"][0]["id"] for result in discographies if not isinstance(result, Exception) and result["albums"]]
+    with bench.stage("tidal favorite albums", len(album_ids)):
+        favorited_albums = tidal.add_favorite_albums(album_ids)
+    with bench.stage("tidal favorite albums (no-op)", len(album_ids)):
+        tidal.add_favorite_albums(album_ids)
+    with bench.stage("tidal favorites read", len(album_ids)):
+        tidal.favorite_albums()
+
+    # The same albums again, straight from their Spotify matches by UPC / ISRC
+    with bench.stage("tidal resolve by UPC/ISRC", int(albums["album_id"].notna().sum())):
+        resolved = resolve_tidal_albums(spotify, tidal, albums, workers=workers)
+    print(f"Resolved {len(resolved)} of {len(albums)} local albums without search or discography.")
+
+    failed = {
+        **failures(names, results),
+        **failures(artist_ids, discographies),
+        **failures(artist_ids, favorited_artists),
+        **failures(album_ids, favorited_albums),
+    }
+    if failed:
+        print(f"{len(failed)} Tidal lookups failed, e.g. {next(iter(failed.items()))}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the sync pipeline against a local API stand-in.")
+    parser.add_argument("--albums", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds the server adds to every request")
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="Server-side requests/sec before 429s (0 = unlimited)")
+    parser.add_argument("--client-rate", type=float, default=1000.0, help="Client-side RateLimiter rate")
+    parser.add_argument("--cache-mode", default="off", help="ResponseCache mode for the Spotify client")
+    parser.add_argument("--skip-tidal", action="store_true")
+    parser.add_argument("--json", help="Also write the results to this file")
+    parser.add_argument("--metrics", help="Write per-endpoint metrics for each stage to this directory")
+    args = parser.parse_args()
+
+    server = start_server(args.albums, args.seed, latency=args.latency, jitter=args.jitter, rate_limit=args.rate_limit)
+    print(f"Stand-in server on {server.base_url}, {args.albums} albums, {args.workers} workers")
+    metrics = Metrics(args.metrics) if args.metrics else None
+    bench = Bench(server, metrics)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        music_dir = os.path.join(tmp, "music")
+        write_library(music_dir, args.albums, args.seed)
+        with bench.stage("scan (cold)", args.albums):
+            albums, _ = scan_library(music_dir, manifest_path=os.path.join(tmp, "manifest.json"))
+        with bench.stage("scan (unchanged)", args.albums):
+            scan_library(music_dir, manifest_path=os.path.join(tmp, "manifest.json"))
+
+        request_session = requests.Session()
+        sp = spotipy.Spotify(auth="bench-token", requests_session=request_session)
+        sp.prefix = f"{server.base_url}/v1/"
+        cache = ResponseCache(path=os.path.join(tmp, "api_cache.sqlite"), mode=args.cache_mode)
+        limiter = RateLimiter(rate=args.client_rate)
+        if metrics is not None:
+            metrics.instrument(request_session, "spotify", limiter)
+        spotify = SpotifyClient(sp, limiter=limiter, cache=cache)
+        matched = spotify_stages(bench, albums, spotify, args.workers)
+
+        if not args.skip_tidal:
+            try:
+                import tidalapi  # noqa: F401
+            except ImportError:
+                print("tidalapi isn't installed, skipping the Tidal stages.")
+            else:
+                tidal_stages(bench, matched, server.base_url, RateLimiter(rate=args.client_rate), args.workers, spotify)
+        cache.close()
+
+    summary = bench.summary()
+    summary["options"] = vars(args)
+    print(f"Total: {summary['seconds']:.2f}s, {summary['requests']} requests")
+
+    if args.json:
+        if os.path.dirname(args.json):
+            os.makedirs(os.path.dirname(args.json), exist_ok=True)
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+
+    server.shutdown()
@@ -0,0 +1,797 @@
+"""
+Local HTTP stand-in for the parts of the Spotify Web API and Tidal API the
+scripts use, backed by the synthetic library from bench.library.
+
+Spotify lives under /v1/ (point spotipy at it with `sp.prefix`), Tidal under
+/tidal/v1/ and /tidal/v2/ (point tidalapi at it with `session.config`).
+
+Every request can be delayed (--latency, --jitter), and a server-side token
+bucket (--rate-limit) answers with 429 + Retry-After once it's exhausted, like
+the real services do. GET /_stats returns request counts per endpoint, POST
+/_reset clears them.
+
+    python -m bench.server --albums 10000 --latency 0.05 --rate-limit 50
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlencode, urlparse
+
+from bench.library import WORDS, synthetic_library
+
+# Album objects carry their market list, which is most of a real payload's size
+MARKETS = [f"{a}{b}" for a in "ABCDEFGHIJKLMN" for b in "ABCDEFGHIJKLM"]
+
+SPOTIFY_PAGE_LIMIT = 50
+TIDAL_USER_ID = 1
+
+
+def normalize(name: str) -> str:
+    name = unicodedata.normalize("NFKD", name)
+    name = "".join(c for c in name if not unicodedata.combining(c))
+    return " ".join(name.casefold().split())
+
+
+class Catalog:
+    """Deterministic catalog: every artist's discography is generated on demand from the seed."""
+
+    def __init__(self, albums: int, seed: int = 1):
+        self.seed = seed
+        self.library = synthetic_library(albums, seed)
+        self.by_name = {normalize(artist): idx for idx, (artist, _) in enumerate(self.library)}
+
+    # IDs encode their position, so any ID can be resolved without an index
+    def artist_id(self, idx: int) -> str:
+        return f"ar{idx:020d}"
+
+    def album_id(self, idx: int, j: int) -> str:
+        return f"al{idx:012d}{j:08d}"
+
+    def track_id(self, idx: int, j: int, k: int) -> str:
+        return f"tr{idx:010d}{j:06d}{k:04d}"
+
+    def tidal_artist_id(self, idx: int) -> int:
+        return idx + 1
+
+    def tidal_album_id(self, idx: int, j: int) -> int:
+        return (idx + 1) * 1000 + j
+
+    def upc(self, idx: int, j: int) -> str:
+        return f"{idx:08d}{j:04d}"
+
+    def tidal_upc(self, idx: int, j: int) -> str:
+        # Every 10th album is another pressing on Tidal, with its own barcode,
+        # so only its ISRCs match Spotify's
+        return self.upc(idx, j) if (idx + j) % 10 else f"{idx:08d}{j + 5000:04d}"
+
+    def parse_artist_id(self, artist_id) -> Optional[int]:
+        try:
+            idx = int(str(artist_id)[2:]) if str(artist_id).startswith("ar") else int(artist_id) - 1
+        except ValueError:
+            return None
+        return idx if 0 <= idx < len(self.library) else None
+
+    def parse_album_id(self, album_id) -> Optional[Tuple[int, int]]:
+        album_id = str(album_id)
+        try:
+            if album_id.startswith("al"):
+                idx, j = int(album_id[2:14]), int(album_id[14:])
+            else:
+                idx, j = divmod(int(album_id), 1000)
+                idx -= 1
+        except ValueError:
+            return None
+        if not 0 <= idx < len(self.library) or j >= len(self.discography(idx)):
+            return None
+        return idx, j
+
+    @lru_cache(maxsize=50_000)
+    def discography(self, idx: int) -> List[Dict]:
+        """The artist's albums: every local title (sometimes respelled), some re-release variants, and filler."""
+        rng = random.Random(self.seed * 7919 + idx)
+        _, titles = self.library[idx]
+
+        names = []
+        for title in titles:
+            if rng.random() < 0.15:
+                names.append(title.lower() + "!")
+            else:
+                names.append(title)
+            if rng.random() < 0.3:
+                names.append(f"{title} (Remastered {rng.randint(1995, 2022)})")
+            if rng.random() < 0.15:
+                names.append(f"{title} (Deluxe Edition)")
+
+        # A long tail of other releases, so some discographies span several pages
+        for _ in range(rng.choice([2, 5, 10, 20, 40, 80])):
+            names.append(" ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 3))).title())
+
+        albums = []
+        for j, name in enumerate(names):
+            albums.append({
+                "name": name,
+                "year": rng.randint(1965, 2024),
+                "tracks": 60 if rng.random() < 0.03 else rng.randint(6, 18),
+                "explicit": rng.random() < 0.1,
+            })
+        return albums
+
+
+class State:
+    """The mutable per-user bits: saved albums, follows, playlists, favorites."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.saved_albums: Dict[str, float] = {}
+        self.followed_artists: List[str] = []
+        self.playlists: Dict[str, Dict] = {"pl0000000000000000000001": {"name": "My CDs", "tracks": []}}
+        self.tidal_favorite_artists: Dict[int, float] = {}
+        self.tidal_favorite_albums: Dict[int, float] = {}
+
+
+class Limiter:
+    def __init__(self, rate: float, burst: int, retry_after: int):
+        self.rate = rate
+        self.burst = burst
+        self.retry_after = retry_after
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def allow(self) -> bool:
+        if not self.rate:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, catalog: Catalog, latency: float = 0.0, jitter: float = 0.0,
+                 rate_limit: float = 0.0, burst: int = 20, retry_after: int = 1):
+        super().__init__(address, Handler)
+        self.catalog = catalog
+        self.state = State()
+        self.latency = latency
+        self.jitter = jitter
+        self.limiters = {
+            "spotify": Limiter(rate_limit, burst, retry_after),
+            "tidal": Limiter(rate_limit, burst, retry_after),
+        }
+        self.stats = Counter()
+        self.stats_lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, key: str):
+        with self.stats_lock:
+            self.stats[key] += 1
+
+
+class Handler(BaseHTTPRequestHandler):
+    server: StandInServer
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out as two writes; with Nagle on, keep-alive clients
+    # wait out a delayed ACK (~40ms) on every response
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    ##############################
+    # Plumbing
+    ##############################
+
+    def do_GET(self):
+        self.dispatch("GET")
+
+    def do_POST(self):
+        self.dispatch("POST")
+
+    def do_PUT(self):
+        self.dispatch("PUT")
+
+    def do_DELETE(self):
+        self.dispatch("DELETE")
+
+    def dispatch(self, method: str):
+        url = urlparse(self.path)
+        self.query_lists = parse_qs(url.query)
+        self.query = {k: v[-1] for k, v in self.query_lists.items()}
+        length = int(self.headers.get("Content-Length") or 0)
+        self.body = self.rfile.read(length) if length else b""
+
+        if url.path == "/_stats":
+            with self.server.stats_lock:
+                return self.send_json(dict(self.server.stats))
+        if url.path == "/_reset":
+            with self.server.stats_lock:
+                self.server.stats.clear()
+            return self.send_json({})
+
+        for route_method, pattern, handler in ROUTES:
+            # spotipy asks for some collections with a trailing slash ("albums/?ids=")
+            match = pattern.fullmatch(url.path.rstrip("/"))
+            if route_method != method or not match:
+                continue
+
+            service = "tidal" if url.path.startswith("/tidal/") else "spotify"
+            endpoint = f"{method} " + re.sub(r"\([^)]*\)", "{id}", pattern.pattern)
+            self.server.count("total")
+            self.server.count(endpoint)
+
+            if self.server.latency or self.server.jitter:
+                time.sleep(self.server.latency + random.uniform(0, self.server.jitter))
+
+            limiter = self.server.limiters[service]
+            if not limiter.allow():
+                self.server.count("throttled")
+                return self.send_json({"error": {"status": 429, "message": "API rate limit exceeded"}}, status=429,
+                                      headers={"Retry-After": str(limiter.retry_after)})
+
+            return handler(self, *match.groups())
+
+        self.send_json({"error": {"status": 404, "message": "Not found"}}, status=404)
+
+    def send_json(self, obj, status: int = 200, headers: Optional[Dict] = None):
+        body = json.dumps(obj).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def json_body(self):
+        return json.loads(self.body) if self.body else None
+
+    def form_body(self) -> Dict[str, str]:
+        return {k: v[-1] for k, v in parse_qs(self.body.decode()).items()}
+
+    def int_arg(self, name: str, default: int) -> int:
+        try:
+            return int(self.query.get(name, default))
+        except ValueError:
+            return default
+
+    def page(self, items: List, total: int, offset: int, limit: int, path: str) -> Dict:
+        def link(offset):
+            query = {**self.query, "offset": offset, "limit": limit}
+            return f"{self.server.base_url}{path}?{urlencode(query)}"
+
+        return {
+            "href": link(offset),
+            "items": items,
+            "limit": limit,
+            "offset": offset,
+            "total": total,
+            "next": link(offset + limit) if offset + limit < total else None,
+            "previous": link(max(0, offset - limit)) if offset > 0 else None,
+        }
+
+    ##############################
+    # Spotify objects
+    ##############################
+
+    def spotify_artist(self, idx: int) -> Dict:
+        artist_id = self.server.catalog.artist_id(idx)
+        return {
+            "id": artist_id,
+            "name": self.server.catalog.library[idx][0],
+            "type": "artist",
+            "uri": f"spotify:artist:{artist_id}",
+            "external_urls": {"spotify": f"https://open.spotify.com/artist/{artist_id}"},
+        }
+
+    def spotify_album(self, idx: int, j: int, full: bool = False) -> Dict:
+        catalog = self.server.catalog
+        album = catalog.discography(idx)[j]
+        album_id = catalog.album_id(idx, j)
+        obj = {
+            "id": album_id,
+            "name": album["name"],
+            "album_type": "album",
+            "release_date": f"{album['year']}-01-01",
+            "total_tracks": album["tracks"],
+            "artists": [self.spotify_artist(idx)],
+            "available_markets": MARKETS,
+            "uri": f"spotify:album:{album_id}",
+            "external_urls": {"spotify": f"https://open.spotify.com/album/{album_id}"},
+        }
+        if full:
+            obj["external_ids"] = {"upc": self.server.catalog.upc(idx, j)}
+            tracks = [self.spotify_track(idx, j, k) for k in range(min(album["tracks"], SPOTIFY_PAGE_LIMIT))]
+            obj["tracks"] = self.page(tracks, album["tracks"], 0, SPOTIFY_PAGE_LIMIT, f"/v1/albums/{album_id}/tracks")
+            obj["tracks"]["next"] = (
+                f"{self.server.base_url}/v1/albums/{album_id}/tracks?offset={SPOTIFY_PAGE_LIMIT}&limit={SPOTIFY_PAGE_LIMIT}"
+                if album["tracks"] > SPOTIFY_PAGE_LIMIT else None
+            )
+        return obj
+
+    def spotify_track(self, idx: int, j: int, k: int, full: bool = False) -> Dict:
+        track_id = self.server.catalog.track_id(idx, j, k)
+        obj = {
+            "id": track_id,
+            "name": f"Track {k + 1}",
+            "track_number": k + 1,
+            "duration_ms": 180_000,
+            "explicit": self.server.catalog.discography(idx)[j]["explicit"],
+            "uri": f"spotify:track:{track_id}",
+            "artists": [self.spotify_artist(idx)],
+        }
+        if full:
+            obj["external_ids"] = {"isrc": f"QZ{idx:07d}{j:03d}{k:02d}"}
+            obj["album"] = self.spotify_album(idx, j)
+        return obj
+
+    def parse_track_id(self, track_id: str) -> Optional[Tuple[int, int, int]]:
+        track_id = track_id.split(":")[-1]
+        try:
+            return int(track_id[2:12]), int(track_id[12:18]), int(track_id[18:])
+        except ValueError:
+            return None
+
+    ##############################
+    # Spotify endpoints
+    ##############################
+
+    def spotify_search(self):
+        catalog = self.server.catalog
+        limit = self.int_arg("limit", 10)
+        query = self.query.get("q", "")
+        fields = dict(re.findall(r'(artist|album):"?([^"]+?)"?(?=\s+\w+:|$)', query))
+        idx = catalog.by_name.get(normalize(fields.get("artist", query)))
+
+        if self.query.get("type") == "album":
+            items = []
+            if idx is not None:
+                wanted = normalize(fields.get("album", ""))
+                items = [self.spotify_album(idx, j) for j, album in enumerate(catalog.discography(idx))
+                         if wanted and wanted in normalize(album["name"])][:limit]
+            return self.send_json({"albums": self.page(items, len(items), 0, limit, "/v1/search")})
+
+        items = []
+        if idx is not None:
+            # The real artist first, plus a couple of similarly named decoys
+            candidates = [idx] + [i for i in (idx + 1, idx + 2) if i < len(catalog.library)]
+            items = [self.spotify_artist(i) for i in candidates[:limit]]
+        self.send_json({"artists": self.page(items, len(items), 0, limit, "/v1/search")})
+
+    def spotify_artist_albums(self, artist_id: str):
+        idx = self.server.catalog.parse_artist_id(artist_id)
+        if idx is None:
+            return self.send_json({"error": {"status": 404, "message": "Artist not found"}}, status=404)
+
+        offset, limit = self.int_arg("offset", 0), min(self.int_arg("limit", 20), SPOTIFY_PAGE_LIMIT)
+        discography = self.server.catalog.discography(idx)
+        items = [self.spotify_album(idx, j) for j in range(offset, min(offset + limit, len(discography)))]
+        self.send_json(self.page(items, len(discography), offset, limit, f"/v1/artists/{artist_id}/albums"))
+
+    def spotify_albums(self):
+        albums = []
+        for album_id in self.query.get("ids", "").split(",")[:20]:
+            parsed = self.server.catalog.parse_album_id(album_id)
+            albums.append(self.spotify_album(*parsed, full=True) if parsed else None)
+        self.send_json({"albums": albums})
+
+    def spotify_album_tracks(self, album_id: str):
+        parsed = self.server.catalog.parse_album_id(album_id)
+        if parsed is None:
+            return self.send_json({"error": {"status": 404, "message": "Album not found"}}, status=404)
+
+        idx, j = parsed
+        total = self.server.catalog.discography(idx)[j]["tracks"]
+        offset, limit = self.int_arg("offset", 0), min(self.int_arg("limit", 20), SPOTIFY_PAGE_LIMIT)
+        items = [self.spotify_track(idx, j, k) for k in range(offset, min(offset + limit, total))]
+        self.send_json(self.page(items, total, offset, limit, f"/v1/albums/{album_id}/tracks"))
+
+    def spotify_tracks(self):
+        tracks = []
+        for track_id in self.query.get("ids", "").split(",")[:50]:
+            parsed = self.parse_track_id(track_id)
+            tracks.append(self.spotify_track(*parsed, full=True) if parsed else None)
+        self.send_json({"tracks": tracks})
+
+    def spotify_saved_albums(self):
+        catalog = self.server.catalog
+        state = self.server.state
+        with state.lock:
+            # Most recently saved first, like the real endpoint
+            saved = sorted(state.saved_albums.items(), key=lambda item: item[1], reverse=True)
+
+        offset, limit = self.int_arg("offset", 0), min(self.int_arg("limit", 20), SPOTIFY_PAGE_LIMIT)
+        items = []
+        for album_id, added_at in saved[offset:offset + limit]:
+            items.append({
+                "added_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(added_at)),
+                "album": self.spotify_album(*catalog.parse_album_id(album_id), full=True),
+            })
+        self.send_json(self.page(items, len(saved), offset, limit, "/v1/me/albums"))
+
+    def spotify_save_albums(self):
+        ids = [album_id for album_id in self.query.get("ids", "").split(",") if album_id][:50]
+        state = self.server.state
+        with state.lock:
+            for album_id in ids:
+                if self.server.catalog.parse_album_id(album_id) and album_id not in state.saved_albums:
+                    state.saved_albums[album_id] = time.time()
+        self.send_json({})
+
+    def spotify_followed_artists(self):
+        state = self.server.state
+        with state.lock:
+            followed = sorted(state.followed_artists)
+
+        limit = min(self.int_arg("limit", 20), SPOTIFY_PAGE_LIMIT)
+        after = self.query.get("after")
+        start = followed.index(after) + 1 if after in followed else 0
+        items = [self.spotify_artist(self.server.catalog.parse_artist_id(artist_id)) for artist_id in followed[start:start + limit]]
+        last = items[-1]["id"] if items else None
+        next_url = (
+            f"{self.server.base_url}/v1/me/following?{urlencode({'type': 'artist', 'limit': limit, 'after': last})}"
+            if start + limit < len(followed) else None
+        )
+        self.send_json({"artists": {
+            "items": items,
+            "limit": limit,
+            "total": len(followed),
+            "next": next_url,
+            "cursors": {"after": last if next_url else None},
+        }})
+
+    def spotify_follow_artists(self):
+        ids = [artist_id for artist_id in self.query.get("ids", "").split(",") if artist_id][:50]
+        state = self.server.state
+        with state.lock:
+            for artist_id in ids:
+                if self.server.catalog.parse_artist_id(artist_id) is not None and artist_id not in state.followed_artists:
+                    state.followed_artists.append(artist_id)
+        self.send_response(204)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def spotify_playlist_object(self, playlist_id: str, playlist: Dict) -> Dict:
+        return {
+            "id": playlist_id,
+            "name": playlist["name"],
+            "uri": f"spotify:playlist:{playlist_id}",
+            "tracks": {"total": len(playlist["tracks"])},
+        }
+
+    def spotify_me(self):
+        self.send_json({"id": "bench", "display_name": "bench", "uri": "spotify:user:bench"})
+
+    def spotify_playlists(self):
+        state = self.server.state
+        with state.lock:
+            playlists = [self.spotify_playlist_object(pid, playlist) for pid, playlist in state.playlists.items()]
+
+        offset, limit = self.int_arg("offset", 0), min(self.int_arg("limit", 50), SPOTIFY_PAGE_LIMIT)
+        self.send_json(self.page(playlists[offset:offset + limit], len(playlists), offset, limit, "/v1/me/playlists"))
+
+    def spotify_create_playlist(self, user: str):
+        body = self.json_body() or {}
+        state = self.server.state
+        with state.lock:
+            playlist_id = f"pl{len(state.playlists) + 1:022d}"
+            state.playlists[playlist_id] = {"name": body.get("name", ""), "tracks": []}
+            obj = self.spotify_playlist_object(playlist_id, state.playlists[playlist_id])
+        self.send_json(obj, status=201)
+
+    def spotify_playlist(self, playlist_id: str) -> Optional[Dict]:
+        playlist = self.server.state.playlists.get(playlist_id)
+        if playlist is None:
+            self.send_json({"error": {"status": 404, "message": "Playlist not found"}}, status=404)
+        return playlist
+
+    def spotify_playlist_tracks(self, playlist_id: str):
+        playlist = self.spotify_playlist(playlist_id)
+        if playlist is None:
+            return
+        with self.server.state.lock:
+            tracks = list(playlist["tracks"])
+
+        offset, limit = self.int_arg("offset", 0), min(self.int_arg("limit", 100), 100)
+        items = [{"track": {"id": track_id, "uri": f"spotify:track:{track_id}"}} for track_id in tracks[offset:offset + limit]]
+        self.send_json(self.page(items, len(tracks), offset, limit, f"/v1/playlists/{playlist_id}/tracks"))
+
+    def spotify_add_playlist_tracks(self, playlist_id: str):
+        playlist = self.spotify_playlist(playlist_id)
+        if playlist is None:
+            return
+        body = self.json_body()
+        uris = body["uris"] if isinstance(body, dict) else body
+        ids = [uri.split(":")[-1] for uri in uris][:100]
+        with self.server.state.lock:
+            if playlist["tracks"] and len(playlist["tracks"]) + len(ids) > 10_000:
+                return self.send_json({"error": {"status": 400, "message": "Playlist size limit reached"}}, status=400)
+            position = self.query.get("position")
+            if position is None:
+                playlist["tracks"] += ids
+            else:
+                playlist["tracks"][int(position):int(position)] = ids
+        self.send_json({"snapshot_id": "bench"}, status=201)
+
+    def spotify_replace_playlist_tracks(self, playlist_id: str):
+        playlist = self.spotify_playlist(playlist_id)
+        if playlist is None:
+            return
+        ids = [uri.split(":")[-1] for uri in (self.json_body() or {}).get("uris", [])][:100]
+        with self.server.state.lock:
+            playlist["tracks"] = ids
+        self.send_json({"snapshot_id": "bench"}, status=201)
+
+    def spotify_remove_playlist_tracks(self, playlist_id: str):
+        playlist = self.spotify_playlist(playlist_id)
+        if playlist is None:
+            return
+        remove = {track["uri"].split(":")[-1] for track in (self.json_body() or {}).get("tracks", [])[:100]}
+        with self.server.state.lock:
+            playlist["tracks"] = [track_id for track_id in playlist["tracks"] if track_id not in remove]
+        self.send_json({"snapshot_id": "bench"})
+
+    ##############################
+    # Tidal objects
+    ##############################
+
+    def tidal_artist(self, idx: int) -> Dict:
+        return {"id": self.server.catalog.tidal_artist_id(idx), "name": self.server.catalog.library[idx][0], "type": "MAIN"}
+
+    def tidal_album(self, idx: int, j: int) -> Dict:
+        album = self.server.catalog.discography(idx)[j]
+        artist = self.tidal_artist(idx)
+        return {
+            "id": self.server.catalog.tidal_album_id(idx, j),
+            "title": album["name"],
+            "cover": None,
+            "videoCover": None,
+            "numberOfTracks": album["tracks"],
+            "explicit": album["explicit"],
+            "releaseDate": f"{album['year']}-01-01",
+            "upc": self.server.catalog.tidal_upc(idx, j),
+            "artist": artist,
+            "artists": [artist],
+        }
+
+    def tidal_list(self, items: List, total: int, offset: int, limit: int) -> Dict:
+        return {"items": items, "limit": limit, "offset": offset, "totalNumberOfItems": total}
+
+    def tidal_favorites(self, favorites: Dict[int, float], to_obj) -> Dict:
+        with self.server.state.lock:
+            favorited = sorted(favorites.items(), key=lambda item: item[1], reverse=True)
+        offset, limit = self.int_arg("offset", 0), self.int_arg("limit", 10)
+        items = [
+            {"created": time.strftime("%Y-%m-%dT%H:%M:%S.000+0000", time.gmtime(added)), "item": to_obj(item_id)}
+            for item_id, added in favorited[offset:offset + limit]
+        ]
+        return self.tidal_list(items, len(favorited), offset, limit)
+
+    ##############################
+    # Tidal endpoints
+    ##############################
+
+    def tidal_session(self):
+        self.send_json({"sessionId": "bench", "countryCode": "US", "userId": TIDAL_USER_ID})
+
+    def tidal_user(self, user_id: str):
+        self.send_json({"id": int(user_id), "username": "bench", "email": "bench@example.com", "firstName": "Bench", "lastName": "User"})
+
+    def tidal_search(self):
+        catalog = self.server.catalog
+        idx = catalog.by_name.get(normalize(self.query.get("query", "")))
+        limit = self.int_arg("limit", 50)
+        artists = []
+        if idx is not None:
+            candidates = [idx] + [i for i in (idx + 1, idx + 2) if i < len(catalog.library)]
+            artists = [self.tidal_artist(i) for i in candidates[:limit]]
+        empty = self.tidal_list([], 0, 0, limit)
+        self.send_json({
+            "artists": self.tidal_list(artists, len(artists), 0, limit),
+            "albums": empty, "tracks": empty, "videos": empty, "playlists": empty,
+            "topHit": None,
+        })
+
+    def tidal_get_artist(self, artist_id: str):
+        idx = self.server.catalog.parse_artist_id(artist_id)
+        if idx is None:
+            return self.send_json({"status": 404, "userMessage": "Artist not found"}, status=404)
+        self.send_json(self.tidal_artist(idx))
+
+    def tidal_artist_albums(self, artist_id: str):
+        idx = self.server.catalog.parse_artist_id(artist_id)
+        if idx is None:
+            return self.send_json({"status": 404, "userMessage": "Artist not found"}, status=404)
+        discography = self.server.catalog.discography(idx)
+        offset, limit = self.int_arg("offset", 0), self.int_arg("limit", 10)
+        items = [self.tidal_album(idx, j) for j in range(offset, min(offset + limit, len(discography)))]
+        self.send_json(self.tidal_list(items, len(discography), offset, limit))
+
+    def tidal_get_album(self, album_id: str):
+        parsed = self.server.catalog.parse_album_id(album_id)
+        if parsed is None:
+            return self.send_json({"status": 404, "userMessage": "Album not found"}, status=404)
+        self.send_json(self.tidal_album(*parsed))
+
+    def tidal_favorite_artists(self, user_id: str):
+        catalog = self.server.catalog
+        self.send_json(self.tidal_favorites(self.server.state.tidal_favorite_artists,
+                                            lambda artist_id: self.tidal_artist(catalog.parse_artist_id(artist_id))))
+
+    def tidal_favorite_albums(self, user_id: str):
+        catalog = self.server.catalog
+        self.send_json(self.tidal_favorites(self.server.state.tidal_favorite_albums,
+                                            lambda album_id: self.tidal_album(*catalog.parse_album_id(album_id))))
+
+    def tidal_add_favorites(self, favorites: Dict[int, float], ids: str, valid):
+        with self.server.state.lock:
+            for item_id in ids.split(","):
+                if item_id.strip().isdigit() and valid(item_id.strip()):
+                    favorites.setdefault(int(item_id), time.time())
+        self.send_json({})
+
+    def tidal_add_favorite_artists(self, user_id: str):
+        form = self.form_body()
+        self.tidal_add_favorites(self.server.state.tidal_favorite_artists, form.get("artistIds", form.get("artistId", "")),
+                                 lambda item_id: self.server.catalog.parse_artist_id(item_id) is not None)
+
+    def tidal_add_favorite_albums(self, user_id: str):
+        form = self.form_body()
+        self.tidal_add_favorites(self.server.state.tidal_favorite_albums, form.get("albumIds", form.get("albumId", "")),
+                                 lambda item_id: self.server.catalog.parse_album_id(item_id) is not None)
+
+    def query_values(self, name: str) -> List[str]:
+        # Array filters can be repeated or comma-separated
+        return [value for values in self.query_lists.get(name, []) for value in values.split(",") if value]
+
+    def tidal_v2_resource(self, kind: str, resource_id, attributes: Dict, **relationships) -> Dict:
+        resource = {"id": str(resource_id), "type": kind, "attributes": attributes}
+        if relationships:
+            resource["relationships"] = {
+                name: {"data": [{"id": str(related["id"]), "type": related["type"]} for related in items]}
+                for name, items in relationships.items()
+            }
+        return resource
+
+    def tidal_v2_album(self, idx: int, j: int) -> Dict:
+        catalog = self.server.catalog
+        album = catalog.discography(idx)[j]
+        return self.tidal_v2_resource("albums", catalog.tidal_album_id(idx, j), {"title": album["name"], "barcodeId": catalog.tidal_upc(idx, j)})
+
+    def tidal_v2_artist(self, idx: int) -> Dict:
+        catalog = self.server.catalog
+        return self.tidal_v2_resource("artists", catalog.tidal_artist_id(idx), {"name": catalog.library[idx][0]})
+
+    def tidal_albums_by_barcode(self):
+        catalog = self.server.catalog
+        data, included = [], {}
+        for barcode in self.query_values("filter[barcodeId]")[:20]:
+            if len(barcode) != 12 or not barcode.isdigit():
+                continue
+            idx, j = int(barcode[:8]), int(barcode[8:]) % 5000
+            if catalog.parse_album_id(catalog.tidal_album_id(idx, j)) and catalog.tidal_upc(idx, j) == barcode:
+                artist = self.tidal_v2_artist(idx)
+                album = self.tidal_v2_album(idx, j)
+                data.append(self.tidal_v2_resource("albums", album["id"], album["attributes"], artists=[artist]))
+                included[("artists", artist["id"])] = artist
+        self.send_json({"data": data, "included": list(included.values())})
+
+    def tidal_tracks_by_isrc(self):
+        catalog = self.server.catalog
+        data, included = [], {}
+        for isrc in self.query_values("filter[isrc]")[:20]:
+            if len(isrc) != 14 or not isrc.startswith("QZ") or not isrc[2:].isdigit():
+                continue
+            idx, j, k = int(isrc[2:9]), int(isrc[9:12]), int(isrc[12:])
+            if catalog.parse_album_id(catalog.tidal_album_id(idx, j)):
+                artist, album = self.tidal_v2_artist(idx), self.tidal_v2_album(idx, j)
+                data.append(self.tidal_v2_resource(
+                    "tracks", catalog.tidal_album_id(idx, j) * 100 + k, {"title": f"Track {k + 1}", "isrc": isrc},
+                    albums=[album], artists=[artist],
+                ))
+                included[("artists", artist["id"])] = artist
+                included[("albums", album["id"])] = album
+        self.send_json({"data": data, "included": list(included.values())})
+
+    def tidal_get_track(self, track_id: str):
+        album_id, k = divmod(int(track_id), 100)
+        parsed = self.server.catalog.parse_album_id(album_id)
+        if parsed is None:
+            return self.send_json({"status": 404, "userMessage": "Track not found"}, status=404)
+        album = self.tidal_album(*parsed)
+        self.send_json({
+            "id": int(track_id),
+            "title": f"Track {k + 1}",
+            "trackNumber": k + 1,
+            "volumeNumber": 1,
+            "duration": 180,
+            "isrc": f"QZ{parsed[0]:07d}{parsed[1]:03d}{k:02d}",
+            "album": album,
+            "artist": album["artist"],
+            "artists": album["artists"],
+        })
+
+
+def route(method: str, pattern: str, handler) -> Tuple[str, re.Pattern, object]:
+    return method, re.compile(pattern), handler
+
+
+ROUTES = [
+    route("GET", r"/v1/search", Handler.spotify_search),
+    route("GET", r"/v1/artists/([^/]+)/albums", Handler.spotify_artist_albums),
+    route("GET", r"/v1/albums", Handler.spotify_albums),
+    route("GET", r"/v1/albums/([^/]+)/tracks", Handler.spotify_album_tracks),
+    route("GET", r"/v1/tracks", Handler.spotify_tracks),
+    route("GET", r"/v1/me/albums", Handler.spotify_saved_albums),
+    route("PUT", r"/v1/me/albums", Handler.spotify_save_albums),
+    route("GET", r"/v1/me/following", Handler.spotify_followed_artists),
+    route("PUT", r"/v1/me/following", Handler.spotify_follow_artists),
+    route("GET", r"/v1/me", Handler.spotify_me),
+    route("GET", r"/v1/me/playlists", Handler.spotify_playlists),
+    route("POST", r"/v1/users/([^/]+)/playlists", Handler.spotify_create_playlist),
+    route("GET", r"/v1/playlists/([^/]+)/tracks", Handler.spotify_playlist_tracks),
+    route("POST", r"/v1/playlists/([^/]+)/tracks", Handler.spotify_add_playlist_tracks),
+    route("PUT", r"/v1/playlists/([^/]+)/tracks", Handler.spotify_replace_playlist_tracks),
+    route("DELETE", r"/v1/playlists/([^/]+)/tracks", Handler.spotify_remove_playlist_tracks),
+    route("GET", r"/tidal/v1/sessions", Handler.tidal_session),
+    route("GET", r"/tidal/v1/users/(\d+)", Handler.tidal_user),
+    route("GET", r"/tidal/v1/search", Handler.tidal_search),
+    route("GET", r"/tidal/v1/artists/(\d+)", Handler.tidal_get_artist),
+    route("GET", r"/tidal/v1/artists/(\d+)/albums", Handler.tidal_artist_albums),
+    route("GET", r"/tidal/v1/albums/(\d+)", Handler.tidal_get_album),
+    route("GET", r"/tidal/v1/tracks/(\d+)", Handler.tidal_get_track),
+    route("GET", r"/tidal/v1/users/(\d+)/favorites/artists", Handler.tidal_favorite_artists),
+    route("GET", r"/tidal/v1/users/(\d+)/favorites/albums", Handler.tidal_favorite_albums),
+    route("POST", r"/tidal/v1/users/(\d+)/favorites/artists", Handler.tidal_add_favorite_artists),
+    route("POST", r"/tidal/v1/users/(\d+)/favorites/albums", Handler.tidal_add_favorite_albums),
+    route("GET", r"/tidal/v2/albums", Handler.tidal_albums_by_barcode),
+    route("GET", r"/tidal/v2/tracks", Handler.tidal_tracks_by_isrc),
+]
+
+
+def start_server(albums: int, seed: int = 1, host: str = "127.0.0.1", port: int = 0, **options) -> StandInServer:
+    """Starts the stand-in on a background thread. port=0 picks a free port."""
+    server = StandInServer((host, port), Catalog(albums, seed), **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local Spotify / Tidal API stand-in.")
+    parser.add_argument("--albums", type=int, default=1000, help="Size of the synthetic library the catalog is built from")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Up to this many extra seconds, at random")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="Requests/sec per service before 429s (0 = unlimited)")
+    parser.add_argument("--burst", type=int, default=20)
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with 429s")
+    args = parser.parse_args()
+
+    server = StandInServer(
+        (args.host, args.port), Catalog(args.albums, args.seed),
+        latency=args.latency, jitter=args.jitter,
+        rate_limit=args.rate_limit, burst=args.burst, retry_after=args.retry_after,
+    )
+    print(f"Serving a {args.albums}-album catalog on {server.base_url} (Spotify /v1/, Tidal /tidal/v1/)")
+    server.serve_forever()
@@ -0,0 +1,3 @@
+"""
+Shared helpers for the numbered Spotify / Tidal scripts in the repo root.
+"""
@@ -0,0 +1,3 @@
+from music_sync.cli import main
+
+main()
@@ -0,0 +1,92 @@
+"""
+Artist name keys, so spelling variants share one search and one review row.
+
+"The Beatles", "Beatles, The" and "beatles" all get the key "beatles",
+"Beyoncé" and "Beyonce" both get "beyonce", and "Artist feat. X" gets the key
+for "Artist". Each key is searched once, with one canonical query (the most
+common spelling), and the result feeds every variant.
+
+The raw name -> key -> query mapping is saved to data/artist_index.csv. Existing
+rows are kept on later runs, so queries (and the cache and journal entries keyed
+on them) stay stable, and a query fixed by hand there sticks.
+"""
+
+import os
+import re
+import unicodedata
+from collections import Counter
+from typing import Iterable
+
+import pandas as pd
+
+ARTIST_INDEX_PATH = "data/artist_index.csv"
+
+_featuring = re.compile(r"\s*[(\[]?\s*\b(?:feat|ft|featuring)\b\.?\s.*$", re.IGNORECASE)
+_trailing_article = re.compile(r",\s*the$", re.IGNORECASE)
+_leading_article = re.compile(r"^the\s+", re.IGNORECASE)
+_dropped = re.compile(r"[.'’`]")
+_punctuation = re.compile(r"[^\w\s]")
+
+
+def display_name(name: str) -> str:
+    # "Beatles, The feat. X" -> "The Beatles": what we'd type into a search box
+    name = " ".join(str(name).split())
+    name = _featuring.sub("", name) or name
+    if _trailing_article.search(name):
+        name = "The " + _trailing_article.sub("", name)
+    return name
+
+
+def artist_key(name: str) -> str:
+    # Casefold, drop accents, features and "The", "&" -> "and", strip punctuation
+    name = display_name(name)
+    key = unicodedata.normalize("NFKD", name)
+    key = "".join(c for c in key if not unicodedata.combining(c))
+    key = key.casefold().replace("&", " and ")
+    key = _leading_article.sub("", key)
+    # "R.E.M." and "REM" are the same band, "AC/DC" is "ac dc"
+    key = _dropped.sub("", key)
+    key = _punctuation.sub(" ", key)
+    return " ".join(key.split()) or " ".join(name.casefold().split())
+
+
+def build_artist_index(names: Iterable[str], path: str = ARTIST_INDEX_PATH) -> pd.DataFrame:
+    """
+    One row per raw artist name: artist, artist_key, query. Loads and extends
+    the index at `path` (pass None to skip), then saves it back.
+    """
+    names = pd.Series(list(names), dtype="string").dropna()
+
+    existing = pd.DataFrame(columns=["artist", "artist_key", "query"])
+    if path and os.path.exists(path):
+        existing = pd.read_csv(path, dtype="string", keep_default_na=False)
+
+    new = pd.DataFrame({"artist": names[~names.isin(existing["artist"])].unique()})
+    new["artist_key"] = new["artist"].map(artist_key)
+
+    # Keys we've seen before keep their query. New keys use the most common
+    # spelling among their variants (Counter keeps first-seen order on ties).
+    queries = existing.drop_duplicates("artist_key").set_index("artist_key")["query"].to_dict()
+    counts = Counter(names.map(display_name))
+    for key, variants in new.groupby("artist_key", sort=False)["artist"]:
+        if key not in queries:
+            spellings = Counter({display_name(name): counts[display_name(name)] for name in variants})
+            queries[key] = spellings.most_common(1)[0][0]
+    new["query"] = new["artist_key"].map(queries)
+
+    index = pd.concat([existing, new], ignore_index=True)
+    if path and len(new):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        index.to_csv(path, index=False)
+
+    index = index[index["artist"].isin(names)].reset_index(drop=True)
+    print(f"{len(index)} artist names -> {index['artist_key'].nunique()} unique artists to search.")
+    return index
+
+
+def artist_queries(index: pd.DataFrame) -> pd.DataFrame:
+    """One row per key: artist (the query), artist_key, and the raw variants it covers."""
+    variants = index.groupby("artist_key", sort=False)["artist"].agg(lambda names: "; ".join(names))
+    queries = index.drop_duplicates("artist_key")[["artist_key", "query"]].rename(columns={"query": "artist"})
+    return queries.join(variants.rename("variants"), on="artist_key").reset_index(drop=True)[["artist", "artist_key", "variants"]]
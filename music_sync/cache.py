@@ -0,0 +1,200 @@
+"""
+On-disk cache for Spotify and Tidal catalog lookups.
+
+Re-running the match scripts after fixing one row in a CSV used to repeat every
+search and discography call. Responses are now stored as JSON in a local SQLite
+file, keyed by endpoint + normalized arguments, so a rerun only calls the API for
+lookups it hasn't seen before.
+
+Modes:
+    normal  - use fresh entries, call the API for missing or expired ones
+    misses  - use any cached entry regardless of age, only call the API for misses
+    refresh - always call the API and overwrite the cached entry
+    off     - bypass the cache entirely
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+DAY = 24 * 60 * 60
+
+# Time-to-live (in seconds) per endpoint. Search results and discographies
+# change slowly, so they can live a long time.
+DEFAULT_TTLS = {
+    "spotify.search": 30 * DAY,
+    "spotify.discography": 7 * DAY,
+    "spotify.album_search": 30 * DAY,
+    "tidal.search": 30 * DAY,
+    "tidal.discography": 7 * DAY,
+}
+DEFAULT_TTL = DAY
+
+MODES = ("normal", "misses", "refresh", "off")
+
+
+def normalize_arg(value: Any) -> Any:
+    # Collapse whitespace so "The  Beatles " and "The Beatles" share an entry.
+    # Case is left alone: Spotify IDs are case-sensitive.
+    if isinstance(value, str):
+        return " ".join(value.split())
+    if isinstance(value, (list, tuple)):
+        return [normalize_arg(v) for v in value]
+    if isinstance(value, dict):
+        return {k: normalize_arg(v) for k, v in value.items()}
+    return value
+
+
+def make_key(endpoint: str, args: Tuple = (), kwargs: Optional[Dict] = None) -> str:
+    kwargs = {k: v for k, v in (kwargs or {}).items() if v is not None}
+    payload = [normalize_arg(list(args)), normalize_arg(kwargs)]
+    return endpoint + ":" + json.dumps(payload, sort_keys=True, default=str)
+
+
+class ResponseCache:
+    def __init__(
+        self,
+        path: str = "data/api_cache.sqlite",
+        ttls: Optional[Dict[str, float]] = None,
+        max_entries: int = 200_000,
+        mode: str = "normal",
+    ):
+        if mode not in MODES:
+            raise ValueError(f"Unknown cache mode {mode!r}. Expected one of {', '.join(MODES)}")
+
+        self.path = path
+        self.ttls = {**DEFAULT_TTLS, **(ttls or {})}
+        self.max_entries = max_entries
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._writes_since_evict = 0
+        # key -> last hit, written out on eviction or close rather than per hit
+        self._accessed: Dict[str, float] = {}
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                endpoint TEXT NOT NULL,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+        self._conn.commit()
+
+    def ttl(self, endpoint: str) -> float:
+        return self.ttls.get(endpoint, DEFAULT_TTL)
+
+    def get(self, endpoint: str, *args, **kwargs) -> Tuple[bool, Any]:
+        """Returns (hit, value). Respects the mode and the endpoint's TTL."""
+        if self.mode in ("off", "refresh"):
+            return False, None
+
+        key = make_key(endpoint, args, kwargs)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return False, None
+
+            value, created_at = row
+            if self.mode == "normal" and time.time() - created_at > self.ttl(endpoint):
+                return False, None
+
+            self._accessed[key] = time.time()
+
+        return True, json.loads(value)
+
+    def peek(self, endpoint: str, *args, **kwargs) -> Any:
+        """The cached response whatever its age (None if there's none), e.g. to estimate what refetching it costs."""
+        if self.mode == "off":
+            return None
+
+        key = make_key(endpoint, args, kwargs)
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, endpoint: str, value: Any, *args, **kwargs):
+        if self.mode == "off":
+            return
+
+        key = make_key(endpoint, args, kwargs)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT INTO responses (key, endpoint, value, created_at, accessed_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET
+                    value = excluded.value,
+                    created_at = excluded.created_at,
+                    accessed_at = excluded.accessed_at
+                """,
+                (key, endpoint, json.dumps(value), now, now),
+            )
+            self._conn.commit()
+            self._accessed.pop(key, None)
+
+            # Evicting on every write would mean a COUNT(*) per call
+            self._writes_since_evict += 1
+            if self._writes_since_evict >= 100:
+                self._evict()
+
+    def fetch(self, endpoint: str, fn: Callable, *args, **kwargs) -> Any:
+        """Returns the cached response for fn(*args, **kwargs), calling fn on a miss."""
+        hit, value = self.get(endpoint, *args, **kwargs)
+        if hit:
+            self.hits += 1
+            return value
+
+        self.misses += 1
+        value = fn(*args, **kwargs)
+        self.set(endpoint, value, *args, **kwargs)
+        return value
+
+    def evict(self):
+        with self._lock:
+            self._evict()
+
+    def _flush_accessed(self):
+        # Hits only bump accessed_at in memory, so a read never waits on a write
+        if self._accessed:
+            self._conn.executemany("UPDATE responses SET accessed_at = ? WHERE key = ?", [(at, key) for key, at in self._accessed.items()])
+            self._conn.commit()
+            self._accessed.clear()
+
+    def _evict(self):
+        # Drop the least recently used entries once we're over the size limit
+        self._writes_since_evict = 0
+        self._flush_accessed()
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()
+        if count <= self.max_entries:
+            return
+
+        self._conn.execute(
+            """
+            DELETE FROM responses WHERE key IN (
+                SELECT key FROM responses ORDER BY accessed_at LIMIT ?
+            )
+            """,
+            (count - self.max_entries,),
+        )
+        self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._evict()
+            self._conn.close()
@@ -0,0 +1,148 @@
+"""
+The `music-sync` command: every pipeline stage as a subcommand.
+
+    music-sync scan
+    music-sync spotify match          # then review data/spotify_artist_matches.csv, data/albums_join.csv
+    music-sync spotify follow
+    music-sync spotify save
+    music-sync spotify playlist
+    music-sync tidal match
+    music-sync plan                   # then review data/plan.json
+    music-sync apply
+    music-sync status
+
+Nothing heavy is imported here: pandas, spotipy and tidalapi, and the logins,
+are only loaded by the stage that runs (see music_sync.context), so --help and
+status return instantly and the stages can run from cron.
+"""
+
+import argparse
+import importlib
+import sqlite3
+import sys
+from typing import List, Optional
+
+# Same as music_sync.store.STATE_PATH, which would import pandas
+STATE_PATH = "data/state.sqlite"
+
+AUDIT_HELP = "Re-read the whole library instead of just what was added since the last run"
+
+
+def status():
+    """Counts from the state store, read with plain sqlite3."""
+    try:
+        conn = sqlite3.connect(f"file:{STATE_PATH}?mode=ro", uri=True)
+        local = conn.execute("SELECT COUNT(*) FROM local_albums").fetchone()[0]
+    except sqlite3.Error:
+        print(f"No state in {STATE_PATH} yet; run `music-sync scan` first.")
+        return
+
+    print(f"Local albums: {local}")
+    for service in ("spotify", "tidal"):
+        artists, artists_matched = conn.execute(
+            "SELECT COUNT(*), COUNT(artist_id) FROM artist_matches WHERE service = ?", (service,)
+        ).fetchone()
+        albums_matched = conn.execute(
+            "SELECT COUNT(album_id) FROM album_matches WHERE service = ?", (service,)
+        ).fetchone()[0]
+        library = dict(conn.execute(
+            "SELECT kind, COUNT(*) FROM library WHERE service = ? GROUP BY kind", (service,)
+        ).fetchall())
+        try:
+            flagged = conn.execute(
+                "SELECT COUNT(*) FROM artist_matches WHERE service = ? AND needs_review = 1", (service,)
+            ).fetchone()[0]
+        except sqlite3.OperationalError:
+            # A state file from before the column was added (this connection is read-only)
+            flagged = 0
+        print(
+            f"{service.capitalize()}: {artists_matched} of {artists} artists matched ({flagged} to review), {albums_matched} of {local} albums matched; "
+            f"library has {library.get('artist', 0)} artists, {library.get('album', 0)} albums."
+        )
+    conn.close()
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="music-sync", description="Match a local album collection to Spotify and Tidal.")
+    parser.add_argument("--workers", type=int, help="Concurrent API calls (default: 8 for Spotify, 4 for Tidal)")
+    parser.add_argument("--no-resume", dest="resume", action="store_false", help="Start every stage over instead of resuming its journal")
+    parser.add_argument("--cache-mode", choices=["normal", "misses", "refresh", "off"], help="API response cache mode (default: CACHE_MODE or normal)")
+    commands = parser.add_subparsers(dest="command", required=True, metavar="command")
+
+    def stage(subparsers, name: str, handler: str, help: str) -> argparse.ArgumentParser:
+        # handler is "module:function", imported only when the command runs
+        command = subparsers.add_parser(name, help=help, description=help)
+        command.set_defaults(handler=handler)
+        return command
+
+    scan = stage(commands, "scan", "music_sync.commands.local:scan", "Scan the local music folder into the state store.")
+    scan.add_argument("--music-dir", help="Album folders named 'Artist - Album' (default: LOCAL_MUSIC_PATH)")
+    scan.add_argument("--full", action="store_true", help="Stat every folder even if the library folder looks untouched")
+
+    status_command = commands.add_parser("status", help="Show match and library counts from the state store.")
+    status_command.set_defaults(handler=None)
+
+    spotify = commands.add_parser("spotify", help="Spotify stages.").add_subparsers(dest="stage", required=True, metavar="stage")
+    match = stage(spotify, "match", "music_sync.commands.spotify:match", "Search artists, fetch their discographies and match the local albums.")
+    match.add_argument("--artists-only", action="store_true", help="Stop after the artist search, to review artist IDs first")
+    match.add_argument("--chunk-size", type=int, metavar="N", help="Stream N artists at a time through search, discography and matching, to bound memory on big libraries")
+    for command in (
+        stage(spotify, "follow", "music_sync.commands.spotify:follow", "Follow every matched artist not followed yet."),
+        stage(spotify, "save", "music_sync.commands.spotify:save", "Save every matched album not saved yet."),
+    ):
+        command.add_argument("--audit", action="store_true", help=AUDIT_HELP)
+    playlist = stage(spotify, "playlist", "music_sync.commands.spotify:playlist", "Sync every saved album's tracks into a playlist.")
+    playlist.add_argument("--name", default="My CDs", help="Playlist name (default: My CDs)")
+    playlist.add_argument("--preserve-order", action="store_true", help="Insert new tracks in album order instead of at the end")
+    playlist.add_argument("--shards", type=int, help='Split the tracks across "NAME 1".."NAME N" (default: as many as needed, 8k tracks each)')
+    stage(spotify, "multi", "music_sync.commands.spotify:multi", "Match, follow and save for every account in SPOTIFY_LIBRARIES.")
+
+    tidal = commands.add_parser("tidal", help="Tidal stages.").add_subparsers(dest="stage", required=True, metavar="stage")
+    match = stage(tidal, "match", "music_sync.commands.tidal:match", "Resolve albums by UPC / ISRC, then search and match the rest.")
+    match.add_argument("--artists-only", action="store_true", help="Stop after the artist search, to review artist IDs first")
+    match.add_argument("--chunk-size", type=int, metavar="N", help="Stream N artists at a time through search, discography and matching, to bound memory on big libraries")
+    for command in (
+        stage(tidal, "follow", "music_sync.commands.tidal:follow", "Favorite every matched artist not favorited yet."),
+        stage(tidal, "save", "music_sync.commands.tidal:save", "Favorite every matched album not favorited yet."),
+    ):
+        command.add_argument("--audit", action="store_true", help=AUDIT_HELP)
+
+    plan = stage(commands, "plan", "music_sync.commands.plan:plan", "Work out every follow, save, favorite and playlist album from the state store, into data/plan.json.")
+    plan.add_argument("--path", default="data/plan.json", help="Where to write the plan (default: data/plan.json)")
+    plan.add_argument("--playlist", default="My CDs", metavar="NAME", help="Playlist to plan (default: My CDs)")
+    plan.add_argument("--no-playlist", dest="playlist", action="store_const", const=None, help="Leave the playlist out of the plan")
+    apply = stage(commands, "apply", "music_sync.commands.plan:apply", "Send the writes in a plan, all at once, then sync its playlist.")
+    apply.add_argument("--path", default="data/plan.json", help="The plan to apply (default: data/plan.json)")
+    apply.add_argument("--preserve-order", action="store_true", help="Insert new playlist tracks in album order instead of at the end")
+    apply.add_argument("--shards", type=int, help='Split the playlist across "NAME 1".."NAME N" (default: as many as needed, 8k tracks each)')
+
+    return parser
+
+
+# Parser options that go to the Context rather than to the stage
+GLOBAL_OPTIONS = {"workers", "resume", "cache_mode", "command", "stage", "handler"}
+
+
+def main(argv: Optional[List[str]] = None):
+    args = build_parser().parse_args(argv)
+    if args.handler is None:
+        return status()
+
+    from music_sync.context import Context
+
+    module_name, function_name = args.handler.split(":")
+    stage = getattr(importlib.import_module(module_name), function_name)
+    options = {key: value for key, value in vars(args).items() if key not in GLOBAL_OPTIONS}
+
+    ctx = Context(workers=args.workers, resume=args.resume, cache_mode=args.cache_mode)
+    try:
+        stage(ctx, **options)
+    except KeyboardInterrupt:
+        # Journals make an interrupted stage safe to rerun
+        sys.exit(130)
+    finally:
+        ctx.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+"""
+The pipeline stages behind the `music-sync` command (and the numbered
+notebook scripts): local.py scans the library, spotify.py and tidal.py match,
+follow and save. Each stage takes a music_sync.context.Context.
+"""
@@ -0,0 +1,249 @@
+"""
+Steps the Spotify and Tidal stages share: picking the artists to search,
+recording search results, matching local albums against the stored catalog,
+and the CSV round trip for manual review.
+
+match_in_chunks() is the memory-bounded version of search -> discography ->
+match, for libraries too big to hold the whole catalog in memory.
+"""
+
+import os
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import pandas as pd
+
+from music_sync.artists import artist_queries, build_artist_index
+from music_sync.context import Context
+from music_sync.disambiguation import disambiguate
+from music_sync.journal import Journal
+from music_sync.matching import match_albums
+from music_sync.store import ID_DTYPES
+from music_sync.workers import chunker
+
+# The CSVs exported for manual review, per service and table
+REVIEW_CSVS = {
+    ("spotify", "artist_matches"): "data/spotify_artist_matches.csv",
+    ("spotify", "album_matches"): "data/albums_join.csv",
+    ("tidal", "artist_matches"): "data/tidal_artist_matches.csv",
+    ("tidal", "album_matches"): "data/albums_join_tidal.csv",
+}
+
+# Artists per chunk in match_in_chunks
+STREAM_CHUNK_SIZE = 500
+
+
+@contextmanager
+def reviewed(ctx: Context, service: str, table: str):
+    """
+    Loads the reviewed CSV for this table into the store (if there is one),
+    then exports the table again once the block is done. Every stage that
+    writes a reviewable table goes through this, so edits are never lost and
+    the CSV always shows the latest state.
+    """
+    path = REVIEW_CSVS[(service, table)]
+    if os.path.exists(path):
+        ctx.store.import_csv(table, path, service=service)
+    yield
+    if table == "album_matches":
+        ctx.store.export_csv(table, path, frame=ctx.store.album_join(service))
+    else:
+        ctx.store.export_csv(table, path, service=service)
+
+
+def artists_to_search(ctx: Context, service: str) -> pd.DataFrame:
+    """Artist keys from the local library that don't have an artist ID on this service yet."""
+    # Key the local artist names, so spelling variants ("Beatles, The", "beatles") share one search
+    index = build_artist_index(ctx.store.query("SELECT artist FROM local_albums")["artist"])
+    artists = artist_queries(index).sort_values("artist").reset_index(drop=True)
+
+    # Every key gets a row (without touching IDs already there), so the review CSV lists them all
+    ctx.store.upsert("artist_matches", artists, service=service)
+    known = ctx.store.table("artist_matches", service=service).dropna(subset=["artist_id"])["artist_key"]
+    return artists[~artists["artist_key"].isin(known)].reset_index(drop=True)
+
+
+def record_artist_matches(ctx: Context, service: str, artists: pd.DataFrame, results: List, candidates: slice = slice(None)):
+    """Stores the first search result as each artist's ID, and `candidates` of them for review."""
+    artists["artist_id"] = pd.Series(dtype=ID_DTYPES[service], index=artists.index)
+    artists["artist_candidates"] = pd.Series(dtype="string", index=artists.index)
+
+    # Results come back in the same order as the artists
+    for i, matches in enumerate(results):
+        artist = artists.iloc[i]["artist"]
+        if matches is None:
+            print(f"Retrieved artist {artist}: Failed, rerun to retry.")
+        elif len(matches) > 0:
+            # Default the artist_id to the first match
+            print(f"Retrieved artist {artist}: found. First match: {matches[0]['name']}")
+            artists.at[i, "artist_id"] = matches[0]["id"]
+            artists.at[i, "artist_candidates"] = "; ".join(f"{match['name']} ({match['id']})" for match in matches[candidates])
+        else:
+            print(f"Retrieved artist {artist}: Not found.")
+
+    ctx.store.upsert("artist_matches", artists, service=service)
+
+
+def disambiguate_artists(
+    ctx: Context,
+    service: str,
+    artists: pd.DataFrame,
+    results: List,
+    discography: Callable[[object, str, List[str]], List[Dict]],
+    workers: int,
+):
+    """
+    Swaps each artist's first search result for the candidate whose
+    discography has the most of our albums by them (see disambiguation.py), and
+    flags the doubtful picks with needs_review in the artist review CSV.
+    discography(artist_id, artist name, local titles) returns the artist's albums.
+    """
+    if len(artists) == 0:
+        return
+    titles = ctx.store.local_titles(artists["artist_key"])
+    picks = disambiguate(
+        [titles.get(key, []) for key in artists["artist_key"]],
+        results,
+        lambda result, titles: [album["name"] for album in discography(result["id"], result["name"], titles)],
+        workers=workers,
+    )
+
+    rows = [{"artist_key": key, **pick} for key, pick in zip(artists["artist_key"], picks) if pick]
+    ctx.store.upsert("artist_matches", rows, service=service)
+    changed = sum(1 for matches, pick in zip(results, picks) if pick and pick["artist_id"] != matches[0]["id"])
+    flagged = sum(row["needs_review"] for row in rows)
+    print(f"Checked {len(rows)} artists against their discographies: {changed} changed from the first search result, {flagged} flagged for review.")
+
+
+def unmatched_artist_ids(ctx: Context, service: str) -> List:
+    """Artists that still have local albums without an album ID; only their discographies are needed."""
+    return ctx.store.albums_for_matching(service, unmatched_only=True)["artist_id"].dropna().unique().tolist()
+
+
+def wanted_titles(albums: pd.DataFrame) -> Dict[object, Tuple[str, List[str]]]:
+    """artist_id -> (local artist name, local album titles), from albums with artist_id, artist and album."""
+    albums = albums.dropna(subset=["artist_id"])
+    return {
+        artist_id: (group["artist"].iloc[0], group["album"].astype(str).tolist())
+        for artist_id, group in albums.groupby("artist_id", sort=False)
+    }
+
+
+def match_local_albums(ctx: Context, service: str) -> pd.DataFrame:
+    """
+    Fuzzy matches local albums without an album ID against the stored catalog,
+    by artist ID, and fills in the album IDs. Returns the full album join.
+    """
+    albums = ctx.store.albums_for_matching(service, unmatched_only=True)
+    if len(albums) > 0:
+        catalog = ctx.store.catalog_names(service)
+
+        # album_match_candidates keeps the runners-up with their scores, for manual review
+        journal = Journal(f"{service}_match", reset=not ctx.resume)
+        albums = match_albums(albums, catalog, artist_col="artist_id", journal=journal)
+        ctx.store.upsert("album_matches", albums.drop(columns=["artist", "album"]), service=service)
+        journal.finish()
+
+    # When the same name appears more than once (re-releases and such), this takes the first
+    ctx.store.resolve_album_ids(service)
+    return ctx.store.album_join(service)
+
+
+def match_in_chunks(
+    ctx: Context,
+    service: str,
+    search: Callable[[str], List[Dict]],
+    discography: Callable[[object, str, List[str]], List[Dict]],
+    workers: int,
+    chunk_size: int = STREAM_CHUNK_SIZE,
+    candidates: slice = slice(None),
+) -> pd.DataFrame:
+    """
+    Search, discography fetch and album matching, chunk_size artists at a
+    time: each chunk's discographies go straight into the store and are read
+    back (artist_id and name only) to match that chunk's albums, so memory
+    depends on the chunk size rather than the size of the library or catalog.
+
+    Only artists with unmatched local albums are processed, and progress is
+    kept in the store and the journals, so an interrupted run picks up where it
+    stopped. Returns the full album join.
+    """
+    with reviewed(ctx, service, "artist_matches"), reviewed(ctx, service, "album_matches"):
+        # Artist keys without an ID yet; just the names, so small next to the catalog
+        to_search = artists_to_search(ctx, service).set_index("artist_key")
+        keys = ctx.store.unmatched_artist_keys(service)
+
+        search_journal = Journal(f"{service}_artist_search", reset=not ctx.resume)
+        # Discographies are in the store once fetched, so only their sizes are journaled
+        catalog_journal = Journal(f"{service}_catalog", reset=not ctx.resume)
+
+        wanted: Dict = {}
+
+        def fetch(artist_id) -> int:
+            albums = pd.DataFrame(discography(artist_id, *wanted[artist_id]), columns=["artist_id", "album_id", "name"])
+            ctx.store.upsert("catalog_albums", albums, service=service)
+            return len(albums)
+
+        matched = 0
+        chunks = list(chunker(keys, chunk_size))
+        for n, chunk in enumerate(chunks, start=1):
+            artists = to_search[to_search.index.isin(chunk)].reset_index()
+            if len(artists) > 0:
+                results = search_journal.run(artists["artist"], search, workers=workers)
+                record_artist_matches(ctx, service, artists, results, candidates=candidates)
+                disambiguate_artists(ctx, service, artists, results, discography, workers=workers)
+
+            albums = ctx.store.albums_for_matching(service, unmatched_only=True, artist_keys=chunk)
+            wanted = wanted_titles(albums)
+            artist_ids = list(wanted)
+            catalog_journal.run(artist_ids, fetch, workers=workers)
+
+            albums = match_albums(albums, ctx.store.catalog_names(service, artist_ids), artist_col="artist_id")
+            ctx.store.upsert("album_matches", albums.drop(columns=["artist", "album"]), service=service)
+            matched += ctx.store.resolve_album_ids(service)
+            print(f"Chunk {n} of {len(chunks)}: {len(chunk)} artists, {len(albums)} albums; {matched} matched so far.")
+
+        search_journal.finish()
+        catalog_journal.finish()
+
+    return ctx.store.album_join(service)
+
+
+def refresh_library(ctx: Context, service: str, kind: str, fetch: Callable[[Optional[set]], List[Dict]], audit: bool = False) -> set:
+    """
+    Brings the stored snapshot of followed artists / saved albums up to date
+    and returns its IDs. fetch(None) reads the whole library; fetch(known)
+    reads newest first and stops at the first known ID, so only what was added
+    since the last refresh is downloaded. The first run, or an audit, reads
+    everything and replaces the snapshot; in between, items removed on the
+    service's side stay in the snapshot until the next audit.
+    """
+    if audit or not ctx.store.library_ids(service, kind):
+        ctx.store.replace_library(service, kind, fetch(None))
+    else:
+        # Only stop at items we've seen in a listing: a write of ours is newer
+        # than anything added on the service's side before it
+        before = ctx.store.library_ids(service, kind)
+        items = fetch(ctx.store.library_ids(service, kind, listed=True))
+        ctx.store.update_library(service, kind, items)
+        added = len({item["id"] for item in items} - before)
+        print(f"Read {len(items)} {kind}s from {service}: {added} added there since the last refresh.")
+    return ctx.store.library_ids(service, kind)
+
+
+def new_ids(ctx: Context, service: str, kind: str, wanted: Iterable, fetch: Callable[[Optional[set]], List[Dict]], audit: bool = False) -> List:
+    """Refreshes the stored library snapshot, and returns the wanted IDs not in it."""
+    return sorted(set(wanted) - refresh_library(ctx, service, kind, fetch, audit=audit))
+
+
+def record_written(ctx: Context, service: str, kind: str, journal: Journal, ids: List, items: Optional[Dict] = None):
+    """
+    Adds the IDs the journal has as written to the stored library snapshot,
+    with the name and artist_id `items` ({id: {"name", "artist_id"}}) has for them.
+    """
+    written = [item_id for item_id in ids if journal.done(item_id)]
+    if items is None:
+        rows = [{"item_id": item_id} for item_id in written]
+    else:
+        rows = [{"item_id": item_id, "name": items.get(item_id, {}).get("name"), "artist_id": items.get(item_id, {}).get("artist_id")} for item_id in written]
+    ctx.store.upsert("library", rows, service=service, kind=kind)
@@ -0,0 +1,44 @@
+"""
+Local library stage (what script 1 used to do inline): parse the album
+folders, which are organized like /Artist - Album/01 - Track.mp3, into
+data/albums.csv and the local_albums table the later stages join against.
+"""
+
+import os
+from typing import Optional, Tuple
+
+import pandas as pd
+
+from music_sync.artists import artist_key
+from music_sync.context import Context
+from music_sync.scanner import scan_library
+
+ALBUMS_CSV = "data/albums.csv"
+CHANGES_CSV = "data/albums_changes.csv"
+
+
+def scan(ctx: Context, music_dir: Optional[str] = None, full: bool = False) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Scans the music folder (LOCAL_MUSIC_PATH by default). The manifest from the
+    last run means folders are only stat'ed when the library folder changed,
+    and only the folders the store doesn't have yet (added or renamed ones) are
+    written to it, unless `full` is set. Returns (albums, changes).
+    """
+    music_dir = music_dir or os.environ["LOCAL_MUSIC_PATH"]
+    albums, changes = scan_library(music_dir, full=full)
+
+    # Save "Albums" csv, plus just the changes so later steps can work on deltas
+    albums.to_csv(ALBUMS_CSV, index=False)
+    changes.to_csv(CHANGES_CSV, index=False)
+
+    # Against the store rather than the manifest's changes, so a store that
+    # missed a scan (or is new) catches up: drop folders that are gone (removed,
+    # or the old names of renamed ones) and add the ones it doesn't have
+    stored = set(ctx.store.query("SELECT folder FROM local_albums")["folder"])
+    for folder in stored - set(albums["folder"]):
+        ctx.store.delete("local_albums", folder=folder)
+    new = albums if full else albums[~albums["folder"].isin(stored)]
+    ctx.store.upsert("local_albums", new.assign(artist_key=new["artist"].map(artist_key)))
+
+    print(f"{len(albums)} local albums, {len(changes)} changed since the last scan.")
+    return albums, changes
@@ -0,0 +1,157 @@
+"""
+Plan / apply: every library write worked out offline, reviewed, then sent in
+one burst.
+
+The follow and save stages each refresh the library from the service, take
+the difference and write it, one stage and one service at a time. plan()
+computes the same differences for every stage at once (Spotify follows and
+saves, Tidal favorite artists and albums, and the albums in the playlist)
+from the state store alone: the matches, and the library snapshot the last
+follow / save left (run one with --audit first if the library was changed in
+the apps). No API calls, so it's cheap to rerun and review. The result goes
+to data/plan.json.
+
+apply() sends the plan: every write group at once, each in the largest batch
+its endpoint takes and with as many workers as the service's limiter allows
+(Spotify and Tidal have separate limits, so they don't slow each other down),
+through the same journals as the stages, so a rerun only sends what's
+missing. The groups share one Metrics, so their requests are exported
+together, as the apply_writes stage, once they've all finished. Then it
+syncs the playlist, which always diffs against the live playlist (see
+music_sync.playlist).
+"""
+
+import json
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+from music_sync.commands import spotify, tidal
+from music_sync.commands.common import reviewed
+from music_sync.context import Context
+from music_sync.workers import map_concurrent
+
+PLAN_PATH = "data/plan.json"
+
+# (service, write) -> library kind
+WRITES = {
+    ("spotify", "follow"): "artist",
+    ("spotify", "save"): "album",
+    ("tidal", "follow"): "artist",
+    ("tidal", "save"): "album",
+}
+
+
+def _items(frame: pd.DataFrame, id_col: str, name_col: str, extra: tuple = ()) -> List[Dict]:
+    # JSON-ready {"id", "name", ...}: Python scalars, None for missing
+    frame = frame[[id_col, name_col, *extra]].rename(columns={id_col: "id", name_col: "name"}).astype(object)
+    return frame.where(frame.notna(), None).to_dict("records")
+
+
+def _wanted(ctx: Context, service: str) -> Dict[str, pd.DataFrame]:
+    with reviewed(ctx, service, "artist_matches"), reviewed(ctx, service, "album_matches"):
+        artists = ctx.store.table("artist_matches", service=service).dropna(subset=["artist_id"])
+        albums = ctx.store.album_join(service).dropna(subset=["album_id"])
+    albums["name"] = albums["name"].fillna(albums["album"])
+    return {
+        "follow": artists.drop_duplicates("artist_id").sort_values("artist_id"),
+        "save": albums.drop_duplicates("album_id").sort_values("album_id"),
+    }
+
+
+def plan(ctx: Context, path: str = PLAN_PATH, playlist: Optional[str] = spotify.PLAYLIST_NAME) -> Dict:
+    """
+    Writes the plan to `path` and returns it: per service, the artists to
+    follow and albums to save ({"id", "name"}), and the playlist's albums
+    ({"id", "name", "artist_id"}, newest first). `playlist` None leaves it out.
+    """
+    result = {"created_at": datetime.now(timezone.utc).isoformat(timespec="seconds")}
+    new_saves = None
+    for service in ("spotify", "tidal"):
+        result[service] = {}
+        for write, frame in _wanted(ctx, service).items():
+            kind = WRITES[(service, write)]
+            known = ctx.store.library_ids(service, kind)
+            if not known and len(frame) > 0:
+                print(f"No {service} {kind} snapshot yet, so every matched {kind} is planned (writing one that's already there is harmless).")
+            id_col, name_col = ("artist_id", "artist") if write == "follow" else ("album_id", "name")
+            todo = frame[~frame[id_col].isin(known)]
+            result[service][write] = _items(todo, id_col, name_col, ("artist_id",) if write == "save" else ())
+            if (service, write) == ("spotify", "save"):
+                new_saves = todo
+
+    if playlist is not None:
+        # The saved albums once the plan is applied; the new saves will be the newest
+        albums: Dict = {}
+        saved = ctx.store.library_albums("spotify")
+        for album in _items(new_saves, "album_id", "name", ("artist_id",)) + _items(saved, "item_id", "name", ("artist_id",)):
+            albums.setdefault(album["id"], album)
+        result["spotify"]["playlist"] = {"name": playlist, "albums": list(albums.values())}
+
+    with open(path, "w") as f:
+        json.dump(result, f, indent=1, default=int)
+
+    for service in ("spotify", "tidal"):
+        counts = ", ".join(f"{len(result[service][write])} to {write}" for write in ("follow", "save"))
+        print(f"{service.capitalize()}: {counts}.")
+    if playlist is not None:
+        print(f"Playlist {playlist}: {len(result['spotify']['playlist']['albums'])} albums.")
+    print(f"Plan written to {path}; review it, then run `music-sync apply`.")
+    return result
+
+
+def apply(ctx: Context, path: str = PLAN_PATH, preserve_order: bool = False, shards: Optional[int] = None) -> Dict:
+    """
+    Sends the plan at `path`: all follows, saves and favorites concurrently,
+    then the playlist sync. Returns the number written per write group.
+    """
+    with open(path) as f:
+        planned = json.load(f)
+    print(f"Applying the plan from {planned['created_at']}.")
+
+    writers = {
+        ("spotify", "follow"): lambda items: spotify.write_follows(ctx, [item["id"] for item in items], export=False),
+        ("spotify", "save"): lambda items: spotify.write_saves(ctx, [item["id"] for item in items], export=False, albums=_by_id(items)),
+        ("tidal", "follow"): lambda items: tidal.write_favorites(ctx, "artist", [item["id"] for item in items], _names(items), export=False),
+        ("tidal", "save"): lambda items: tidal.write_favorites(ctx, "album", [item["id"] for item in items], _names(items), export=False),
+    }
+    groups = [(key, planned[key[0]][key[1]]) for key in writers if planned.get(key[0], {}).get(key[1])]
+
+    # Create everything the groups share up front, on this thread: the store,
+    # metrics and clients are created on first use, and cached_property has no
+    # lock, so threads racing to it could each make their own
+    services = {service for (service, _), _ in groups} | ({"spotify"} if planned["spotify"].get("playlist") else set())
+    for name in ("store", "metrics", *sorted(services)):
+        getattr(ctx, name)
+
+    results = map_concurrent(lambda group: writers[group[0]](group[1]), groups, workers=len(groups) or 1, return_exceptions=True)
+    ctx.metrics.export("apply_writes")
+    written = {}
+    failed = []
+    for ((service, write), items), result in zip(groups, results):
+        if isinstance(result, Exception):
+            print(f"{service} {write} failed: {result}")
+            failed.append(f"{service} {write}")
+        else:
+            written[f"{service}_{write}"] = result
+            print(f"{service.capitalize()} {write}: {result} of {len(items)} written.")
+
+    playlist = planned["spotify"].get("playlist")
+    if playlist:
+        # Only albums that are saved now, in case some of the planned saves failed
+        saved = ctx.store.library_ids("spotify", "album")
+        albums = [album for album in playlist["albums"] if album["id"] in saved]
+        spotify.sync_albums_playlist(ctx, albums, playlist["name"], preserve_order=preserve_order, shards=shards)
+
+    if failed:
+        raise RuntimeError(f"Failed: {', '.join(failed)}; rerun `music-sync apply` to retry what's missing.")
+    return written
+
+
+def _names(items: List[Dict]) -> Dict:
+    return {item["id"]: item["name"] for item in items}
+
+
+def _by_id(items: List[Dict]) -> Dict:
+    return {item["id"]: item for item in items}
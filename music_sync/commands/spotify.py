@@ -0,0 +1,284 @@
+"""
+Spotify stages (what scripts 2 and 3 used to do inline): search the local
+artists, follow them, fetch their discographies, match the local albums, save
+them, and sync the "My CDs" playlists from the saved albums.
+
+Artist IDs and album IDs land in the state store and are exported for review
+(see common.REVIEW_CSVS); edits to those CSVs are picked up by the next stage that runs.
+"""
+
+import os
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+from music_sync.commands.common import (
+    artists_to_search,
+    disambiguate_artists,
+    match_in_chunks,
+    match_local_albums,
+    new_ids,
+    record_artist_matches,
+    record_written,
+    reviewed,
+    wanted_titles,
+)
+from music_sync.context import Context
+from music_sync.editions import collapse_editions
+from music_sync.journal import Journal
+from music_sync.lookup import search_key
+from music_sync.multi import sync_libraries
+from music_sync.playlist import sync_sharded
+
+SERVICE = "spotify"
+CATALOG_CSV = "data/spotify_album_matches.csv"
+
+# Most IDs the follow and save endpoints accept per call
+WRITE_BATCH_SIZE = 50
+
+PLAYLIST_NAME = "My CDs"
+
+
+def search_artists(ctx: Context):
+    """
+    Searches every local artist that doesn't have a Spotify ID yet (keeping the
+    top 3 matches), and picks the one whose discography has our albums.
+    """
+    with reviewed(ctx, SERVICE, "artist_matches"):
+        artists = artists_to_search(ctx, SERVICE)
+        journal = Journal("spotify_artist_search", reset=not ctx.resume)
+        results = journal.run(artists["artist"], ctx.spotify.search_artist, workers=ctx.spotify_workers)
+        record_artist_matches(ctx, SERVICE, artists, results)
+        disambiguate_artists(ctx, SERVICE, artists, results, lambda *artist: get_artist_albums(ctx, *artist), workers=ctx.spotify_workers)
+    journal.finish()
+    ctx.metrics.export("spotify_artist_search")
+
+
+def get_artist_albums(ctx: Context, artist_id: str, artist: Optional[str] = None, titles: Optional[List[str]] = None) -> List[Dict]:
+    # Full discography, across as many pages as it takes, or a search for just
+    # our titles (by artist) when that takes fewer calls (see music_sync.lookup)
+    items = ctx.spotify_lookup.albums(artist_id, artist, titles)
+
+    # One edition per album: remasters and deluxe editions of it are left out
+    albums = [{
+            "artist_id": artist_id,
+            "album_id": item["id"],
+            "name": item["name"],
+            "url": item["url"]
+        } for item in collapse_editions(items, ctx.edition_rules)]
+
+    if len(albums) > 0:
+        print(f"Retrieved albums for {artist_id}: {len(albums)} records. Samples: {', '.join([item['name'] for item in albums[0:3]])}")
+    else:
+        print(f"Retrieved albums for {artist_id}: None found.")
+
+    return albums
+
+
+def fetch_catalog(ctx: Context) -> pd.DataFrame:
+    """Albums of the artists that still have unmatched local albums (their discographies, or searched for)."""
+    wanted = wanted_titles(ctx.store.albums_for_matching(SERVICE, unmatched_only=True))
+    searched = {
+        search_key(artist_id, titles): artist_id
+        for artist_id, (artist, titles) in wanted.items()
+        if ctx.spotify_lookup.strategy(artist_id, artist, titles) == "album_search"
+    }
+    searched_ids = set(searched.values())
+    discographies = [artist_id for artist_id in wanted if artist_id not in searched_ids]
+    print(f"Retrieving albums for {len(wanted)} artists ({len(searched)} by album search)...")
+
+    # Only whole discographies are journaled by artist ID (multi.py reads the
+    # same journal); search results cover just the titles they were for
+    journal = Journal("spotify_discography", reset=not ctx.resume)
+    results = journal.run(discographies, lambda artist_id: get_artist_albums(ctx, artist_id), workers=ctx.spotify_workers)
+    search_journal = Journal("spotify_album_search", reset=not ctx.resume)
+    results += search_journal.run(
+        list(searched), lambda key: get_artist_albums(ctx, searched[key], *wanted[searched[key]]), workers=ctx.spotify_workers,
+    )
+    catalog = pd.DataFrame([album for albums in results if albums for album in albums], columns=["artist_id", "album_id", "name", "url"])
+
+    ctx.store.upsert("catalog_albums", catalog, service=SERVICE)
+    catalog.to_csv(CATALOG_CSV, index=False)
+    journal.finish()
+    search_journal.finish()
+    ctx.metrics.export("spotify_discography")
+    return catalog
+
+
+def match_albums(ctx: Context) -> pd.DataFrame:
+    """Fuzzy matches the local albums against the fetched discographies."""
+    with reviewed(ctx, SERVICE, "album_matches"):
+        album_join = match_local_albums(ctx, SERVICE)
+    matched = album_join["album_id"].notna().sum()
+    print(f"Matched {matched} of {len(album_join)} local albums; review {SERVICE} matches in data/albums_join.csv.")
+    return album_join
+
+
+def match(ctx: Context, artists_only: bool = False, chunk_size: Optional[int] = None):
+    """
+    With a chunk_size, artists stream through search, discography and matching
+    that many at a time (see common.match_in_chunks), and no catalog CSV is written.
+    """
+    if chunk_size and not artists_only:
+        match_in_chunks(ctx, SERVICE, ctx.spotify.search_artist, lambda *artist: get_artist_albums(ctx, *artist), workers=ctx.spotify_workers, chunk_size=chunk_size)
+        ctx.metrics.export("spotify_match_in_chunks")
+    else:
+        search_artists(ctx)
+        if artists_only:
+            return
+        fetch_catalog(ctx)
+        match_albums(ctx)
+    if ctx.spotify_lookup.strategies:
+        print(ctx.spotify_lookup.report())
+
+
+def _followed_artists(ctx: Context, known) -> List[Dict]:
+    # Followed artists are listed by ID, not by when they were followed, so
+    # there's no reading just the new ones. Between audits the snapshot (kept
+    # up to date with our own follows) stands in; following an artist that was
+    # followed elsewhere again is harmless.
+    return ctx.spotify.followed_artists() if known is None else []
+
+
+def follow(ctx: Context, audit: bool = False) -> int:
+    """Follows every matched artist that isn't followed yet. audit re-reads every followed artist first."""
+    with reviewed(ctx, SERVICE, "artist_matches"):
+        artists = ctx.store.table("artist_matches", service=SERVICE)
+    new_follows = new_ids(ctx, SERVICE, "artist", artists["artist_id"].dropna(), lambda known: _followed_artists(ctx, known), audit=audit)
+    return write_follows(ctx, new_follows, audit=audit)
+
+
+def write_follows(ctx: Context, ids: List[str], audit: bool = False, export: bool = True) -> int:
+    """
+    Follows these artists, WRITE_BATCH_SIZE per call, and adds them to the
+    library snapshot. audit means an audit found them missing, so they're sent
+    even if the journal has them as written. export=False leaves the metrics
+    to the caller, for when other stages are recording at the same time.
+    """
+    def follow_artists(batch: List[str]):
+        print(f"Following {len(batch)} artists.")
+        ctx.spotify.call(ctx.spotify.sp.user_follow_artists, batch)
+
+    journal = Journal("spotify_follow", reset=not ctx.resume)
+    if audit:
+        journal.forget(ids)
+    written = journal.run_writes(ids, follow_artists, batch_size=WRITE_BATCH_SIZE, workers=ctx.spotify_workers)
+    record_written(ctx, SERVICE, "artist", journal, ids)
+    journal.finish()
+    if export:
+        ctx.metrics.export("spotify_follow")
+    return written
+
+
+def save(ctx: Context, audit: bool = False) -> int:
+    """
+    Saves every matched album that isn't saved yet. Only the albums saved since
+    the last run are read from Spotify; audit re-reads the whole library.
+    """
+    with reviewed(ctx, SERVICE, "album_matches"):
+        albums = ctx.store.album_join(SERVICE)
+    new_albums = new_ids(ctx, SERVICE, "album", albums["album_id"].dropna(), ctx.spotify.saved_albums, audit=audit)
+    matched = albums.dropna(subset=["album_id"]).drop_duplicates("album_id").set_index("album_id")
+    return write_saves(ctx, new_albums, audit=audit, albums=matched[["name", "artist_id"]].to_dict("index"))
+
+
+def write_saves(ctx: Context, ids: List[str], audit: bool = False, export: bool = True, albums: Optional[Dict] = None) -> int:
+    """
+    Saves these albums, WRITE_BATCH_SIZE per call, and adds them to the
+    library snapshot, with their name and artist_id from `albums` ({id:
+    {"name", "artist_id"}}). audit and export as in write_follows.
+    """
+    def save_albums(batch: List[str]):
+        print(f"Saving {len(batch)} albums.")
+        ctx.spotify.call(ctx.spotify.sp.current_user_saved_albums_add, batch)
+
+    journal = Journal("spotify_save", reset=not ctx.resume)
+    if audit:
+        journal.forget(ids)
+    written = journal.run_writes(ids, save_albums, batch_size=WRITE_BATCH_SIZE, workers=ctx.spotify_workers)
+    record_written(ctx, SERVICE, "album", journal, ids, items=albums)
+    journal.finish()
+    if export:
+        ctx.metrics.export("spotify_save")
+    return written
+
+
+def playlist(ctx: Context, name: str = PLAYLIST_NAME, preserve_order: bool = False, shards: Optional[int] = None) -> Dict:
+    """
+    Syncs every track of every saved album into the playlist, only adding the
+    new tracks and removing the ones that are gone. preserve_order inserts new
+    tracks in album order instead of at the end. Past 10k tracks the albums are
+    split across "{name} 1".."{name} N" (see playlist.sync_sharded); `shards`
+    fixes N instead of sizing it from the collection. Of several saved editions
+    of one album, only the one EDITION_RULES prefers is included.
+    """
+    return sync_albums_playlist(ctx, ctx.spotify.saved_albums(), name, preserve_order=preserve_order, shards=shards)
+
+
+def _edition_known(album: Dict) -> bool:
+    return pd.notna(album.get("artist_id")) and pd.notna(album.get("name"))
+
+
+def sync_albums_playlist(
+    ctx: Context, saved: List[Dict], name: str = PLAYLIST_NAME, preserve_order: bool = False, shards: Optional[int] = None,
+) -> Dict:
+    """Syncs the tracks of these albums ({"id", "name", "artist_id"}, in playlist order) into the playlist."""
+    spotify = ctx.spotify
+
+    # When more than one edition of an album is saved, only the preferred one's
+    # tracks go in. Editions are told apart by artist and title, so an album
+    # missing either is kept as is rather than merged with an unrelated one.
+    preferred = {album["id"] for album in collapse_editions([album for album in saved if _edition_known(album)], ctx.edition_rules)}
+    albums = [album for album in saved if album["id"] in preferred or not _edition_known(album)]
+    if len(albums) < len(saved):
+        print(f"Skipping {len(saved) - len(albums)} saved albums that are other editions of saved albums.")
+
+    # All track IDs across all albums, 20 albums per request
+    album_tracks = spotify.tracks_for_albums([album["id"] for album in albums], workers=ctx.spotify_workers)
+    ctx.metrics.export("spotify_album_tracks")
+
+    # Keep album order, so the playlist order is unchanged
+    tracks = [(album["id"], [item["id"] for item in album_tracks.get(album["id"], [])]) for album in albums]
+
+    # Every write batch is journaled to data/journal/spotify_playlist.jsonl
+    journal = Journal("spotify_playlist", reset=not ctx.resume)
+    summary = sync_sharded(
+        spotify, name, tracks, shards=shards, preserve_order=preserve_order, journal=journal, workers=ctx.spotify_workers,
+    )
+    print(f"Synced {len(summary['shards'])} playlists: added {summary['added']}, removed {summary['removed']} in {summary['calls']} calls.")
+    journal.finish()
+    ctx.metrics.export("spotify_playlist")
+    return summary
+
+
+def _libraries(text: Optional[str]) -> Dict[str, str]:
+    # "alice=data/alice/albums.csv,bob=..." -> {"alice": "data/alice/albums.csv", ...}
+    usage = "Expected username=path/to/albums.csv, comma separated, e.g. SPOTIFY_LIBRARIES=alice=data/alice/albums.csv,bob=data/bob/albums.csv"
+    libraries = {}
+    for entry in (text or "").split(","):
+        if not entry.strip():
+            continue
+        username, _, path = (part.strip() for part in entry.partition("="))
+        if not username or not path:
+            raise SystemExit(f"Can't read {entry.strip()!r} in SPOTIFY_LIBRARIES. {usage}")
+        libraries[username] = path
+    if not libraries:
+        raise SystemExit(f"SPOTIFY_LIBRARIES isn't set in .env. {usage}")
+    return libraries
+
+
+def multi(ctx: Context) -> pd.DataFrame:
+    """
+    The match/follow/save pipeline for every account in SPOTIFY_LIBRARIES
+    (username=path to that user's albums.csv, comma separated). Spotify's rate
+    limit is per app, not per user, so every account shares one limiter.
+    """
+    libraries = _libraries(os.environ.get("SPOTIFY_LIBRARIES"))
+    clients = {username: ctx.spotify_for(username) for username in libraries}
+
+    albums = sync_libraries(clients, libraries, workers=ctx.spotify_workers, resume=ctx.resume, rules=ctx.edition_rules)
+    ctx.metrics.export("spotify_multi_library")
+
+    # Save the results, for manual review
+    albums.to_csv("data/albums_join_multi.csv", index=False)
+    return albums
@@ -0,0 +1,216 @@
+"""
+Tidal stages (what script 4 used to do inline). Albums already matched on
+Spotify are resolved by UPC / ISRC first; only the rest go through artist
+search, discography fetch and fuzzy matching. Then the artists and albums are
+added to Tidal favorites.
+"""
+
+import os
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+from music_sync.commands.common import (
+    artists_to_search,
+    disambiguate_artists,
+    match_in_chunks,
+    match_local_albums,
+    new_ids,
+    record_artist_matches,
+    record_written,
+    reviewed,
+    unmatched_artist_ids,
+)
+from music_sync.context import Context
+from music_sync.editions import collapse_editions
+from music_sync.identifiers import resolve_tidal_albums
+from music_sync.journal import Journal
+from music_sync.tidal import FAVORITES_BATCH_SIZE, failures
+
+SERVICE = "tidal"
+CATALOG_CSV = "data/tidal_album_matches.csv"
+
+
+def resolve_identifiers(ctx: Context) -> pd.DataFrame:
+    """
+    Looks up every album matched on Spotify by barcode (or its first track's
+    ISRC) and stores the Tidal album and artist IDs, with no search,
+    discography or review. Needs SPOTIFY_USERNAME, and Spotify matches from
+    the Spotify stages.
+    """
+    spotify_albums = ctx.store.album_join("spotify").dropna(subset=["album_id"])
+    if len(spotify_albums) == 0 or not os.environ.get("SPOTIFY_USERNAME"):
+        print("No Spotify album matches (or SPOTIFY_USERNAME) to resolve by UPC / ISRC; matching every album by name.")
+        return pd.DataFrame(columns=["folder", "artist_id", "album_id"])
+
+    with reviewed(ctx, SERVICE, "artist_matches"), reviewed(ctx, SERVICE, "album_matches"):
+        # Only the albums that don't have a Tidal ID yet
+        done = set(ctx.store.table("album_matches", service=SERVICE).dropna(subset=["album_id"])["folder"])
+        spotify_albums = spotify_albums[~spotify_albums["folder"].isin(done)]
+
+        resolved = resolve_tidal_albums(ctx.spotify, ctx.tidal, spotify_albums, workers=ctx.tidal_workers).dropna(subset=["artist_id"])
+        resolved["url"] = "https://tidal.com/browse/album/" + resolved["album_id"].astype(str)
+        ctx.store.upsert("catalog_albums", resolved, service=SERVICE)
+        ctx.store.upsert(
+            "album_matches",
+            resolved.assign(album_name_best_match=resolved["name"], album_match_score=1.0),
+            service=SERVICE,
+        )
+
+        # Resolved albums also tell us their artists' Tidal IDs. Only for artists
+        # without one yet, or whose pick was flagged for review: an ID that's
+        # set and not flagged may be a hand correction, so it stays.
+        artist_keys = ctx.store.table("local_albums").set_index("folder")["artist_key"]
+        resolved_artists = (
+            resolved.assign(artist_key=resolved["folder"].map(artist_keys))
+            .groupby("artist_key")["artist_id"]
+            .agg(lambda ids: ids.mode().iloc[0])
+            .reset_index()
+        )
+        artists = ctx.store.table("artist_matches", service=SERVICE)
+        settled = artists[artists["artist_id"].notna() & (artists["needs_review"].fillna(0) == 0)]["artist_key"]
+        resolved_artists = resolved_artists[~resolved_artists["artist_key"].isin(settled)]
+        ctx.store.upsert("artist_matches", resolved_artists.assign(needs_review=0), service=SERVICE)
+
+    ctx.metrics.export("tidal_identifier_lookup")
+    return resolved
+
+
+def search_artists(ctx: Context):
+    """
+    Searches every local artist that doesn't have a Tidal ID yet (keeping the
+    next 2 matches), and picks the one of the top 3 whose discography has our albums.
+    """
+    with reviewed(ctx, SERVICE, "artist_matches"):
+        artists = artists_to_search(ctx, SERVICE)
+        journal = Journal("tidal_artist_search", reset=not ctx.resume)
+        results = journal.run(artists["artist"], ctx.tidal.search_artist, workers=ctx.tidal_workers)
+        record_artist_matches(ctx, SERVICE, artists, results, candidates=slice(1, 3))
+        # Always the whole discography on Tidal; the artist name and titles are for Spotify's album search
+        disambiguate_artists(ctx, SERVICE, artists, results, lambda artist_id, *_: get_albums_for_artist(ctx, artist_id), workers=ctx.tidal_workers)
+    journal.finish()
+    ctx.metrics.export("tidal_artist_search")
+
+
+def get_albums_for_artist(ctx: Context, artist_id) -> List[Dict]:
+    # Errors are journaled as failures, and retried on the next run
+    resp = ctx.tidal.artist_albums(artist_id)
+
+    # One edition per album: remasters, deluxe and clean versions of it are left out
+    albums = collapse_editions(resp["albums"], ctx.edition_rules)
+    album_data = [{
+        "artist_id": artist_id,
+        "album_id": album["id"],
+        "artist_name": resp["artist_name"],
+        "name": album["name"],
+        "url": f"https://tidal.com/browse/album/{album['id']}"
+    } for album in albums]
+
+    if len(albums) > 0:
+        print(f"Retrieved albums for {artist_id}: {len(albums)} records. Samples: {', '.join([item['name'] for item in album_data[0:3]])}")
+    else:
+        print(f"Retrieved albums for {artist_id}: None found.")
+
+    return album_data
+
+
+def fetch_catalog(ctx: Context) -> pd.DataFrame:
+    """Discographies of the artists that still have unmatched local albums."""
+    artist_ids = unmatched_artist_ids(ctx, SERVICE)
+    print(f"Retrieving albums for {len(artist_ids)} artists...")
+
+    journal = Journal("tidal_discography", reset=not ctx.resume)
+    results = journal.run(artist_ids, lambda artist_id: get_albums_for_artist(ctx, artist_id), workers=ctx.tidal_workers)
+    catalog = pd.DataFrame(
+        [album for albums in results if albums for album in albums],
+        columns=["artist_id", "album_id", "artist_name", "name", "url"],
+    )
+
+    ctx.store.upsert("catalog_albums", catalog, service=SERVICE)
+    catalog.to_csv(CATALOG_CSV, index=False)
+    journal.finish()
+    ctx.metrics.export("tidal_discography")
+    return catalog
+
+
+def match_albums(ctx: Context) -> pd.DataFrame:
+    """Fuzzy matches the local albums not resolved by identifier against the fetched discographies."""
+    with reviewed(ctx, SERVICE, "album_matches"):
+        album_join = match_local_albums(ctx, SERVICE)
+    matched = album_join["album_id"].notna().sum()
+    print(f"Matched {matched} of {len(album_join)} local albums; review {SERVICE} matches in data/albums_join_tidal.csv.")
+    return album_join
+
+
+def match(ctx: Context, artists_only: bool = False, chunk_size: Optional[int] = None):
+    """
+    With a chunk_size, the albums not resolved by identifier stream through
+    search, discography and matching that many artists at a time (see
+    common.match_in_chunks), and no catalog CSV is written.
+    """
+    resolve_identifiers(ctx)
+    if chunk_size and not artists_only:
+        match_in_chunks(ctx, SERVICE, ctx.tidal.search_artist, lambda artist_id, *_: get_albums_for_artist(ctx, artist_id), workers=ctx.tidal_workers, chunk_size=chunk_size, candidates=slice(1, 3))
+        ctx.metrics.export("tidal_match_in_chunks")
+        return
+    search_artists(ctx)
+    if artists_only:
+        return
+    fetch_catalog(ctx)
+    match_albums(ctx)
+
+
+def _favorite(ctx: Context, kind: str, ids: List[int], names: Dict) -> None:
+    # Already-favorited items were filtered out by the caller. The journal
+    # already spreads the batches over the workers, so within one this is a
+    # single POST, with the per-ID fallback one at a time: one session per worker.
+    add = ctx.tidal.add_favorite_artists if kind == "artist" else ctx.tidal.add_favorite_albums
+    print(f"Favoriting {len(ids)} {kind}s.")
+    results = add(ids, skip_existing=False, workers=1)
+    failed = failures(ids, results)
+    for item_id, error in failed.items():
+        print(f"Couldn't favorite {kind} {names.get(item_id)} ({item_id}): {error}")
+    if failed:
+        raise RuntimeError(f"{len(failed)} of {len(ids)} {kind}s failed")
+
+
+def follow(ctx: Context, audit: bool = False) -> int:
+    """
+    Favorites every matched artist that isn't a favorite yet. Only the
+    favorites added since the last run are read; audit re-reads them all.
+    """
+    with reviewed(ctx, SERVICE, "artist_matches"):
+        artists = ctx.store.table("artist_matches", service=SERVICE).dropna(subset=["artist_id"])
+    new_favorites = new_ids(ctx, SERVICE, "artist", artists["artist_id"], ctx.tidal.favorite_artists, audit=audit)
+    names = artists.set_index("artist_id")["artist"].to_dict()
+    return write_favorites(ctx, "artist", new_favorites, names, audit=audit)
+
+
+def write_favorites(ctx: Context, kind: str, ids: List[int], names: Dict, audit: bool = False, export: bool = True) -> int:
+    """
+    Favorites these artists or albums (`kind`), FAVORITES_BATCH_SIZE per call,
+    and adds them to the library snapshot. `names` is for the error messages.
+    audit means an audit found them missing, so they're sent even if the
+    journal has them as written; export=False leaves the metrics to the caller.
+    """
+    stage = f"tidal_favorite_{kind}s"
+    journal = Journal(stage, reset=not ctx.resume)
+    if audit:
+        journal.forget(ids)
+    written = journal.run_writes(
+        ids, lambda batch: _favorite(ctx, kind, batch, names), batch_size=FAVORITES_BATCH_SIZE, workers=ctx.tidal_workers,
+    )
+    record_written(ctx, SERVICE, kind, journal, ids)
+    journal.finish()
+    if export:
+        ctx.metrics.export(stage)
+    return written
+
+
+def save(ctx: Context, audit: bool = False) -> int:
+    """Favorites every matched album that isn't a favorite yet (same refresh as follow)."""
+    with reviewed(ctx, SERVICE, "album_matches"):
+        albums = ctx.store.album_join(SERVICE).dropna(subset=["album_id"])
+    new_albums = new_ids(ctx, SERVICE, "album", albums["album_id"], ctx.tidal.favorite_albums, audit=audit)
+    names = albums.set_index("album_id")["album"].to_dict()
+    return write_favorites(ctx, "album", new_albums, names, audit=audit)
@@ -0,0 +1,151 @@
+"""
+Everything a pipeline stage needs, created on first use.
+
+The scripts used to log in to Spotify and Tidal and import pandas, spotipy and
+tidalapi at the top, so even a status check paid for all of it. A Context only
+builds the state store, cache, metrics and API clients when a stage first asks
+for them, and only imports the libraries those need at that point. A stage
+that only touches Spotify never logs in to Tidal.
+
+    ctx = Context()
+    ctx.spotify.followed_artists()   # logs in here
+"""
+
+import os
+from functools import cached_property
+from typing import Optional
+
+SPOTIFY_SCOPE = ", ".join([
+    "user-library-read",
+    "user-library-modify",
+    "user-follow-modify",
+    "user-follow-read",
+    "playlist-read-private",
+    "playlist-modify-public",
+    "playlist-modify-private",
+])
+SPOTIFY_WORKERS = 8
+TIDAL_WORKERS = 4
+
+
+def load_env():
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+
+class Context:
+    def __init__(self, workers: Optional[int] = None, resume: bool = True, cache_mode: Optional[str] = None):
+        load_env()
+        self.spotify_workers = workers or SPOTIFY_WORKERS
+        self.tidal_workers = workers or TIDAL_WORKERS
+        # Each stage journals its progress to data/journal/; resume=False starts every stage over
+        self.resume = resume
+        # normal, misses (reuse anything cached regardless of age), refresh, off
+        self.cache_mode = cache_mode or os.environ.get("CACHE_MODE", "normal")
+
+    @cached_property
+    def store(self):
+        from music_sync.store import StateStore
+
+        return StateStore()
+
+    @cached_property
+    def cache(self):
+        from music_sync.cache import ResponseCache
+
+        return ResponseCache(mode=self.cache_mode)
+
+    @cached_property
+    def metrics(self):
+        from music_sync.metrics import Metrics
+
+        # Per-endpoint request counts, latencies, retries and bytes, written to
+        # data/metrics/<stage>.json / .prom after each stage
+        return Metrics()
+
+    @cached_property
+    def edition_rules(self):
+        from music_sync.editions import parse_rules
+
+        # Which edition of a re-released album to keep (see music_sync.editions)
+        return parse_rules(os.environ.get("EDITION_RULES"))
+
+    ##############################
+    # Spotify
+    ##############################
+
+    @cached_property
+    def spotify_limiter(self):
+        from music_sync.ratelimit import RateLimiter
+
+        # All Spotify calls share one limiter
+        return RateLimiter(rate=float(os.environ.get("SPOTIFY_RATE_LIMIT", 10)))
+
+    def spotify_for(self, username: str):
+        """
+        A SpotifyClient logged in as this user, with a connection pool sized to
+        the workers and a token that refreshes itself (see music_sync.sessions).
+        """
+        from music_sync.sessions import spotify_client
+        from music_sync.spotify import SpotifyClient
+
+        # Leave room for the page prefetch threads next to the workers
+        sp = spotify_client(username, SPOTIFY_SCOPE, pool_size=self.spotify_workers + 2)
+        self.metrics.instrument(sp._session, "spotify", self.spotify_limiter)
+        return SpotifyClient(sp, limiter=self.spotify_limiter, cache=self.cache)
+
+    @cached_property
+    def spotify(self):
+        return self.spotify_for(os.environ["SPOTIFY_USERNAME"])
+
+    @cached_property
+    def spotify_lookup(self):
+        from music_sync.lookup import AlbumLookup
+
+        # Album search or the whole discography, per artist, whichever takes fewer calls
+        return AlbumLookup(self.spotify)
+
+    ##############################
+    # Tidal
+    ##############################
+
+    @cached_property
+    def tidal_limiter(self):
+        from music_sync.ratelimit import RateLimiter
+
+        return RateLimiter(rate=float(os.environ.get("TIDAL_RATE_LIMIT", 5)))
+
+    @cached_property
+    def tidal_login(self):
+        from music_sync.sessions import TidalLogin
+
+        # Reuses the saved session in .tidal_session.txt (refreshing it if it's
+        # about to expire), or logs in and saves it
+        return TidalLogin.load()
+
+    @cached_property
+    def tidal_session(self):
+        session = self.tidal_login.session
+        self.metrics.instrument(session.request_session, "tidal", self.tidal_limiter)
+        return session
+
+    @cached_property
+    def tidal(self):
+        from music_sync.tidal import TidalClient
+
+        # Runs calls concurrently, each on its own pooled copy of the session, with a timeout
+        return TidalClient(
+            self.tidal_session,
+            limiter=self.tidal_limiter,
+            cache=self.cache,
+            workers=self.tidal_workers,
+            metrics=self.metrics,
+            login=self.tidal_login,
+        )
+
+    def close(self):
+        # Only close what was opened
+        for name in ("store", "cache"):
+            if name in self.__dict__:
+                self.__dict__[name].close()
@@ -0,0 +1,94 @@
+"""
+Artist disambiguation: picking the right one of an artist search's top results.
+
+The scripts always took the first search result, so a search for "Owen" could
+land on the wrong Owen, and that only turned up in manual review of the CSV.
+Here each candidate is scored by the share of our local albums by that artist
+that its discography has (fuzzy matched, like the album match itself), and the
+best one wins, with search rank breaking ties.
+
+Discographies come through the clients' response cache, and the pick's is
+needed for album matching anyway. The first result is scored first; only when
+its discography is missing some of the local albums are the other candidates
+fetched. A pick with few of the local albums, or tied with a runner-up, is
+flagged for review.
+"""
+
+from typing import Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from music_sync.matching import DEFAULT_CUTOFF, AlbumMatcher
+from music_sync.workers import DEFAULT_WORKERS, map_concurrent
+
+# Search results per artist that are considered
+DEFAULT_CANDIDATES = 3
+
+# Share of the local albums the pick's discography needs to have to skip review
+CONFIDENT_SCORE = 0.5
+
+
+def album_coverage(titles: List[str], discography: List[str], cutoff: float = DEFAULT_CUTOFF) -> float:
+    """Share of `titles` with a match in the discography's album names."""
+    if not titles:
+        return 0.0
+    matcher = AlbumMatcher(pd.DataFrame({"artist_id": 0, "name": discography}), artist_col="artist_id")
+    matches = matcher.match(0, titles, n=1, cutoff=cutoff)
+    return sum(1 for candidates in matches if candidates) / len(titles)
+
+
+def _score(
+    pairs: List[Tuple[int, int]],
+    titles: List[List[str]],
+    results: List[List[Dict]],
+    discography: Callable[[Dict, List[str]], List[str]],
+    workers: int,
+) -> Dict[Tuple[int, int], float]:
+    # (artist, candidate rank) -> coverage. A discography that can't be fetched scores 0.
+    discographies = map_concurrent(lambda pair: discography(results[pair[0]][pair[1]], titles[pair[0]]), pairs, workers=workers, return_exceptions=True)
+    scores = {}
+    for (i, rank), names in zip(pairs, discographies):
+        if isinstance(names, Exception):
+            print(f"Couldn't fetch the discography of {results[i][rank]['name']} ({results[i][rank]['id']}): {names}")
+            names = []
+        scores[(i, rank)] = album_coverage(titles[i], names)
+    return scores
+
+
+def disambiguate(
+    titles: List[List[str]],
+    results: List[Optional[List[Dict]]],
+    discography: Callable[[Dict, List[str]], List[str]],
+    workers: int = DEFAULT_WORKERS,
+    n: int = DEFAULT_CANDIDATES,
+) -> List[Optional[Dict]]:
+    """
+    For each artist (its local album titles, and its search results best
+    first), returns {"artist_id", "artist_match_score", "needs_review"}, or
+    None when the search failed or found nothing. discography(result, titles)
+    returns the album names of a search result's artist; `titles` are the
+    local ones it's scored on, so a lookup can search for just those.
+    """
+    searched = [i for i, matches in enumerate(results) if matches]
+    scores = _score([(i, 0) for i in searched], titles, results, discography, workers)
+
+    # Only artists whose first result is missing some local albums need the runners-up
+    rest = [(i, rank) for i in searched if scores[(i, 0)] < 1.0 for rank in range(1, min(n, len(results[i])))]
+    if rest:
+        print(f"Checking {len(rest)} more candidates for {len({i for i, _ in rest})} artists...")
+        scores.update(_score(rest, titles, results, discography, workers))
+
+    picks: List[Optional[Dict]] = [None] * len(results)
+    for i in searched:
+        ranked = sorted(
+            ((scores[(i, rank)], rank) for rank in range(min(n, len(results[i]))) if (i, rank) in scores),
+            key=lambda item: (-item[0], item[1]),
+        )
+        best, rank = ranked[0]
+        tied = len(ranked) > 1 and ranked[1][0] == best
+        picks[i] = {
+            "artist_id": results[i][rank]["id"],
+            "artist_match_score": round(best, 3),
+            "needs_review": int(best < CONFIDENT_SCORE or tied),
+        }
+    return picks
@@ -0,0 +1,129 @@
+"""
+Edition keys, so re-releases of one album count as one album.
+
+Discographies list "Abbey Road", "Abbey Road (Remastered 2019)", "Abbey Road
+(Super Deluxe Edition)" and "Abbey Road [Explicit]" as separate albums, and the
+scripts kept every one of them: a bigger catalog, near-tied fuzzy matches, and
+the same songs in the playlist more than once when two editions got saved.
+
+album_key() strips edition suffixes ("(2011 Remaster)", "- Deluxe Edition",
+"[Explicit]", ...) and normalizes the rest, so every edition of a release gets
+the same key. collapse_editions() keeps one album per artist + key: the one
+the rules score highest, then the earliest release, then the first listed.
+Suffixes without an edition word ("(Live)", "(Taylor's Version)", "- Extended
+Play") are part of the title, so those stay separate albums.
+
+Rules weigh each edition tag; an untagged title (usually the original
+release) scores 0. Set EDITION_RULES in .env to change them, e.g.
+"remaster=1,deluxe=1" prefers remastered deluxe editions.
+"""
+
+import re
+import unicodedata
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+# Edition tag -> the words that mark it in a title suffix
+EDITION_TAGS = {
+    "remaster": r"re-?master(?:ed)?",
+    "deluxe": r"deluxe",
+    # "Extended Play" is an EP, a release of its own
+    "expanded": r"expanded|extended(?!\s+play)|bonus tracks?",
+    "anniversary": r"anniversary",
+    "special": r"special|collector'?s|limited|legacy",
+    "reissue": r"reissue|re-?issued?",
+    "mono": r"mono",
+    "explicit": r"explicit",
+    "clean": r"clean|edited",
+}
+
+# Tag weights, higher preferred. The standard edition's track list is the one
+# on the CD, and the CD wasn't a clean version.
+DEFAULT_RULES = {
+    "remaster": -1,
+    "deluxe": -2,
+    "expanded": -2,
+    "anniversary": -2,
+    "special": -2,
+    "reissue": -1,
+    "mono": -1,
+    "explicit": 1,
+    "clean": -1,
+}
+
+_tags = {tag: re.compile(rf"\b(?:{words})\b", re.IGNORECASE) for tag, words in EDITION_TAGS.items()}
+# A trailing "(...)", "[...]" or " - ..."
+_suffix = re.compile(r"\s*(?:\(([^()]*)\)|\[([^\[\]]*)\]|\s[-–]\s+([^-–()\[\]]+))\s*$")
+_punctuation = re.compile(r"[^\w\s]")
+
+
+def _suffix_tags(text: str) -> FrozenSet[str]:
+    return frozenset(tag for tag, pattern in _tags.items() if pattern.search(text))
+
+
+def split_edition(name: str) -> Tuple[str, FrozenSet[str]]:
+    """("Abbey Road (Remastered 2019) [Explicit]") -> ("Abbey Road", {"remaster", "explicit"})."""
+    title = " ".join(str(name).split())
+    tags: FrozenSet[str] = frozenset()
+    while True:
+        m = _suffix.search(title)
+        if not m or m.start() == 0:
+            return title, tags
+        found = _suffix_tags(next(group for group in m.groups() if group is not None))
+        if not found:
+            return title, tags
+        title, tags = title[:m.start()], tags | found
+
+
+def base_title(name: str) -> str:
+    return split_edition(name)[0]
+
+
+def album_key(name: str) -> str:
+    # Edition suffixes stripped, then casefold, drop accents, "&" -> "and", strip punctuation
+    key = unicodedata.normalize("NFKD", base_title(name))
+    key = "".join(c for c in key if not unicodedata.combining(c))
+    key = key.casefold().replace("&", " and ")
+    key = _punctuation.sub(" ", key)
+    return " ".join(key.split())
+
+
+def parse_rules(text: Optional[str]) -> Dict[str, int]:
+    """DEFAULT_RULES, with the weights in "tag=weight,..." (e.g. EDITION_RULES) on top."""
+    rules = dict(DEFAULT_RULES)
+    for entry in (text or "").split(","):
+        if not entry.strip():
+            continue
+        tag, _, weight = entry.partition("=")
+        tag = tag.strip().lower()
+        if tag not in EDITION_TAGS:
+            raise ValueError(f"Unknown edition tag {tag!r} in {text!r}; known tags: {', '.join(EDITION_TAGS)}")
+        try:
+            rules[tag] = int(weight)
+        except ValueError:
+            raise ValueError(f"Edition rule {entry.strip()!r} needs a whole-number weight, like {tag}=1") from None
+    return rules
+
+
+def edition_score(album: Dict, rules: Dict[str, int]) -> int:
+    tags = split_edition(album["name"])[1]
+    # Tidal marks explicit versions with a flag rather than in the title
+    if album.get("explicit"):
+        tags |= {"explicit"}
+    return sum(rules.get(tag, 0) for tag in tags)
+
+
+def collapse_editions(albums: List[Dict], rules: Optional[Dict[str, int]] = None) -> List[Dict]:
+    """
+    One album per edition cluster (artist_id, when the albums have it, +
+    album_key), in the order the albums came. Uses "name", and "explicit" and
+    "release_date" when present.
+    """
+    rules = DEFAULT_RULES if rules is None else rules
+    best: Dict[Tuple, Tuple[Tuple, Dict]] = {}
+    for i, album in enumerate(albums):
+        cluster = (album.get("artist_id"), album_key(album["name"]))
+        released = album.get("release_date")
+        rank = (-edition_score(album, rules), released is None, str(released or ""), i)
+        if cluster not in best or rank < best[cluster][0]:
+            best[cluster] = (rank, album)
+    return [album for _, album in sorted(best.values(), key=lambda item: item[0][-1])]
@@ -0,0 +1,84 @@
+"""
+Cross-service album resolution by barcode (UPC) and ISRC.
+
+Once script 2 has matched a local album to a Spotify album, we know the exact
+release, so the Tidal side doesn't need to start over from the artist's name.
+The Spotify album's UPC usually finds the same release on Tidal in one lookup.
+When the barcodes differ (another pressing or region), the ISRC of its first
+track finds the Tidal track, and its album with it. Only the albums where
+neither works still need the artist search, discography fetch and fuzzy match.
+"""
+
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+from music_sync.matching import normalize_title
+from music_sync.spotify import SpotifyClient
+from music_sync.tidal import TidalClient, failures
+from music_sync.workers import DEFAULT_WORKERS
+
+RESOLVED_COLUMNS = ["folder", "artist_id", "artist_name", "album_id", "name", "matched_by"]
+
+
+def _pick(candidates, name: Optional[str]) -> Optional[Dict]:
+    # Failed lookups and misses both fall through to the fuzzy path
+    if isinstance(candidates, Exception) or not candidates:
+        return None
+    # An ISRC can be on the album and on compilations; prefer the same title
+    for candidate in candidates:
+        if name and normalize_title(candidate["name"]) == normalize_title(name):
+            return candidate
+    return candidates[0]
+
+
+def _lookup(spotify_ids: List[str], identifiers: Dict[str, Dict], key: str, fetch) -> Dict[str, Dict]:
+    codes = sorted({identifiers[spotify_id][key] for spotify_id in spotify_ids if identifiers[spotify_id][key]})
+    results = fetch(codes)
+    failed = failures(codes, results)
+    if failed:
+        print(f"{len(failed)} {key.upper()} lookups failed, e.g. {next(iter(failed.items()))}")
+
+    by_code = dict(zip(codes, results))
+    resolved = {}
+    for spotify_id in spotify_ids:
+        ids = identifiers[spotify_id]
+        match = _pick(by_code.get(ids[key]), ids["name"])
+        if match is not None:
+            resolved[spotify_id] = {**match, "matched_by": key}
+    return resolved
+
+
+def resolve_tidal_albums(
+    spotify: SpotifyClient,
+    tidal: TidalClient,
+    albums: pd.DataFrame,
+    workers: int = DEFAULT_WORKERS,
+) -> pd.DataFrame:
+    """
+    Finds the Tidal album for each local album that has a Spotify album_id
+    (e.g. store.album_join("spotify")). Returns one row per resolved folder:
+    folder, artist_id, artist_name, album_id, name, matched_by ("upc" / "isrc").
+    """
+    spotify_ids = albums["album_id"].dropna().unique().tolist()
+    identifiers = spotify.album_identifiers(spotify_ids, workers=workers)
+    spotify_ids = list(identifiers)
+
+    resolved = _lookup(spotify_ids, identifiers, "upc", tidal.albums_by_barcodes)
+    by_upc = len(resolved)
+    resolved.update(_lookup([spotify_id for spotify_id in spotify_ids if spotify_id not in resolved], identifiers, "isrc", tidal.albums_by_isrcs))
+    print(f"Resolved {len(resolved)} of {len(spotify_ids)} Spotify albums on Tidal: {by_upc} by UPC, {len(resolved) - by_upc} by ISRC.")
+
+    rows = [{
+        "folder": folder,
+        "artist_id": resolved[spotify_id]["artist_id"],
+        "artist_name": resolved[spotify_id]["artist_name"],
+        "album_id": resolved[spotify_id]["id"],
+        "name": resolved[spotify_id]["name"],
+        "matched_by": resolved[spotify_id]["matched_by"],
+    } for folder, spotify_id in zip(albums["folder"], albums["album_id"]) if spotify_id in resolved]
+
+    frame = pd.DataFrame(rows, columns=RESOLVED_COLUMNS)
+    frame["artist_id"] = frame["artist_id"].astype(pd.Int64Dtype())
+    frame["album_id"] = frame["album_id"].astype(pd.Int64Dtype())
+    return frame
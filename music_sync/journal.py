@@ -0,0 +1,190 @@
+"""
+Write-ahead journal for resumable pipeline stages.
+
+Each stage (artist search, follow, discography fetch, match, save, playlist
+write) appends one JSON line per finished item (or batch) to
+data/journal/<stage>.jsonl, fsynced as it goes. After a token expiry, network
+blip or kernel restart, re-running the stage skips everything already done and
+only retries what failed or never ran.
+
+Write actions are journaled twice: a "started" line before the request goes
+out and a "done" line after. Done writes are never sent again. A write that was
+started but never finished is "in doubt": it may or may not have reached the
+service. Callers diff against the live library before writing, so anything that
+did land drops out on its own, and only the writes that didn't get sent again.
+
+A journal only carries an interrupted run over to its rerun. Once a stage
+finishes with nothing failed or in doubt, finish() deletes it, and entries
+older than max_age are ignored, so between complete runs the response cache
+(with its TTLs) and the library snapshot decide what gets fetched and written.
+forget() un-does keys, e.g. writes an audit found missing on the service.
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from music_sync.workers import DEFAULT_WORKERS, chunker, map_concurrent
+
+JOURNAL_DIR = "data/journal"
+
+# Entries older than this are ignored: the run they'd resume is long over
+JOURNAL_MAX_AGE = 7 * 24 * 60 * 60
+
+
+class Journal:
+    def __init__(self, stage: str, directory: str = JOURNAL_DIR, reset: bool = False, max_age: Optional[float] = JOURNAL_MAX_AGE):
+        self.stage = stage
+        self.path = os.path.join(directory, f"{stage}.jsonl")
+        self.max_age = max_age
+        self.state: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        if reset and os.path.exists(self.path):
+            os.remove(self.path)
+        self._load()
+
+        in_doubt = self.in_doubt()
+        if in_doubt:
+            print(f"{stage}: {len(in_doubt)} writes from the last run may not have completed. They'll be checked against the live library.")
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        oldest = time.time() - self.max_age if self.max_age is not None else None
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # A crash mid-write can leave a torn last line
+                    continue
+                if oldest is not None and entry.get("at", 0) < oldest:
+                    continue
+                for key in entry.pop("keys"):
+                    self.state[key] = entry
+
+    def _append(self, entries: List[Dict]):
+        lines = "".join(json.dumps(entry, default=str) + "\n" for entry in entries)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+            for entry in entries:
+                for key in entry.pop("keys"):
+                    self.state[key] = entry
+
+    def _entry(self, keys: List, status: str, result: Any = None, error: Optional[str] = None) -> Dict:
+        entry = {"keys": [str(key) for key in keys], "status": status, "at": time.time()}
+        if result is not None:
+            entry["result"] = result
+        if error is not None:
+            entry["error"] = error
+        return entry
+
+    def status(self, key) -> Optional[str]:
+        entry = self.state.get(str(key))
+        return entry["status"] if entry else None
+
+    def done(self, key) -> bool:
+        return self.status(key) == "done"
+
+    def result(self, key) -> Any:
+        entry = self.state.get(str(key))
+        return entry.get("result") if entry and entry["status"] == "done" else None
+
+    def pending(self, keys: Iterable) -> List:
+        """Keys (deduped, in order) that haven't completed yet, including failures."""
+        return [key for key in dict.fromkeys(keys) if not self.done(key)]
+
+    def failed(self) -> Dict[str, str]:
+        return {key: entry.get("error") for key, entry in self.state.items() if entry["status"] == "failed"}
+
+    def in_doubt(self) -> List[str]:
+        return [key for key, entry in self.state.items() if entry["status"] == "started"]
+
+    def begin(self, keys: List):
+        self._append([self._entry(keys, "started")])
+
+    def record(self, keys: List, result: Any = None):
+        self._append([self._entry(keys, "done", result=result)])
+
+    def record_each(self, results: Dict):
+        """Records many keys with their own results, with a single fsync."""
+        self._append([self._entry([key], "done", result=result) for key, result in results.items()])
+
+    def fail(self, keys: List, error: Exception):
+        self._append([self._entry(keys, "failed", error=f"{type(error).__name__}: {error}")])
+
+    def forget(self, keys: Iterable):
+        """Marks done keys as not done, so the next run does them again."""
+        done = [key for key in dict.fromkeys(keys) if self.done(key)]
+        if done:
+            self._append([self._entry(done, "forgotten")])
+
+    def finish(self) -> bool:
+        """
+        Deletes the journal if nothing in it failed or is in doubt: the stage
+        is complete, so the next run starts fresh. Call it once the results
+        have been used. Returns whether it was deleted.
+        """
+        with self._lock:
+            if any(entry["status"] in ("failed", "started") for entry in self.state.values()):
+                return False
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            self.state = {}
+        return True
+
+    def run(self, keys: Iterable, fn: Callable, workers: int = DEFAULT_WORKERS) -> List:
+        """
+        Calls fn(key) for every key not already done (concurrently), journaling
+        each result as it lands. Returns results for all keys in input order,
+        with None for keys that failed.
+        """
+        keys = list(keys)
+        todo = self.pending(keys)
+        skipped = len(set(map(str, keys))) - len(todo)
+        if skipped:
+            print(f"{self.stage}: {skipped} already done, {len(todo)} to go.")
+
+        def work(key):
+            try:
+                result = fn(key)
+            except Exception as e:
+                print(f"{self.stage}: {key} failed: {e}")
+                self.fail([key], e)
+                raise
+            self.record([key], result)
+            return result
+
+        map_concurrent(work, todo, workers=workers, return_exceptions=True)
+        return [self.result(key) for key in keys]
+
+    def run_writes(self, ids: Iterable, fn: Callable[[List], Any], batch_size: int, workers: int = DEFAULT_WORKERS) -> int:
+        """
+        Sends fn(batch) for ids not already written, journaling each batch before
+        and after. Returns the number of ids written this run.
+        """
+        todo = self.pending(ids)
+        if not todo:
+            print(f"{self.stage}: nothing to write.")
+            return 0
+
+        def work(batch):
+            self.begin(batch)
+            try:
+                fn(batch)
+            except Exception as e:
+                print(f"{self.stage}: batch of {len(batch)} failed: {e}")
+                self.fail(batch, e)
+                raise
+            self.record(batch)
+            return len(batch)
+
+        results = map_concurrent(work, list(chunker(todo, batch_size)), workers=workers, return_exceptions=True)
+        return sum(result for result in results if not isinstance(result, Exception))
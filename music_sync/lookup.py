@@ -0,0 +1,125 @@
+"""
+Per-artist choice between album search and the full discography.
+
+Matching fetched every matched artist's whole discography, a call per 50
+albums, even for an artist with hundreds of releases that we own one album
+by. An album search (album:"Title" artist:"Artist") finds one of our albums
+in one call. AlbumLookup works out both costs for each artist and takes the
+cheaper:
+
+    album search  a call per local title that isn't in the response cache
+    discography   nothing if it's in the cache, else a call per 50 albums:
+                  the total from the last fetch (peeked from the cache even
+                  once it's expired), or ESTIMATED_PAGES for an artist never
+                  fetched
+
+A tie goes to the discography, which also covers albums added locally later.
+If the search turns up nothing by the artist for one of the titles, the
+discography is fetched after all, so no album is matched against less than
+before.
+
+strategy() makes the same choice up front, so callers can keep the two
+apart: album search results only cover the titles searched for, so they're
+never stored as the artist's discography (search_key() identifies them).
+
+report() gives the requests a run made next to what fetching every
+discography would have taken.
+"""
+
+import math
+import threading
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from music_sync.editions import base_title
+from music_sync.spotify import PAGE_SIZE, SpotifyClient
+
+# Discography pages assumed for an artist that was never fetched
+ESTIMATED_PAGES = 2
+
+
+def discography_pages(total: Optional[int]) -> int:
+    return ESTIMATED_PAGES if total is None else max(1, math.ceil(total / PAGE_SIZE))
+
+
+def search_key(artist_id: str, titles: List[str]) -> str:
+    """Identifies an album search result: the artist and the titles it was for."""
+    return "|".join([artist_id, *sorted(set(titles))])
+
+
+class AlbumLookup:
+    def __init__(self, spotify: SpotifyClient):
+        self.spotify = spotify
+        self._lock = threading.Lock()
+        # "album_search" / "discography" -> requests made
+        self.requests: Counter = Counter()
+        # artist_id -> strategy used
+        self.strategies: Dict[str, str] = {}
+        # Requests the same lookups would have made fetching discographies only
+        self.baseline = 0
+
+    def costs(self, artist_id: str, artist: str, titles: List[str]) -> Tuple[int, int]:
+        """(album search, discography) requests for this artist; 0 for what's cached."""
+        total, cached = self.spotify.discography_size(artist_id)
+        search = sum(1 for title in titles if not self.spotify.album_search_cached(artist, base_title(title)))
+        return search, 0 if cached else discography_pages(total)
+
+    def strategy(self, artist_id: str, artist: Optional[str] = None, titles: Optional[List[str]] = None) -> str:
+        """"album_search" or "discography": what albums() will do for this artist, as things are cached now."""
+        titles = list(dict.fromkeys(titles or []))
+        if not artist or not titles:
+            return "discography"
+        search_cost, discography_cost = self.costs(artist_id, artist, titles)
+        return "discography" if search_cost >= discography_cost else "album_search"
+
+    def _record(self, artist_id: str, strategy: str, requests: Dict[str, int], baseline: int):
+        with self._lock:
+            self.requests.update(requests)
+            self.strategies.setdefault(artist_id, strategy)
+            self.baseline += baseline
+
+    def _discography(self, artist_id: str, cached: bool) -> Tuple[List[Dict], int]:
+        # The albums, and the requests they took
+        resp = self.spotify.artist_albums(artist_id)
+        return resp["items"], 0 if cached else discography_pages(resp["total"])
+
+    def albums(self, artist_id: str, artist: Optional[str] = None, titles: Optional[List[str]] = None) -> List[Dict]:
+        """
+        The artist's albums that matching needs: the whole discography, or the
+        album search results for `titles` (by `artist`) when that's cheaper.
+        Without titles it's always the discography.
+        """
+        titles = list(dict.fromkeys(titles or []))
+        if not artist or not titles:
+            _, cached = self.spotify.discography_size(artist_id)
+            items, pages = self._discography(artist_id, cached)
+            self._record(artist_id, "discography", {"discography": pages}, pages)
+            return items
+
+        search_cost, discography_cost = self.costs(artist_id, artist, titles)
+        if search_cost >= discography_cost:
+            items, pages = self._discography(artist_id, discography_cost == 0)
+            self._record(artist_id, "discography", {"discography": pages}, pages)
+            return items
+
+        albums: Dict[str, Dict] = {}
+        missing = False
+        for title in titles:
+            found = [album for album in self.spotify.search_albums(artist, base_title(title)) if artist_id in album["artist_ids"]]
+            missing = missing or not found
+            albums.update((album["id"], album) for album in found)
+
+        pages = 0
+        if missing:
+            items, pages = self._discography(artist_id, discography_cost == 0)
+            albums.update((album["id"], album) for album in items)
+        self._record(artist_id, "album_search", {"album_search": search_cost, "discography": pages}, pages if missing else discography_cost)
+        return list(albums.values())
+
+    def report(self) -> str:
+        searched = sum(1 for strategy in self.strategies.values() if strategy == "album_search")
+        return (
+            f"Album lookups for {len(self.strategies)} artists ({searched} by album search, {len(self.strategies) - searched} by discography): "
+            f"{sum(self.requests.values())} requests ({self.requests['album_search']} album searches, {self.requests['discography']} discography pages), "
+            f"against ~{self.baseline} fetching every discography."
+        )
@@ -0,0 +1,178 @@
+"""
+Fuzzy album matching: local album names -> catalog album names, per artist.
+
+The scripts used to run `difflib.get_close_matches` once per local album, with a
+full boolean scan of the catalog DataFrame for that artist on every row. Here the
+catalog is grouped by artist ID once, titles are normalized and tokenized once,
+and all of an artist's local albums are scored against that artist's catalog in
+one pass.
+
+Score is the better of difflib's ratio on the normalized titles and the token
+overlap (Dice coefficient), so "Abbey Road" and "abbey road!" are a perfect match
+and word-order differences don't sink an otherwise obvious match. Edition suffixes
+are dropped on both sides first (see editions.py), so a local "Abbey Road
+(Remastered)" is a perfect match for the catalog's "Abbey Road".
+"""
+
+import difflib
+import hashlib
+import re
+import unicodedata
+from typing import Dict, FrozenSet, List, Tuple
+
+import pandas as pd
+
+from music_sync.editions import base_title
+from music_sync.journal import Journal
+
+DEFAULT_CUTOFF = 0.6
+DEFAULT_CANDIDATES = 3
+
+MATCH_COLUMNS = ["album_name_best_match", "album_match_score", "album_match_candidates"]
+
+_punctuation = re.compile(r"[^\w\s]")
+
+
+def normalize_title(title: str) -> str:
+    # Casefold, drop accents, "&" -> "and", strip punctuation, collapse whitespace
+    title = unicodedata.normalize("NFKD", str(title))
+    title = "".join(c for c in title if not unicodedata.combining(c))
+    title = title.casefold().replace("&", " and ")
+    title = _punctuation.sub(" ", title)
+    return " ".join(title.split())
+
+
+def dice(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    if not a or not b:
+        return 0.0
+    return 2 * len(a & b) / (len(a) + len(b))
+
+
+class AlbumMatcher:
+    def __init__(self, catalog: pd.DataFrame, artist_col: str, name_col: str = "name"):
+        # artist_id -> list of (catalog name, normalized name, tokens)
+        self.index: Dict[object, List[Tuple[str, str, FrozenSet[str]]]] = {}
+
+        catalog = catalog[[artist_col, name_col]].dropna().drop_duplicates()
+        for artist_id, names in catalog.groupby(artist_col, sort=False)[name_col]:
+            entries = []
+            for name in names:
+                normalized = normalize_title(base_title(name))
+                entries.append((name, normalized, frozenset(normalized.split())))
+            self.index[artist_id] = entries
+
+    def match(
+        self,
+        artist_id,
+        titles: List[str],
+        n: int = DEFAULT_CANDIDATES,
+        cutoff: float = DEFAULT_CUTOFF,
+    ) -> List[List[Tuple[str, float]]]:
+        """Ranked (catalog name, score) candidates for each title, best first."""
+        entries = self.index.get(artist_id, [])
+        local = [normalize_title(base_title(title)) for title in titles]
+        local_tokens = [frozenset(title.split()) for title in local]
+        scores: List[Dict[str, float]] = [{} for _ in titles]
+
+        # SequenceMatcher caches its analysis of seq2, so put each catalog name
+        # there once and run all of this artist's local titles against it
+        matcher = difflib.SequenceMatcher(autojunk=False)
+        for name, normalized, tokens in entries:
+            matcher.set_seq2(normalized)
+            for i, title in enumerate(local):
+                if title == normalized:
+                    score = 1.0
+                else:
+                    score = dice(local_tokens[i], tokens)
+
+                    # The quick ratios are upper bounds, so skip the full
+                    # ratio when it can't beat the cutoff or the token score
+                    floor = max(score, cutoff)
+                    matcher.set_seq1(title)
+                    if (score < 1.0
+                            and matcher.real_quick_ratio() >= floor
+                            and matcher.quick_ratio() >= floor):
+                        score = max(score, matcher.ratio())
+
+                if score >= cutoff and score > scores[i].get(name, 0.0):
+                    scores[i][name] = score
+
+        return [
+            sorted(candidates.items(), key=lambda item: item[1], reverse=True)[:n]
+            for candidates in scores
+        ]
+
+
+def catalog_fingerprints(catalog: pd.DataFrame, artist_col: str, name_col: str = "name") -> Dict[object, str]:
+    """artist -> a short hash of their catalog album names, which changes whenever the names do."""
+    names = catalog[[artist_col, name_col]].dropna().drop_duplicates()
+    return {
+        artist: hashlib.sha1("\n".join(sorted(map(str, group))).encode("utf-8")).hexdigest()[:12]
+        for artist, group in names.groupby(artist_col, sort=False)[name_col]
+    }
+
+
+def match_albums(
+    albums: pd.DataFrame,
+    catalog: pd.DataFrame,
+    artist_col: str,
+    album_col: str = "album",
+    catalog_artist_col: str = None,
+    catalog_name_col: str = "name",
+    n: int = DEFAULT_CANDIDATES,
+    cutoff: float = DEFAULT_CUTOFF,
+    journal: Journal = None,
+    key_col: str = "folder",
+) -> pd.DataFrame:
+    """
+    Adds album_name_best_match, album_match_score and album_match_candidates
+    ("name (score); ...", for manual review) to a copy of `albums`.
+
+    With a journal, a row's result is keyed on its key_col, its artist ID and
+    a fingerprint of that artist's catalog, so it's reused only while all three
+    are unchanged: a corrected artist ID or a refreshed discography matches the
+    row again. Rows without an artist ID, and rows that found no match, aren't
+    journaled, so they get matched again on every run.
+    """
+    if journal is not None:
+        fingerprints = catalog_fingerprints(catalog, catalog_artist_col or artist_col, catalog_name_col)
+        keys = pd.Series(
+            [f"{key}|{artist}|{fingerprints.get(artist, '')}" for key, artist in zip(albums[key_col], albums[artist_col])],
+            index=albums.index,
+            dtype=object,
+        )
+        todo = albums[~keys.map(journal.done) & albums[artist_col].notna()]
+        matched = match_albums(todo, catalog, artist_col, album_col, catalog_artist_col, catalog_name_col, n, cutoff)
+        journal.record_each({
+            keys[i]: {col: row[col] for col in MATCH_COLUMNS if pd.notna(row[col])}
+            for i, row in matched.iterrows()
+            if pd.notna(row["album_name_best_match"])
+        })
+
+        albums = albums.copy()
+        for col in MATCH_COLUMNS:
+            albums[col] = keys.map(lambda key: (journal.result(key) or {}).get(col))
+        return albums
+
+    matcher = AlbumMatcher(catalog, catalog_artist_col or artist_col, catalog_name_col)
+
+    albums = albums.copy()
+    albums["album_name_best_match"] = None
+    albums["album_match_score"] = float("nan")
+    albums["album_match_candidates"] = None
+
+    best_col = albums.columns.get_loc("album_name_best_match")
+    score_col = albums.columns.get_loc("album_match_score")
+    candidates_col = albums.columns.get_loc("album_match_candidates")
+
+    positions = albums.reset_index(drop=True).dropna(subset=[artist_col]).groupby(artist_col, sort=False).indices
+    for artist_id, rows in positions.items():
+        titles = albums.iloc[rows, albums.columns.get_loc(album_col)].astype(str).tolist()
+        for row, candidates in zip(rows, matcher.match(artist_id, titles, n=n, cutoff=cutoff)):
+            if not candidates:
+                continue
+            albums.iat[row, best_col] = candidates[0][0]
+            albums.iat[row, score_col] = round(candidates[0][1], 3)
+            albums.iat[row, candidates_col] = "; ".join(f"{name} ({score:.2f})" for name, score in candidates)
+
+    return albums
@@ -0,0 +1,183 @@
+"""
+Per-endpoint API metrics.
+
+spotipy and tidalapi both send everything through a requests.Session, so a
+response hook on that session sees every request either client makes. For
+each endpoint ("GET artists/{id}/albums") it records calls, status codes,
+latency percentiles, payload bytes, retries (responses that get retried: 429s
+and 5xx) and the time the rate limiter spent sleeping before those calls.
+
+At the end of a stage, export() writes data/metrics/<stage>.json and
+<stage>.prom (Prometheus textfile collector format), and starts counting afresh.
+"""
+
+import json
+import os
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+from music_sync.ratelimit import RETRYABLE_STATUSES, RateLimiter
+
+METRICS_DIR = "data/metrics"
+QUANTILES = (0.5, 0.95, 0.99)
+
+# Spotify IDs are 22 base62 characters, Tidal IDs are numbers
+_id_segment = re.compile(r"^(?:[0-9A-Za-z]{22}|\d+)$")
+_version_prefix = re.compile(r"^/?(?:tidal/)?v\d+/")
+
+
+def endpoint_name(method: str, url: str) -> str:
+    path = _version_prefix.sub("", urlparse(url).path)
+    segments = ["{id}" if _id_segment.match(segment) else segment for segment in path.strip("/").split("/")]
+    return f"{method} {'/'.join(segments)}"
+
+
+def quantile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class EndpointStats:
+    def __init__(self):
+        self.statuses: Counter = Counter()
+        self.latencies: List[float] = []
+        self.bytes = 0
+        self.sleep_time = 0.0
+
+    def summary(self) -> Dict:
+        calls = sum(self.statuses.values())
+        return {
+            "calls": calls,
+            "statuses": {str(status): count for status, count in sorted(self.statuses.items())},
+            "throttled": self.statuses[429],
+            "retries": sum(count for status, count in self.statuses.items() if status in RETRYABLE_STATUSES),
+            "errors": sum(count for status, count in self.statuses.items() if status >= 400),
+            "latency": {
+                **{f"p{int(q * 100)}": quantile(self.latencies, q) for q in QUANTILES},
+                "mean": sum(self.latencies) / len(self.latencies) if self.latencies else None,
+                "total": sum(self.latencies),
+            },
+            "bytes": self.bytes,
+            "sleep_time": self.sleep_time,
+        }
+
+
+class Metrics:
+    def __init__(self, directory: str = METRICS_DIR):
+        self.directory = directory
+        self._stats: Dict[tuple, EndpointStats] = defaultdict(EndpointStats)
+        self._limiters: Dict[str, RateLimiter] = {}
+        self._started = time.time()
+        self._lock = threading.Lock()
+
+    def instrument(self, request_session, service: str, limiter: Optional[RateLimiter] = None):
+        """Records every response on a requests.Session (`sp._session`, `session.request_session`)."""
+        if limiter is not None:
+            self._limiters[service] = limiter
+
+        def hook(response, *args, **kwargs):
+            slept = limiter.take_sleep() if limiter is not None else 0.0
+            self.record(
+                service,
+                endpoint_name(response.request.method, response.url),
+                response.status_code,
+                response.elapsed.total_seconds(),
+                len(response.content or b""),
+                slept,
+            )
+            return response
+
+        request_session.hooks["response"].append(hook)
+
+    def record(self, service: str, endpoint: str, status: int, seconds: float, nbytes: int = 0, slept: float = 0.0):
+        with self._lock:
+            stats = self._stats[(service, endpoint)]
+            stats.statuses[status] += 1
+            stats.latencies.append(seconds)
+            stats.bytes += nbytes
+            stats.sleep_time += slept
+
+    def summary(self) -> Dict:
+        with self._lock:
+            endpoints = {f"{service} {endpoint}": stats.summary() for (service, endpoint), stats in sorted(self._stats.items())}
+        return {
+            "started": self._started,
+            "seconds": time.time() - self._started,
+            "endpoints": endpoints,
+            "limiters": {
+                service: {
+                    "rate": limiter.rate,
+                    "retries": limiter.retry_count,
+                    "throttled": limiter.throttled_count,
+                    "sleep_time": limiter.sleep_time,
+                }
+                for service, limiter in self._limiters.items()
+            },
+        }
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self._started = time.time()
+
+    def prometheus(self, stage: str) -> str:
+        lines = []
+
+        def metric(name: str, kind: str, help: str, samples: List[tuple]):
+            lines.append(f"# HELP music_sync_{name} {help}")
+            lines.append(f"# TYPE music_sync_{name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(f'{key}="{value}"' for key, value in {"stage": stage, **labels}.items())
+                lines.append(f"music_sync_{name}{{{label_text}}} {value}")
+
+        with self._lock:
+            items = sorted(self._stats.items())
+
+            requests, latency, nbytes, retries, sleep = [], [], [], [], []
+            for (service, endpoint), stats in items:
+                labels = {"service": service, "endpoint": endpoint}
+                for status, count in sorted(stats.statuses.items()):
+                    requests.append(({**labels, "status": status}, count))
+                for q in QUANTILES:
+                    latency.append(({**labels, "quantile": q}, quantile(stats.latencies, q)))
+                nbytes.append((labels, stats.bytes))
+                retries.append((labels, sum(count for status, count in stats.statuses.items() if status in RETRYABLE_STATUSES)))
+                sleep.append((labels, round(stats.sleep_time, 6)))
+
+            metric("requests_total", "counter", "API requests by endpoint and HTTP status.", requests)
+            metric("request_duration_seconds", "summary", "API request latency.", latency)
+            for (service, endpoint), stats in items:
+                labels = f'stage="{stage}",service="{service}",endpoint="{endpoint}"'
+                lines.append(f"music_sync_request_duration_seconds_sum{{{labels}}} {sum(stats.latencies)}")
+                lines.append(f"music_sync_request_duration_seconds_count{{{labels}}} {len(stats.latencies)}")
+            metric("response_bytes_total", "counter", "Response payload bytes.", nbytes)
+            metric("retries_total", "counter", "Responses that were retried (429 and 5xx).", retries)
+            metric("sleep_seconds_total", "counter", "Time the rate limiter slept before these requests.", sleep)
+
+        return "\n".join(lines) + "\n"
+
+    def export(self, stage: str, reset: bool = True) -> Dict:
+        """Writes <stage>.json and <stage>.prom to the metrics directory. Returns the summary."""
+        os.makedirs(self.directory, exist_ok=True)
+        summary = {"stage": stage, **self.summary()}
+
+        # Write to temp files and swap them in, so a collector never reads half a file
+        for extension, text in (("json", json.dumps(summary, indent=2)), ("prom", self.prometheus(stage))):
+            path = os.path.join(self.directory, f"{stage}.{extension}")
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(path + ".tmp", path)
+
+        calls = sum(endpoint["calls"] for endpoint in summary["endpoints"].values())
+        throttled = sum(endpoint["throttled"] for endpoint in summary["endpoints"].values())
+        print(f"{stage}: {calls} requests across {len(summary['endpoints'])} endpoints, {throttled} throttled.")
+
+        if reset:
+            self.reset()
+        return summary
@@ -0,0 +1,171 @@
+"""
+Multi-library batch mode: several users' albums.csv files, one catalog pass.
+
+Running script 2 once per account searches the same artists and fetches the same
+discographies over and over. Here every library is loaded up front, artists are
+keyed (see music_sync.artists) and deduped across all of them, and each unique
+artist is searched, fetched and matched once, through the shared response cache
+and journals. Only the follow/save writes, which really are per user, fan out
+to each account. The artist picks and editions follow the same rules as the
+single-user stages: search results are disambiguated against every library's
+titles (see music_sync.disambiguation), and editions collapse by EDITION_RULES.
+
+Catalog calls grow with the number of unique artists, not users x artists.
+"""
+
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+from music_sync.artists import artist_queries, build_artist_index
+from music_sync.disambiguation import disambiguate
+from music_sync.editions import collapse_editions
+from music_sync.journal import Journal
+from music_sync.matching import match_albums
+from music_sync.spotify import SpotifyClient
+from music_sync.workers import DEFAULT_WORKERS
+
+# Most IDs the follow and save endpoints accept per call
+WRITE_BATCH_SIZE = 50
+
+
+def load_libraries(paths: Dict[str, str]) -> pd.DataFrame:
+    """Every user's albums.csv stacked into one frame, with a `user` column."""
+    frames = []
+    for user, path in paths.items():
+        albums = pd.read_csv(path)
+        albums.insert(0, "user", user)
+        frames.append(albums)
+    return pd.concat(frames, ignore_index=True)
+
+
+def resolve_artists(spotify: SpotifyClient, albums: pd.DataFrame, workers: int = DEFAULT_WORKERS, resume: bool = True) -> pd.DataFrame:
+    """
+    One search per unique artist key, across all libraries, and the candidate
+    whose discography has the most of the libraries' albums by them. Returns
+    artist -> artist_key, artist_id, artist_match_score, needs_review.
+    """
+    index = build_artist_index(albums["artist"])
+    queries = artist_queries(index)
+    print(f"{albums['user'].nunique()} libraries, {len(queries)} unique artists.")
+
+    # Same journal as script 2, so artists an interrupted run of either searched aren't searched again
+    journal = Journal("spotify_artist_search", reset=not resume)
+    results = journal.run(queries["artist"], spotify.search_artist, workers=workers)
+
+    # Every library's titles by the artist; discographies come through the response cache
+    keyed = albums.merge(index[["artist", "artist_key"]], on="artist")
+    titles = keyed.groupby("artist_key")["album"].agg(lambda names: list(dict.fromkeys(names.astype(str)))).to_dict()
+    picks = disambiguate(
+        [titles.get(key, []) for key in queries["artist_key"]],
+        results,
+        lambda result, _: [item["name"] for item in spotify.artist_albums(result["id"])["items"]],
+        workers=workers,
+    )
+    journal.finish()
+
+    queries = queries.assign(**{
+        column: [pick[column] if pick else None for pick in picks]
+        for column in ("artist_id", "artist_match_score", "needs_review")
+    })
+    flagged = sum(1 for pick in picks if pick and pick["needs_review"])
+    print(f"Picked {sum(1 for pick in picks if pick)} artists, {flagged} flagged for review (needs_review in the output).")
+    return index[["artist", "artist_key"]].merge(
+        queries[["artist_key", "artist_id", "artist_match_score", "needs_review"]], on="artist_key", how="left",
+    )
+
+
+def fetch_catalog(
+    spotify: SpotifyClient,
+    artist_ids: List[str],
+    workers: int = DEFAULT_WORKERS,
+    resume: bool = True,
+    rules: Optional[Dict[str, int]] = None,
+) -> pd.DataFrame:
+    """One discography fetch per unique artist ID, one edition per album (picked by `rules`, see music_sync.editions)."""
+    artist_ids = list(dict.fromkeys(artist_ids))
+    print(f"Retrieving albums for {len(artist_ids)} artists...")
+
+    # The raw discographies, in a journal of their own: editions are collapsed
+    # after, so a rerun with other rules doesn't reuse the old picks
+    journal = Journal("spotify_multi_discography", reset=not resume)
+    results = journal.run(artist_ids, lambda artist_id: spotify.artist_albums(artist_id)["items"], workers=workers)
+    journal.finish()
+    return pd.DataFrame(
+        [{"artist_id": artist_id, "album_id": item["id"], "name": item["name"], "url": item["url"]}
+         for artist_id, items in zip(artist_ids, results) if items for item in collapse_editions(items, rules)],
+        columns=["artist_id", "album_id", "name", "url"],
+    )
+
+
+def match_catalog(albums: pd.DataFrame, catalog: pd.DataFrame, resume: bool = True) -> pd.DataFrame:
+    """
+    Matches each unique (artist_id, album) once, then joins the album ID back
+    onto every user's rows.
+    """
+    unique = albums[["artist_id", "album"]].dropna().drop_duplicates().reset_index(drop=True)
+    unique["key"] = unique["artist_id"] + "|" + unique["album"].astype(str)
+
+    journal = Journal("spotify_multi_match", reset=not resume)
+    unique = match_albums(unique, catalog, artist_col="artist_id", journal=journal, key_col="key")
+    journal.finish()
+
+    # Multiple IDs per name are usually variants, take the first like script 2 does
+    lookup = catalog.groupby(["artist_id", "name"]).first()
+    unique = unique.join(lookup, on=["artist_id", "album_name_best_match"], how="left")
+
+    return albums.merge(unique.drop(columns="key"), on=["artist_id", "album"], how="left")
+
+
+def sync_user(user: str, spotify: SpotifyClient, albums: pd.DataFrame, workers: int = DEFAULT_WORKERS, resume: bool = True) -> Dict:
+    """Follows and saves whatever this user doesn't have yet. Returns counts written."""
+    albums = albums[albums["user"] == user]
+
+    followed = {item["id"] for item in spotify.followed_artists()}
+    new_follows = [artist_id for artist_id in albums["artist_id"].dropna().unique() if artist_id not in followed]
+
+    saved = {item["id"] for item in spotify.saved_albums()}
+    new_saves = [album_id for album_id in albums["album_id"].dropna().unique() if album_id not in saved]
+
+    print(f"{user}: {len(new_follows)} artists to follow, {len(new_saves)} albums to save.")
+    # The live library was just read in full, so nothing the journals have as written needs skipping
+    follow_journal = Journal(f"spotify_follow.{user}", reset=not resume)
+    follow_journal.forget(new_follows)
+    follows = follow_journal.run_writes(
+        new_follows, lambda ids: spotify.call(spotify.sp.user_follow_artists, ids), batch_size=WRITE_BATCH_SIZE, workers=workers,
+    )
+    follow_journal.finish()
+    save_journal = Journal(f"spotify_save.{user}", reset=not resume)
+    save_journal.forget(new_saves)
+    saves = save_journal.run_writes(
+        new_saves, lambda ids: spotify.call(spotify.sp.current_user_saved_albums_add, ids), batch_size=WRITE_BATCH_SIZE, workers=workers,
+    )
+    save_journal.finish()
+    return {"user": user, "followed": follows, "saved": saves}
+
+
+def sync_libraries(
+    clients: Dict[str, SpotifyClient],
+    paths: Dict[str, str],
+    workers: int = DEFAULT_WORKERS,
+    resume: bool = True,
+    rules: Optional[Dict[str, int]] = None,
+) -> pd.DataFrame:
+    """
+    The whole multi-user pipeline. `clients` and `paths` are keyed by user.
+    Catalog lookups go through the first user's client; writes go through each
+    user's own. `rules` are the edition rules. Returns every user's albums with
+    the matched IDs.
+    """
+    albums = load_libraries(paths)
+    catalog_client = next(iter(clients.values()))
+
+    artists = resolve_artists(catalog_client, albums, workers=workers, resume=resume)
+    albums = albums.merge(artists, on="artist", how="left")
+
+    catalog = fetch_catalog(catalog_client, artists["artist_id"].dropna().tolist(), workers=workers, resume=resume, rules=rules)
+    albums = match_catalog(albums, catalog, resume=resume)
+
+    summary = [sync_user(user, clients[user], albums, workers=workers, resume=resume) for user in paths]
+    print(pd.DataFrame(summary).to_string(index=False))
+    return albums
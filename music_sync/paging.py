@@ -0,0 +1,88 @@
+"""
+Generator-based pagination for paged API responses.
+
+Items are yielded page by page. While the caller works through one page the next
+one is already being fetched in the background. max_items never costs an extra
+request: once the pages so far hold that many items, nothing more is fetched.
+Closing the generator early does cost one: the prefetched page's request is
+already in flight and can't be taken back, so callers that expect to stop
+partway (like the library reads that stop at the first known ID) pass
+prefetch=False.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, Optional
+
+
+def iter_pages(
+    first_page: Dict,
+    fetch_next: Callable[[Dict], Optional[Dict]],
+    prefetch: bool = True,
+    last: Optional[Callable[[Dict], bool]] = None,
+) -> Iterator[Dict]:
+    """
+    Yields first_page, then fetch_next(page) until it returns None. fetch_next
+    should return None when the page says there is nothing after it. last(page)
+    (called once per page, in order) returning True means no page after it is
+    wanted, so none is fetched.
+    """
+    if not prefetch:
+        page = first_page
+        while page is not None:
+            yield page
+            page = None if last and last(page) else fetch_next(page)
+        return
+
+    pool = ThreadPoolExecutor(max_workers=1)
+    try:
+        page = first_page
+        while page is not None:
+            upcoming = None if last and last(page) else pool.submit(fetch_next, page)
+            yield page
+            page = upcoming.result() if upcoming else None
+    finally:
+        # If the caller stopped early, don't wait on (or keep) the prefetched page
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def iter_items(
+    first_page: Dict,
+    fetch_next: Callable[[Dict], Optional[Dict]],
+    max_items: Optional[int] = None,
+    prefetch: bool = True,
+) -> Iterator:
+    fetched = 0
+
+    def last(page: Dict) -> bool:
+        nonlocal fetched
+        fetched += len(page["items"])
+        return max_items is not None and fetched >= max_items
+
+    count = 0
+    for page in iter_pages(first_page, fetch_next, prefetch=prefetch, last=last):
+        for item in page["items"]:
+            yield item
+            count += 1
+            if max_items is not None and count >= max_items:
+                return
+
+
+def iter_offset_items(
+    fetch_page: Callable[[int, int], List],
+    page_size: int,
+    max_items: Optional[int] = None,
+    prefetch: bool = True,
+) -> Iterator:
+    """
+    For APIs that just take limit/offset and return a list (like tidalapi).
+    fetch_page(limit, offset) is called until a page comes back short.
+    """
+    def fetch(offset: int) -> Dict:
+        return {"items": fetch_page(page_size, offset), "offset": offset}
+
+    def fetch_next(page: Dict) -> Optional[Dict]:
+        if len(page["items"]) < page_size:
+            return None
+        return fetch(page["offset"] + page_size)
+
+    return iter_items(fetch(0), fetch_next, max_items=max_items, prefetch=prefetch)
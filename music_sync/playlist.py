@@ -0,0 +1,242 @@
+"""
+Incremental playlist sync.
+
+Instead of emptying the playlist and re-adding every track (~100 write calls for
+10k tracks, with the playlist empty partway through), read what's there now,
+and only send the tracks that need to be removed or added, 100 per call.
+
+With preserve_order=True new tracks are inserted at their position in the
+desired order rather than appended. If the tracks we keep are themselves out of
+order (or duplicated), there's no cheap fix, so we fall back to a full rewrite.
+
+Given a journal, every write batch is journaled before and after it's sent.
+Nothing is skipped based on the journal: the diff is always taken against the
+live playlist, so a batch that landed before a crash is never sent again.
+
+A playlist holds at most 10k tracks, so bigger collections are split across
+"My CDs 1".."My CDs N" by a hash of each album's ID. The hash doesn't depend on
+the rest of the collection, so saving or removing an album only changes the one
+shard it hashes to (until the shard count itself changes, which moves most
+albums). The shards are found (or created) from one scan of the user's
+playlists and synced concurrently. When the shard count changes, the
+playlists it no longer uses (the plain "My CDs" once there are shards, or
+numbered shards past the new count) only hold tracks that are now in the
+other shards, so they're emptied rather than left duplicating them.
+"""
+
+import hashlib
+import math
+import re
+from typing import Callable, Dict, List, Optional, Tuple
+
+from music_sync.journal import Journal
+from music_sync.spotify import SpotifyClient
+from music_sync.workers import DEFAULT_WORKERS, chunker, map_concurrent
+
+# Most tracks the playlist endpoints accept per call
+PLAYLIST_BATCH_SIZE = 100
+
+MAX_PLAYLIST_TRACKS = 10_000
+
+# Tracks per shard when picking the shard count, leaving room under the cap for
+# uneven hashing and for the collection to grow before it has to be reshuffled
+SHARD_TRACKS = 8_000
+
+
+def playlist_track_ids(spotify: SpotifyClient, playlist_id: str) -> List[str]:
+    first_page = spotify.call(
+        spotify.sp.playlist_items,
+        playlist_id,
+        fields="items(track(id)),next",
+        limit=PLAYLIST_BATCH_SIZE,
+        additional_types=("track",),
+    )
+    # Local files and removed tracks come back without an ID
+    return [item["track"]["id"] for item in spotify.paginate(first_page) if item.get("track") and item["track"].get("id")]
+
+
+def diff_tracks(current: List[str], desired: List[str]) -> Tuple[List[str], List[str]]:
+    """Returns (to_add, to_remove), each in the order they appear."""
+    current_set = set(current)
+    desired_set = set(desired)
+    to_add = [track_id for track_id in desired if track_id not in current_set]
+    to_remove = list(dict.fromkeys(track_id for track_id in current if track_id not in desired_set))
+    return to_add, to_remove
+
+
+def journaled(journal: Optional[Journal], action: str, fn: Callable[[List[str]], object], chunk: List[str]):
+    if journal is None:
+        return fn(chunk)
+
+    keys = [f"{action}:{track_id}" for track_id in chunk]
+    journal.begin(keys)
+    try:
+        result = fn(chunk)
+    except Exception as e:
+        journal.fail(keys, e)
+        raise
+    journal.record(keys)
+    return result
+
+
+def rewrite_playlist(spotify: SpotifyClient, playlist_id: str, track_ids: List[str], journal: Optional[Journal] = None) -> int:
+    chunks = list(chunker(track_ids, PLAYLIST_BATCH_SIZE)) or [[]]
+    journaled(journal, "replace", lambda chunk: spotify.call(spotify.sp.playlist_replace_items, playlist_id, chunk), chunks[0])
+    for chunk in chunks[1:]:
+        journaled(journal, "add", lambda chunk: spotify.call(spotify.sp.playlist_add_items, playlist_id, chunk), chunk)
+    return len(chunks)
+
+
+def insert_in_order(spotify: SpotifyClient, playlist_id: str, desired: List[str], new: set, journal: Optional[Journal] = None) -> int:
+    # Once the kept tracks are a subsequence of `desired`, walking `desired`
+    # front to back means everything before index i is already in place, so each
+    # run of new tracks can go straight in at its own index.
+    calls = 0
+    i = 0
+    while i < len(desired):
+        if desired[i] not in new:
+            i += 1
+            continue
+
+        start = i
+        while i < len(desired) and desired[i] in new:
+            i += 1
+        for offset, chunk in enumerate(chunker(desired[start:i], PLAYLIST_BATCH_SIZE)):
+            position = start + offset * PLAYLIST_BATCH_SIZE
+            journaled(journal, "add", lambda chunk: spotify.call(spotify.sp.playlist_add_items, playlist_id, chunk, position=position), chunk)
+            calls += 1
+
+    return calls
+
+
+def sync_playlist(
+    spotify: SpotifyClient,
+    playlist_id: str,
+    track_ids: List[str],
+    preserve_order: bool = False,
+    dry_run: bool = False,
+    journal: Optional[Journal] = None,
+    label: str = "Playlist",
+) -> Dict:
+    desired = list(dict.fromkeys(track_ids))
+    current = playlist_track_ids(spotify, playlist_id)
+    to_add, to_remove = diff_tracks(current, desired)
+
+    summary = {"current": len(current), "desired": len(desired), "added": len(to_add), "removed": len(to_remove), "calls": 0}
+    print(f"{label} has {len(current)} tracks, want {len(desired)}: {len(to_add)} to add, {len(to_remove)} to remove.")
+
+    if dry_run or (not to_add and not to_remove):
+        return summary
+
+    if preserve_order:
+        desired_set = set(desired)
+        kept = [track_id for track_id in current if track_id in desired_set]
+        current_set = set(current)
+        if kept != [track_id for track_id in desired if track_id in current_set]:
+            print(f"{label}: existing tracks are out of order, rewriting the whole playlist.")
+            summary["calls"] = rewrite_playlist(spotify, playlist_id, desired, journal=journal)
+            summary["rewritten"] = True
+            return summary
+
+    for chunk in chunker(to_remove, PLAYLIST_BATCH_SIZE):
+        journaled(journal, "remove", lambda chunk: spotify.call(spotify.sp.playlist_remove_all_occurrences_of_items, playlist_id, chunk), chunk)
+        summary["calls"] += 1
+
+    if preserve_order:
+        summary["calls"] += insert_in_order(spotify, playlist_id, desired, set(to_add), journal=journal)
+    else:
+        for chunk in chunker(to_add, PLAYLIST_BATCH_SIZE):
+            journaled(journal, "add", lambda chunk: spotify.call(spotify.sp.playlist_add_items, playlist_id, chunk), chunk)
+            summary["calls"] += 1
+
+    return summary
+
+
+def shard_of(album_id: str, shards: int) -> int:
+    # Not hash(), which is salted per process
+    digest = hashlib.sha1(album_id.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % shards
+
+
+def shard_name(name: str, shard: int, shards: int) -> str:
+    return name if shards == 1 else f"{name} {shard + 1}"
+
+
+def stale_shards(playlist_names: List[str], name: str, shards: int) -> List[str]:
+    """The plain and numbered `name` playlists that aren't one of the `shards` shards."""
+    current = {shard_name(name, i, shards) for i in range(shards)}
+    numbered = [f"{name} {n}" for n in range(1, existing_shards(playlist_names, name) + 1)]
+    return [playlist for playlist in [name, *numbered] if playlist in playlist_names and playlist not in current]
+
+
+def existing_shards(playlist_names: List[str], name: str) -> int:
+    """Highest N among the "{name} N" playlists, or 0."""
+    pattern = re.compile(rf"{re.escape(name)} (\d+)")
+    numbers = [int(match.group(1)) for match in map(pattern.fullmatch, playlist_names) if match]
+    return max(numbers, default=0)
+
+
+def shard_tracks(album_tracks: List[Tuple[str, List[str]]], shards: int) -> List[List[str]]:
+    """Splits (album_id, track_ids) pairs across the shards, keeping album order within each."""
+    buckets: List[List[str]] = [[] for _ in range(shards)]
+    for album_id, track_ids in album_tracks:
+        buckets[shard_of(album_id, shards)] += track_ids
+    return [list(dict.fromkeys(bucket)) for bucket in buckets]
+
+
+def sync_sharded(
+    spotify: SpotifyClient,
+    name: str,
+    album_tracks: List[Tuple[str, List[str]]],
+    shards: Optional[int] = None,
+    preserve_order: bool = False,
+    journal: Optional[Journal] = None,
+    workers: int = DEFAULT_WORKERS,
+) -> Dict:
+    """
+    Syncs album_tracks ((album_id, track_ids) pairs, in playlist order) into
+    `shards` playlists. Without a shard count, keeps as many shards as already
+    exist, or as many as the collection needs at SHARD_TRACKS each; a single
+    shard is just the playlist called `name`. Playlists left over from another
+    shard count are emptied (see stale_shards).
+    """
+    playlists = {playlist["name"]: playlist["id"] for playlist in spotify.playlists()}
+
+    total = len({track_id for _, track_ids in album_tracks for track_id in track_ids})
+    if shards is None:
+        shards = max(existing_shards(list(playlists), name), math.ceil(total / SHARD_TRACKS), 1)
+
+    buckets = shard_tracks(album_tracks, shards)
+    oversized = [i for i, bucket in enumerate(buckets) if len(bucket) > MAX_PLAYLIST_TRACKS]
+    if oversized:
+        raise ValueError(
+            f"{len(oversized)} of {shards} shards would have more than {MAX_PLAYLIST_TRACKS} tracks "
+            f"({total} tracks in all); use at least {math.ceil(total / SHARD_TRACKS)} shards."
+        )
+
+    names = [shard_name(name, i, shards) for i in range(shards)]
+    for shard in names:
+        if shard not in playlists:
+            playlists[shard] = spotify.create_playlist(shard)["id"]
+
+    print(f"Syncing {total} tracks across {shards} playlists...")
+    summaries = map_concurrent(
+        lambda i: sync_playlist(spotify, playlists[names[i]], buckets[i], preserve_order=preserve_order, journal=journal, label=names[i]),
+        range(shards),
+        workers=workers,
+    )
+
+    # Emptied after the shards are filled, so no track is missing from all of them in between
+    stale = stale_shards(list(playlists), name, shards)
+    if stale:
+        print(f"Emptying {len(stale)} playlists the {shards} shards replace (delete them in Spotify if you like): {', '.join(stale)}")
+    emptied = map_concurrent(
+        lambda playlist: sync_playlist(spotify, playlists[playlist], [], journal=journal, label=playlist),
+        stale,
+        workers=workers,
+    )
+
+    summary = {key: sum(shard[key] for shard in summaries + emptied) for key in ("current", "desired", "added", "removed", "calls")}
+    summary["shards"] = dict(zip(names, summaries))
+    summary["stale"] = dict(zip(stale, emptied))
+    return summary
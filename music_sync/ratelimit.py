@@ -0,0 +1,178 @@
+"""
+Shared, adaptive rate limiter for API calls.
+
+Replaces the fixed `time.sleep(.5)` / `DELAY` between calls. All worker threads
+draw from one token bucket, so throughput is bounded by the service's limits
+rather than by a hard-coded pause:
+
+- every call waits for a token (rate per second, with a small burst allowance)
+- on HTTP 429 the whole bucket pauses for `Retry-After`, and the rate is halved
+- every success nudges the rate back up towards `max_rate`
+- 429s, 5xx and connection errors are retried with jittered exponential backoff
+"""
+
+import functools
+import random
+import threading
+import time
+from typing import Callable, Optional
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+def _response(exc: Exception):
+    # tidalapi raises TooManyRequests from inside its `except HTTPError`, so the
+    # response (and its Retry-After) is only on the chained exception
+    for e in (exc, exc.__cause__, exc.__context__):
+        if e is not None and getattr(e, "response", None) is not None:
+            return e.response
+    return None
+
+
+def http_status(exc: Exception) -> Optional[int]:
+    # spotipy.SpotifyException has http_status, requests.HTTPError has a response
+    status = getattr(exc, "http_status", None)
+    if status is None and type(exc).__name__ == "TooManyRequests":
+        status = 429
+    if status is None and _response(exc) is not None:
+        status = getattr(_response(exc), "status_code", None)
+    return status
+
+
+def retry_after(exc: Exception) -> Optional[float]:
+    """Seconds the server asked us to wait, if it told us."""
+    value = getattr(exc, "retry_after", None)
+    if value is None:
+        headers = getattr(exc, "headers", None)
+        if headers is None and _response(exc) is not None:
+            headers = getattr(_response(exc), "headers", None)
+        if headers:
+            value = headers.get("Retry-After")
+
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return value if value >= 0 else None
+
+
+def is_retryable(exc: Exception) -> bool:
+    # requests' ConnectionError / Timeout are OSError subclasses
+    return http_status(exc) in RETRYABLE_STATUSES or isinstance(exc, OSError)
+
+
+class RateLimiter:
+    def __init__(
+        self,
+        rate: float,
+        burst: Optional[int] = None,
+        min_rate: float = 0.5,
+        max_rate: Optional[float] = None,
+        max_retries: int = 5,
+        max_backoff: float = 60.0,
+    ):
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self.min_rate = min_rate
+        self.max_rate = max_rate or rate * 2
+        self.max_retries = max_retries
+        self.max_backoff = max_backoff
+
+        self.throttled_count = 0
+        self.retry_count = 0
+        self.sleep_time = 0.0
+
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def acquire(self) -> float:
+        """Blocks until a call is allowed. Returns the time spent waiting."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+
+                if now < self._paused_until:
+                    delay = self._paused_until - now
+                elif self._tokens >= 1:
+                    self._tokens -= 1
+                    self.sleep_time += waited
+                    self._slept(waited)
+                    return waited
+                else:
+                    delay = (1 - self._tokens) / self.rate
+
+            time.sleep(delay)
+            waited += delay
+
+    def _slept(self, seconds: float):
+        self._local.slept = getattr(self._local, "slept", 0.0) + seconds
+
+    def take_sleep(self) -> float:
+        """Seconds this thread has slept in the limiter since the last call. Used by Metrics."""
+        slept = getattr(self._local, "slept", 0.0)
+        self._local.slept = 0.0
+        return slept
+
+    def throttle(self, wait: Optional[float] = None):
+        """Called on a 429: pause every worker and back off the rate."""
+        with self._lock:
+            self.throttled_count += 1
+            now = time.monotonic()
+            # 429s that land while we're already paused are from requests sent
+            # before the first one, so they don't count as a new overload
+            if now >= self._paused_until:
+                self.rate = max(self.min_rate, self.rate / 2)
+            self._tokens = 0
+            if wait is not None:
+                self._paused_until = max(self._paused_until, now + wait)
+
+    def succeeded(self):
+        # Additive increase, so we creep back up after a throttle
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + 0.1)
+
+    def backoff(self, attempt: int) -> float:
+        # "Full jitter": random delay up to an exponentially growing cap
+        return random.uniform(0, min(self.max_backoff, 2 ** attempt))
+
+    def call(self, fn: Callable, *args, **kwargs):
+        attempt = 0
+        while True:
+            self.acquire()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+
+                wait = retry_after(e)
+                if http_status(e) == 429:
+                    self.throttle(wait)
+                if wait is None:
+                    wait = self.backoff(attempt)
+                else:
+                    # Don't have every worker wake up at the same instant
+                    wait += random.uniform(0, 1)
+
+                attempt += 1
+                with self._lock:
+                    self.retry_count += 1
+                    self.sleep_time += wait
+                self._slept(wait)
+                time.sleep(wait)
+                continue
+
+            self.succeeded()
+            return result
+
+    def wrap(self, fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            return self.call(fn, *args, **kwargs)
+        return wrapper
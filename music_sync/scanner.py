@@ -0,0 +1,118 @@
+"""
+Incremental scanner for a local library organized like: /Artist - Album/01 - Track.mp3
+
+Keeps a manifest of every album folder's name, mtime and inode from the last
+scan, so each run can report just what changed (added, removed, renamed or
+modified folders) and the rest of the pipeline can work on deltas. If the
+library folder's own mtime hasn't moved, no folders were added, removed or
+renamed, so the per-folder scan is skipped entirely.
+"""
+
+import json
+import os
+from typing import Dict, List, Tuple
+
+import pandas as pd
+
+MANIFEST_PATH = "data/local_manifest.json"
+
+
+def load_manifest(path: str = MANIFEST_PATH) -> Dict:
+    if not os.path.exists(path):
+        return {"root_mtime": None, "folders": {}}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(manifest: Dict, path: str = MANIFEST_PATH):
+    # Write to a temp file and swap it in, so a crash never leaves half a manifest
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path)
+
+
+def scan_folders(music_dir: str) -> Dict[str, Dict]:
+    folders = {}
+    with os.scandir(music_dir) as entries:
+        for entry in entries:
+            if not entry.is_dir():
+                continue
+            stat = entry.stat()
+            folders[entry.name] = {"mtime": stat.st_mtime, "inode": entry.inode()}
+    return folders
+
+
+def diff_folders(old: Dict[str, Dict], new: Dict[str, Dict]) -> Dict[str, List]:
+    added = [name for name in new if name not in old]
+    removed = [name for name in old if name not in new]
+    modified = [name for name in new if name in old and new[name]["mtime"] != old[name]["mtime"]]
+
+    # A folder that disappeared and one that appeared with the same inode is a rename.
+    # Some network filesystems report 0 for every inode, so those never pair up.
+    removed_by_inode = {old[name]["inode"]: name for name in removed if old[name].get("inode")}
+    renamed = []
+    for name in list(added):
+        previous = removed_by_inode.pop(new[name]["inode"], None)
+        if previous is not None:
+            renamed.append((previous, name))
+            added.remove(name)
+            removed.remove(previous)
+
+    return {"added": added, "removed": removed, "renamed": renamed, "modified": modified}
+
+
+def parse_folders(folders: List[str]) -> pd.DataFrame:
+    albums_df = pd.DataFrame({"folder": folders}, dtype="string")
+
+    # partition() on an empty Series comes back without its three columns
+    parts = albums_df["folder"].str.partition("-") if len(folders) else pd.DataFrame({0: [], 2: []}, dtype="string")
+    albums_df["artist"] = parts[0].str.strip()
+    albums_df["album"] = parts[2].str.strip()
+
+    # Clean up ", The" artists
+    mask = albums_df["artist"].str.endswith(", The")
+    albums_df.loc[mask, "artist"] = "The " + albums_df.loc[mask, "artist"].str[:-len(", The")]
+
+    return albums_df
+
+
+def scan_library(music_dir: str, manifest_path: str = MANIFEST_PATH, full: bool = False) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Returns (albums, changes). `albums` is every album folder, `changes` has one
+    row per added / removed / renamed / modified folder with a `change` column.
+    Pass full=True to stat every folder even if the library folder looks untouched.
+    """
+    manifest = load_manifest(manifest_path)
+    old = manifest["folders"]
+
+    root_mtime = os.stat(music_dir).st_mtime
+    if not full and old and manifest["root_mtime"] == root_mtime:
+        print("Library folder unchanged since last scan.")
+        new = old
+    else:
+        new = scan_folders(music_dir)
+
+    changes = diff_folders(old, new)
+    print(
+        f"Scanned {len(new)} folders: {len(changes['added'])} added, {len(changes['removed'])} removed, "
+        f"{len(changes['renamed'])} renamed, {len(changes['modified'])} modified."
+    )
+
+    save_manifest({"root_mtime": root_mtime, "folders": new}, manifest_path)
+
+    albums_df = parse_folders(sorted(new))
+
+    change_rows = (
+        [(name, "added", None) for name in changes["added"]]
+        + [(name, "removed", None) for name in changes["removed"]]
+        + [(new_name, "renamed", old_name) for old_name, new_name in changes["renamed"]]
+        + [(name, "modified", None) for name in changes["modified"]]
+    )
+    changes_df = parse_folders([name for name, _, _ in change_rows])
+    changes_df["change"] = [change for _, change, _ in change_rows]
+    changes_df["previous_folder"] = [previous for _, _, previous in change_rows]
+
+    return albums_df, changes_df
@@ -0,0 +1,223 @@
+"""
+HTTP sessions and logins that hold up over long unattended runs.
+
+Connections: each Spotify client gets one requests.Session with a keep-alive
+pool sized to the worker count, so concurrent calls reuse open connections
+instead of each paying for a new TCP + TLS handshake. pool_block makes a
+thread wait for a free connection rather than open a throwaway one past the
+limit. (Tidal worker sessions are used by one thread at a time, so each one's
+own keep-alive connection is enough.)
+
+Tokens: Spotify access tokens last an hour and the scripts fetched one at
+startup, so big runs started failing partway through. Now the token is
+refreshed REFRESH_MARGIN before it expires, by whichever thread gets there
+first while the others wait, and written back with an atomic rename, so a
+crash mid-write can't leave a torn token file. Tidal gets the same, through
+TidalLogin, which also reads and writes one session file (the scripts read
+.tidal_session.txt but wrote tidal_session.txt, so every run logged in again).
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Refresh tokens this many seconds before they expire
+REFRESH_MARGIN = 300
+
+TIDAL_SESSION_PATH = ".tidal_session.txt"
+
+
+def pooled_session(pool_size: int) -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_maxsize=pool_size, pool_block=True)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def write_atomic(path: str, text: str):
+    """Writes to a temp file next to `path`, then renames it over `path`."""
+    directory = os.path.dirname(path) or "."
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + ".")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+##############################
+# Spotify
+##############################
+
+def spotify_client(username: str, scope: str, pool_size: int):
+    """
+    A spotipy.Spotify logged in as `username`, refreshing its own token. The
+    token lives in .cache-<username>, like prompt_for_user_token kept it, so
+    existing logins carry over. Logs in (or refreshes) right away, so a
+    browser prompt can only happen at startup.
+    """
+    import spotipy
+    from spotipy.cache_handler import CacheHandler
+    from spotipy.oauth2 import SpotifyOAuth
+
+    class TokenFile(CacheHandler):
+        # spotipy asks for the token before every request; read the file once, not every time
+        def __init__(self, path: str):
+            self.path = path
+            self._token: Optional[Dict] = None
+            self._loaded = False
+
+        def get_cached_token(self) -> Optional[Dict]:
+            if not self._loaded:
+                self._loaded = True
+                try:
+                    with open(self.path) as f:
+                        self._token = json.load(f)
+                except (OSError, ValueError):
+                    self._token = None
+            return self._token
+
+        def save_token_to_cache(self, token_info: Dict):
+            self._token = token_info
+            write_atomic(self.path, json.dumps(token_info))
+
+    class RefreshingOAuth(SpotifyOAuth):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self._lock = threading.Lock()
+
+        @staticmethod
+        def is_token_expired(token_info: Dict) -> bool:
+            return token_info["expires_at"] - int(time.time()) < REFRESH_MARGIN
+
+        def get_access_token(self, *args, **kwargs):
+            # Every worker thread asks for the token; only one of them refreshes it
+            with self._lock:
+                return super().get_access_token(*args, **kwargs)
+
+    auth = RefreshingOAuth(scope=scope, cache_handler=TokenFile(f".cache-{username}"))
+    if not auth.get_access_token(as_dict=False):
+        raise SystemExit(f"Can't get a Spotify token for {username}")
+
+    # Retries are handled by our rate limiter, so it can see 429s and slow everyone down.
+    # A plain requests session skips spotipy's urllib3 retries, which would turn a 429
+    # into a "Max Retries" error without its Retry-After header.
+    return spotipy.Spotify(auth_manager=auth, requests_session=pooled_session(pool_size))
+
+
+##############################
+# Tidal
+##############################
+
+def parse_expiry(text: str) -> Optional[datetime]:
+    """
+    The expiry line of a session file, as a naive UTC datetime (what tidalapi
+    uses). Takes str(datetime), with or without microseconds, ISO 8601, or a
+    Unix timestamp; None if it's none of those.
+    """
+    text = text.strip()
+    try:
+        expiry = datetime.fromisoformat(text)
+    except ValueError:
+        try:
+            return datetime.fromtimestamp(float(text), timezone.utc).replace(tzinfo=None)
+        except ValueError:
+            return None
+    if expiry.tzinfo is not None:
+        expiry = expiry.astimezone(timezone.utc).replace(tzinfo=None)
+    return expiry
+
+
+def seconds_left(expiry: Optional[datetime]) -> float:
+    if expiry is None:
+        # Unknown: let tidalapi refresh when the API says it's expired
+        return float("inf")
+    return (expiry.replace(tzinfo=timezone.utc) - datetime.now(timezone.utc)).total_seconds()
+
+
+class TidalLogin:
+    """
+    The Tidal OAuth token, shared by the main session and TidalClient's worker
+    sessions, and kept in the session file.
+    """
+
+    def __init__(self, session, path: str = TIDAL_SESSION_PATH):
+        self.session = session
+        self.path = path
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path: str = TIDAL_SESSION_PATH) -> "TidalLogin":
+        """Logs in from the session file, or interactively when there's no usable one."""
+        import tidalapi
+
+        login = cls(tidalapi.Session(), path)
+        if not login._load():
+            login.session.login_oauth_simple()
+            login.save()
+
+        if not login.session.check_login():
+            raise SystemExit("Failed to login to Tidal")
+        print(f"Logged in as {login.session.user.username}")
+        return login
+
+    def _load(self) -> bool:
+        if not os.path.exists(self.path):
+            print("No existing session found, starting login process...")
+            return False
+
+        with open(self.path, "r") as f:
+            lines = [line.strip() for line in f.readlines()]
+        if len(lines) < 4:
+            print("Invalid session file, need to login again")
+            return False
+
+        token_type, access_token, refresh_token = lines[:3]
+        session = self.session
+        session.token_type, session.access_token, session.refresh_token = token_type, access_token, refresh_token
+        session.expiry_time = parse_expiry(lines[3])
+        try:
+            self.fresh()
+        except Exception as e:
+            print(f"Couldn't refresh the saved session ({e}), need to login again")
+            return False
+
+        loaded = session.load_oauth_session(session.token_type, session.access_token, session.refresh_token, session.expiry_time)
+        print("Loaded existing Tidal session" if loaded else "Existing session expired, need to login again")
+        return loaded
+
+    def save(self):
+        session = self.session
+        expiry = session.expiry_time.isoformat(sep=" ") if session.expiry_time else ""
+        write_atomic(self.path, f"{session.token_type}\n{session.access_token}\n{session.refresh_token}\n{expiry}\n")
+
+    def fresh(self, session=None):
+        """
+        Refreshes the token if it expires within REFRESH_MARGIN (once, by
+        whichever thread gets here first), saves it, and copies it to
+        `session` (a worker session) if that has an older one.
+        """
+        with self._lock:
+            main = self.session
+            if main.refresh_token and seconds_left(main.expiry_time) < REFRESH_MARGIN:
+                if main.token_refresh(main.refresh_token):
+                    self.save()
+                    print("Refreshed the Tidal token.")
+
+            if session is not None and session is not main and session.access_token != main.access_token:
+                session.token_type = main.token_type
+                session.access_token = main.access_token
+                session.refresh_token = main.refresh_token
+                session.expiry_time = main.expiry_time
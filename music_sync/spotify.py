@@ -0,0 +1,233 @@
+"""
+Spotify helpers shared by the Spotify scripts.
+
+SpotifyClient wraps a `spotipy.Spotify` with the shared rate limiter, the on-disk
+response cache and full pagination, so callers never see a truncated first page.
+"""
+
+import math
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from music_sync.cache import ResponseCache
+from music_sync.paging import iter_items, iter_pages
+from music_sync.ratelimit import RateLimiter
+from music_sync.workers import DEFAULT_WORKERS, chunker, map_concurrent
+
+PAGE_SIZE = 50
+
+# Most IDs sp.albums / sp.tracks accept per call
+ALBUMS_BATCH_SIZE = 20
+TRACKS_BATCH_SIZE = 50
+
+
+# Album search results per call
+SEARCH_LIMIT = 10
+
+
+def sample(items: List[Dict], n: int = 5) -> str:
+    return ", ".join([item["name"] for item in items[0:n]])
+
+
+def album_query(artist: str, title: str) -> str:
+    # Field filters, quoted so multi-word names stay together
+    return " ".join(f'{field}:"{str(value).replace(chr(34), "")}"' for field, value in (("album", title), ("artist", artist)))
+
+
+def _album(item: Dict) -> Dict:
+    # Only keep what we use, the full album objects are mostly market lists
+    return {
+        "id": item["id"],
+        "name": item["name"],
+        "url": item["external_urls"]["spotify"],
+        "release_date": item.get("release_date"),
+        "total_tracks": item.get("total_tracks"),
+    }
+
+
+class SpotifyClient:
+    def __init__(self, sp, limiter: Optional[RateLimiter] = None, cache: Optional[ResponseCache] = None):
+        self.sp = sp
+        self.limiter = limiter or RateLimiter(rate=10)
+        self.cache = cache
+
+    def call(self, fn, *args, **kwargs):
+        return self.limiter.call(fn, *args, **kwargs)
+
+    def cached(self, endpoint: str, fn, *args, **kwargs):
+        # Only cache misses go through the rate limiter
+        if self.cache is None:
+            return fn(*args, **kwargs)
+        return self.cache.fetch(endpoint, fn, *args, **kwargs)
+
+    def _next(self, key: Optional[str] = None):
+        def fetch_next(page: Dict) -> Optional[Dict]:
+            if not page.get("next"):
+                return None
+            resp = self.call(self.sp.next, page)
+            return resp[key] if key else resp
+        return fetch_next
+
+    def pages(self, first_page: Dict, key: Optional[str] = None, prefetch: bool = True) -> Iterator[Dict]:
+        """Yields first_page and every page after it. `key` unwraps e.g. {"artists": {...}}."""
+        return iter_pages(first_page, self._next(key), prefetch=prefetch)
+
+    def paginate(self, first_page: Dict, key: Optional[str] = None, max_items: Optional[int] = None) -> Iterator[Dict]:
+        """Yields items from first_page and every page after it."""
+        return iter_items(first_page, self._next(key), max_items=max_items)
+
+    ##############################
+    # Library
+    ##############################
+
+    def followed_artists(self) -> List[Dict]:
+        resp = self.call(self.sp.current_user_followed_artists, limit=PAGE_SIZE)
+
+        existing_follows = []
+        for page in self.pages(resp["artists"], key="artists"):
+            artists = [{"id": item["id"], "name": item["name"]} for item in page["items"]]
+            print(f"Retrieved {len(artists)} artists. Sample: {sample(artists)}")
+            existing_follows += artists
+
+        return existing_follows
+
+    def saved_albums(self, known: Optional[set] = None) -> List[Dict]:
+        """
+        Saved albums, most recently saved first. Given the IDs already known,
+        stops at the first of them: everything after it was saved earlier.
+        """
+        resp = self.call(self.sp.current_user_saved_albums, limit=PAGE_SIZE)
+
+        saved_albums = []
+        # When stopping early, don't prefetch a page we won't need
+        for page in self.pages(resp, prefetch=not known):
+            albums = [{
+                "id": item["album"]["id"],
+                "name": item["album"]["name"],
+                "artist_id": item["album"]["artists"][0]["id"],
+                "artist_name": item["album"]["artists"][0]["name"],
+                "added_at": item["added_at"],
+            } for item in page["items"]]
+            seen = next((i for i, album in enumerate(albums) if album["id"] in (known or ())), None)
+            if seen is not None:
+                saved_albums += albums[:seen]
+                print(f"Retrieved {seen} new albums, then reached albums saved before.")
+                break
+            print(f"Retrieved {len(albums)} albums. Sample: {sample(albums)}")
+            saved_albums += albums
+
+        return saved_albums
+
+    def playlists(self) -> List[Dict]:
+        """Every playlist in the user's library, in one paginated scan."""
+        resp = self.call(self.sp.current_user_playlists, limit=PAGE_SIZE)
+        return [{"id": item["id"], "name": item["name"]} for item in self.paginate(resp)]
+
+    def create_playlist(self, name: str, public: bool = False) -> Dict:
+        user_id = self.call(self.sp.current_user)["id"]
+        resp = self.call(self.sp.user_playlist_create, user_id, name, public=public)
+        print(f"Created playlist {name}.")
+        return {"id": resp["id"], "name": resp["name"]}
+
+    ##############################
+    # Catalog
+    ##############################
+
+    def search_artist(self, name: str, limit: int = 3) -> List[Dict]:
+        resp = self.cached("spotify.search", self.limiter.wrap(self.sp.search), name, limit=limit, type="artist")
+        return resp["artists"]["items"]
+
+    def _search_albums(self, query: str, limit: int) -> List[Dict]:
+        resp = self.call(self.sp.search, query, limit=limit, type="album")
+        return [dict(_album(item), artist_ids=[artist["id"] for artist in item["artists"]]) for item in resp["albums"]["items"]]
+
+    def search_albums(self, artist: str, title: str, limit: int = SEARCH_LIMIT) -> List[Dict]:
+        """Albums named like `title` by artists named like `artist` (with their artist_ids), in one call."""
+        return self.cached("spotify.album_search", self._search_albums, album_query(artist, title), limit)
+
+    def album_search_cached(self, artist: str, title: str, limit: int = SEARCH_LIMIT) -> bool:
+        """Whether search_albums would be answered from the cache."""
+        return self.cache is not None and self.cache.get("spotify.album_search", album_query(artist, title), limit)[0]
+
+    def discography_size(self, artist_id: str, album_type: str = "album") -> Tuple[Optional[int], bool]:
+        """
+        (total, cached): the artist's album count as of the last fetch (None if
+        it was never fetched), and whether artist_albums would be answered from the cache.
+        """
+        if self.cache is None:
+            return None, False
+        hit, resp = self.cache.get("spotify.discography", artist_id, album_type=album_type)
+        if not hit:
+            resp = self.cache.peek("spotify.discography", artist_id, album_type=album_type)
+        return (resp["total"] if resp else None), hit
+
+    def _fetch_artist_albums(self, artist_id: str, album_type: str = "album") -> Dict:
+        first_page = self.call(self.sp.artist_albums, artist_id, album_type=album_type, limit=PAGE_SIZE)
+        albums = [_album(item) for item in self.paginate(first_page)]
+        return {"total": first_page["total"], "items": albums}
+
+    def artist_albums(self, artist_id: str, album_type: str = "album") -> Dict:
+        """The artist's full discography, as {"total": n, "items": [...]}."""
+        return self.cached("spotify.discography", self._fetch_artist_albums, artist_id, album_type=album_type)
+
+    def album_tracks(self, album_id: str) -> List[Dict]:
+        first_page = self.call(self.sp.album_tracks, album_id, limit=PAGE_SIZE)
+        return list(self.paginate(first_page))
+
+    def full_albums(self, album_ids: List[str], workers: int = DEFAULT_WORKERS) -> List[Dict]:
+        """Full album objects, 20 per call with batches running concurrently. Unknown IDs are skipped."""
+        batches = list(chunker(list(album_ids), ALBUMS_BATCH_SIZE))
+        responses = map_concurrent(lambda ids: self.call(self.sp.albums, ids), batches, workers=workers)
+        # Unknown IDs come back as null
+        return [album for resp in responses for album in resp["albums"] if album is not None]
+
+    def full_tracks(self, track_ids: List[str], workers: int = DEFAULT_WORKERS) -> List[Dict]:
+        """Full track objects (with external_ids), 50 per call."""
+        batches = list(chunker(list(track_ids), TRACKS_BATCH_SIZE))
+        responses = map_concurrent(lambda ids: self.call(self.sp.tracks, ids), batches, workers=workers)
+        return [track for resp in responses for track in resp["tracks"] if track is not None]
+
+    def album_identifiers(self, album_ids: List[str], workers: int = DEFAULT_WORKERS) -> Dict[str, Dict]:
+        """
+        album ID -> {"name", "upc", "isrc"}: the album's barcode, and the ISRC
+        of its first track (album track lists don't carry ISRCs, so those come
+        from a second batched call). Either code can be None.
+        """
+        album_ids = list(dict.fromkeys(album_ids))
+        albums = self.full_albums(album_ids, workers=workers)
+        first_tracks = {album["id"]: album["tracks"]["items"][0]["id"] for album in albums if album["tracks"]["items"]}
+        isrcs = {
+            track["id"]: track.get("external_ids", {}).get("isrc")
+            for track in self.full_tracks(list(first_tracks.values()), workers=workers)
+        }
+        return {
+            album["id"]: {
+                "name": album["name"],
+                "upc": album.get("external_ids", {}).get("upc"),
+                "isrc": isrcs.get(first_tracks.get(album["id"])),
+            }
+            for album in albums
+        }
+
+    def tracks_for_albums(self, album_ids: List[str], workers: int = DEFAULT_WORKERS) -> Dict[str, List[Dict]]:
+        """
+        Track lists for many albums, keyed by album ID. Uses the multi-album
+        endpoint (20 albums per call, batches run concurrently), and only pages
+        through album_tracks for albums whose embedded track list was cut off.
+        """
+        album_ids = list(dict.fromkeys(album_ids))
+        print(f"Retrieving tracks for {len(album_ids)} albums in {math.ceil(len(album_ids) / ALBUMS_BATCH_SIZE)} batches...")
+
+        tracks = {}
+        truncated = []
+        for album in self.full_albums(album_ids, workers=workers):
+            tracks[album["id"]] = album["tracks"]["items"]
+            if album["tracks"].get("next"):
+                truncated.append(album)
+
+        if truncated:
+            print(f"Paging through the rest of {len(truncated)} long albums...")
+            rest = map_concurrent(lambda album: list(self.paginate(album["tracks"])), truncated, workers=workers)
+            for album, items in zip(truncated, rest):
+                tracks[album["id"]] = items
+
+        return tracks
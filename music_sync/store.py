@@ -0,0 +1,359 @@
+"""
+Local state database: one SQLite file in place of the chain of intermediate CSVs.
+
+Every step used to read a CSV, rebuild its joins in pandas, and write another
+CSV, losing dtypes on the way (hence all the `astype(pd.Int32Dtype())`). Now
+steps upsert their results into indexed tables in data/state.sqlite, and the
+joins run in SQL:
+
+    local_albums    folder -> artist, album, artist_key           (script 1)
+    artist_matches  (service, artist_key) -> artist_id + candidates, and how
+                    well the pick's discography covers our albums
+    catalog_albums  (service, album_id) -> artist_id, name, url    (discographies)
+    album_matches   (service, folder) -> best match, score, album_id, and
+                    matched_by ("upc" / "isrc" when resolved by identifier)
+    library         (service, kind, item_id): what's followed / saved, with its
+                    name and (albums) artist_id when known, and added_at for
+                    items read from the service (not just written by us)
+
+CSV export stays for manual review: edit the exported file, then import_csv()
+upserts the edited rows back.
+
+catalog_albums.url may be left empty (the streaming match doesn't store it);
+album_join() fills it in from the album ID.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional, Union
+
+import pandas as pd
+
+STATE_PATH = "data/state.sqlite"
+
+# Tidal IDs are integers, Spotify IDs are strings. ID columns are declared
+# without a type so SQLite stores either as given, and reads cast them back.
+ID_DTYPES = {"spotify": "string", "tidal": "Int64"}
+ID_COLUMNS = ["artist_id", "album_id", "item_id"]
+
+ALBUM_URLS = {"spotify": "https://open.spotify.com/album/", "tidal": "https://tidal.com/browse/album/"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS local_albums (
+    folder TEXT PRIMARY KEY,
+    artist TEXT NOT NULL,
+    album TEXT NOT NULL,
+    artist_key TEXT
+);
+CREATE INDEX IF NOT EXISTS local_albums_artist_key ON local_albums (artist_key);
+
+CREATE TABLE IF NOT EXISTS artist_matches (
+    service TEXT NOT NULL,
+    artist_key TEXT NOT NULL,
+    artist TEXT,
+    variants TEXT,
+    artist_id,
+    artist_candidates TEXT,
+    artist_match_score REAL,
+    needs_review INTEGER,
+    PRIMARY KEY (service, artist_key)
+);
+
+CREATE TABLE IF NOT EXISTS catalog_albums (
+    service TEXT NOT NULL,
+    album_id NOT NULL,
+    artist_id NOT NULL,
+    name TEXT NOT NULL,
+    url TEXT,
+    PRIMARY KEY (service, album_id)
+);
+CREATE INDEX IF NOT EXISTS catalog_albums_artist_name ON catalog_albums (service, artist_id, name);
+
+CREATE TABLE IF NOT EXISTS album_matches (
+    service TEXT NOT NULL,
+    folder TEXT NOT NULL,
+    artist_id,
+    album_name_best_match TEXT,
+    album_match_score REAL,
+    album_match_candidates TEXT,
+    album_id,
+    matched_by TEXT,
+    PRIMARY KEY (service, folder)
+);
+CREATE INDEX IF NOT EXISTS album_matches_album_id ON album_matches (service, album_id);
+
+CREATE TABLE IF NOT EXISTS library (
+    service TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    item_id NOT NULL,
+    name TEXT,
+    artist_id,
+    added_at TEXT,
+    PRIMARY KEY (service, kind, item_id)
+);
+"""
+
+# Columns added after the first release; CREATE TABLE IF NOT EXISTS won't add
+# them to an existing database, so __init__ does
+ADDED_COLUMNS = {
+    "artist_matches": {"artist_match_score": "REAL", "needs_review": "INTEGER"},
+    "album_matches": {"matched_by": "TEXT"},
+    "library": {"added_at": "TEXT", "artist_id": ""},
+}
+
+KEYS = {
+    "local_albums": ["folder"],
+    "artist_matches": ["service", "artist_key"],
+    "catalog_albums": ["service", "album_id"],
+    "album_matches": ["service", "folder"],
+    "library": ["service", "kind", "item_id"],
+}
+
+
+def _json_list(values: Iterable) -> str:
+    # For `IN (SELECT value FROM json_each(?))`, which has no limit on the
+    # number of values. default=int covers numpy integers (Tidal IDs).
+    return json.dumps(list(values), default=int)
+
+
+def _records(rows: Union[pd.DataFrame, Iterable[Dict]], columns: List[str]) -> List[tuple]:
+    # object + where() turns numpy scalars into Python ones and NA/NaN into None
+    frame = pd.DataFrame(rows) if not isinstance(rows, pd.DataFrame) else rows
+    frame = frame[columns].astype(object)
+    frame = frame.where(frame.notna(), None)
+    return list(frame.itertuples(index=False, name=None))
+
+
+class StateStore:
+    def __init__(self, path: str = STATE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+
+        self._columns = {
+            table: [row[1] for row in self._conn.execute(f"PRAGMA table_info({table})")]
+            for table in KEYS
+        }
+        for table, columns in ADDED_COLUMNS.items():
+            for column, declaration in columns.items():
+                if column not in self._columns[table]:
+                    self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+                    self._columns[table].append(column)
+        self._conn.commit()
+
+    def upsert(self, table: str, rows: Union[pd.DataFrame, Iterable[Dict]], **fixed) -> int:
+        """
+        Inserts rows, or updates the existing row with the same key. Only the
+        columns present in `rows` (plus `fixed`, e.g. service="spotify") are
+        written, so a step never clobbers columns another step owns.
+        """
+        frame = pd.DataFrame(rows) if not isinstance(rows, pd.DataFrame) else rows.copy()
+        for column, value in fixed.items():
+            frame[column] = value
+        columns = [column for column in self._columns[table] if column in frame.columns]
+        if frame.empty:
+            return 0
+
+        keys = KEYS[table]
+        updates = [column for column in columns if column not in keys]
+        sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})"
+        sql += f" ON CONFLICT ({', '.join(keys)}) DO "
+        sql += ("UPDATE SET " + ", ".join(f"{column} = excluded.{column}" for column in updates)) if updates else "NOTHING"
+
+        records = _records(frame, columns)
+        with self._lock:
+            self._conn.executemany(sql, records)
+            self._conn.commit()
+        return len(records)
+
+    def delete(self, table: str, **where):
+        clause = " AND ".join(f"{column} = ?" for column in where) or "1"
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {table} WHERE {clause}", tuple(where.values()))
+            self._conn.commit()
+
+    def query(self, sql: str, params: tuple = (), service: Optional[str] = None) -> pd.DataFrame:
+        with self._lock:
+            frame = pd.read_sql_query(sql, self._conn, params=params)
+        if service is not None:
+            for column in ID_COLUMNS:
+                if column in frame.columns:
+                    frame[column] = frame[column].astype(ID_DTYPES[service])
+        return frame
+
+    def table(self, table: str, service: Optional[str] = None, **where) -> pd.DataFrame:
+        if service is not None and "service" in self._columns[table]:
+            where["service"] = service
+        clause = " AND ".join(f"{column} = ?" for column in where) or "1"
+        return self.query(f"SELECT * FROM {table} WHERE {clause}", tuple(where.values()), service=service)
+
+    ##############################
+    # Joins the scripts used to do in pandas
+    ##############################
+
+    def resolve_album_ids(self, service: str) -> int:
+        """
+        Fills album_matches.album_id from the catalog by artist + best-match
+        name, taking the first catalog entry when a name appears more than once
+        (re-releases and such). Rows with an album_id already set are left alone.
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                """
+                UPDATE album_matches SET album_id = (
+                    SELECT c.album_id FROM catalog_albums c
+                    WHERE c.service = album_matches.service
+                      AND c.artist_id = album_matches.artist_id
+                      AND c.name = album_matches.album_name_best_match
+                    ORDER BY c.rowid
+                    LIMIT 1
+                )
+                WHERE service = ? AND album_id IS NULL AND album_name_best_match IS NOT NULL
+                """,
+                (service,),
+            )
+            self._conn.commit()
+        return cursor.rowcount
+
+    def albums_for_matching(self, service: str, unmatched_only: bool = False, artist_keys: Optional[Iterable[str]] = None) -> pd.DataFrame:
+        """
+        Local albums with their artist ID for this service: folder, artist,
+        album, artist_id. unmatched_only skips albums that already have an
+        album_id (e.g. resolved by UPC / ISRC); artist_keys limits it to those artists.
+        """
+        where = ["m.album_id IS NULL"] if unmatched_only else []
+        params = (service, service)
+        if artist_keys is not None:
+            where.append("l.artist_key IN (SELECT value FROM json_each(?))")
+            params += (_json_list(artist_keys),)
+
+        return self.query(
+            f"""
+            SELECT l.folder, l.artist, l.album, a.artist_id
+            FROM local_albums l
+            LEFT JOIN artist_matches a ON a.service = ? AND a.artist_key = l.artist_key
+            LEFT JOIN album_matches m ON m.service = ? AND m.folder = l.folder
+            {"WHERE " + " AND ".join(where) if where else ""}
+            ORDER BY l.folder
+            """,
+            params,
+            service=service,
+        )
+
+    def local_titles(self, artist_keys: Iterable[str]) -> Dict[str, List[str]]:
+        """Local album titles per artist key, for these keys."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT artist_key, album FROM local_albums WHERE artist_key IN (SELECT value FROM json_each(?)) ORDER BY folder",
+                (_json_list(artist_keys),),
+            ).fetchall()
+        titles: Dict[str, List[str]] = {}
+        for key, album in rows:
+            titles.setdefault(key, []).append(album)
+        return titles
+
+    def unmatched_artist_keys(self, service: str) -> List[str]:
+        """Artist keys that still have local albums without an album ID, in order."""
+        with self._lock:
+            rows = self._conn.execute(
+                """
+                SELECT DISTINCT l.artist_key
+                FROM local_albums l
+                LEFT JOIN album_matches m ON m.service = ? AND m.folder = l.folder
+                WHERE m.album_id IS NULL AND l.artist_key IS NOT NULL
+                ORDER BY l.artist_key
+                """,
+                (service,),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def catalog_names(self, service: str, artist_ids: Optional[Iterable] = None) -> pd.DataFrame:
+        """Just the artist_id and name columns of the catalog (all of it, or for these artists), for matching."""
+        sql = "SELECT artist_id, name FROM catalog_albums WHERE service = ?"
+        params = (service,)
+        if artist_ids is not None:
+            sql += " AND artist_id IN (SELECT value FROM json_each(?))"
+            params += (_json_list(artist_ids),)
+        return self.query(sql, params, service=service)
+
+    def album_join(self, service: str) -> pd.DataFrame:
+        """Every local album with its artist and album match for this service (what albums_join.csv held)."""
+        return self.query(
+            """
+            SELECT l.folder, l.artist, l.album, a.artist_id,
+                   m.album_name_best_match, m.album_match_score, m.album_match_candidates,
+                   m.matched_by, m.album_id, c.name, COALESCE(c.url, ? || c.album_id) AS url
+            FROM local_albums l
+            LEFT JOIN artist_matches a ON a.service = ? AND a.artist_key = l.artist_key
+            LEFT JOIN album_matches m ON m.service = a.service AND m.folder = l.folder
+            LEFT JOIN catalog_albums c ON c.service = m.service AND c.album_id = m.album_id
+            ORDER BY l.folder
+            """,
+            (ALBUM_URLS[service], service),
+            service=service,
+        )
+
+    def library_ids(self, service: str, kind: str, listed: bool = False) -> set:
+        """IDs in the library snapshot. listed leaves out the ones we wrote that haven't been read back from the service yet."""
+        library = self.table("library", service=service, kind=kind)
+        if listed:
+            library = library[library["added_at"].notna()]
+        return set(library["item_id"].dropna())
+
+    def library_albums(self, service: str) -> pd.DataFrame:
+        """
+        Saved albums in the snapshot, newest first (ours, not read back yet,
+        before those): item_id, name and artist_id, from the catalog where the
+        snapshot doesn't have them.
+        """
+        return self.query(
+            """
+            SELECT l.item_id, COALESCE(l.name, c.name) AS name, COALESCE(l.artist_id, c.artist_id) AS artist_id
+            FROM library l
+            LEFT JOIN catalog_albums c ON c.service = l.service AND c.album_id = l.item_id
+            WHERE l.service = ? AND l.kind = 'album'
+            ORDER BY l.added_at IS NOT NULL, l.added_at DESC
+            """,
+            (service,),
+            service=service,
+        )
+
+    def replace_library(self, service: str, kind: str, items: List[Dict]):
+        """Replaces the stored snapshot of followed artists / saved albums ({"id", "name", "added_at"} dicts, and "artist_id" for albums)."""
+        self.delete("library", service=service, kind=kind)
+        self.update_library(service, kind, items)
+
+    def update_library(self, service: str, kind: str, items: List[Dict]):
+        """Adds items to the snapshot (or refreshes their name, artist_id and added_at)."""
+        self.upsert(
+            "library",
+            [{"item_id": item["id"], "name": item.get("name"), "artist_id": item.get("artist_id"), "added_at": item.get("added_at")} for item in items],
+            service=service,
+            kind=kind,
+        )
+
+    ##############################
+    # CSV round trip for manual review
+    ##############################
+
+    def export_csv(self, table: str, path: str, service: Optional[str] = None, frame: Optional[pd.DataFrame] = None):
+        frame = self.table(table, service=service) if frame is None else frame
+        frame.to_csv(path, index=False)
+
+    def import_csv(self, table: str, path: str, service: Optional[str] = None) -> int:
+        """Upserts a reviewed CSV back. Only columns the table has are read."""
+        dtypes = {column: ID_DTYPES[service] for column in ID_COLUMNS} if service else None
+        frame = pd.read_csv(path, dtype=dtypes)
+        fixed = {"service": service} if service and "service" in self._columns[table] else {}
+        return self.upsert(table, frame, **fixed)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
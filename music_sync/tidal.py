@@ -0,0 +1,383 @@
+"""
+Tidal helpers shared by the Tidal scripts.
+
+tidalapi is blocking and its Session (one requests.Session, plus model objects
+that hold on to it) isn't meant to be shared between threads. TidalClient runs
+calls concurrently anyway by giving every in-flight call its own logged-in
+session from a small pool, so there's at most one session per worker and each
+is reused call after call. Every request gets a timeout, and goes through the
+shared rate limiter (which retries timeouts along with 429s and 5xx).
+
+The bulk methods (search_artists, artists_albums, ...) take N items and return
+N results in input order, with a failed item's exception in its slot, so one
+bad artist doesn't sink the batch and the caller can see exactly what failed.
+The `a`-prefixed versions do the same from asyncio code.
+
+Favorites are written in bulk: the favorites endpoints take a comma-separated
+list of IDs, so add_favorite_albums sends one POST per FAVORITES_BATCH_SIZE
+albums (batches in parallel), after dropping the ones already favorited. If
+the API rejects a batch, its IDs are retried one at a time, so a single bad ID
+only fails its own slot.
+
+albums_by_barcodes / albums_by_isrcs look releases up by identifier on the v2
+catalogue API, 20 codes per request (tidalapi's versions take one code and
+then fetch every hit separately). See music_sync.identifiers.
+"""
+
+import asyncio
+import queue
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional
+
+import tidalapi
+
+from music_sync.cache import ResponseCache
+from music_sync.metrics import Metrics
+from music_sync.paging import iter_offset_items
+from music_sync.ratelimit import RateLimiter
+from music_sync.workers import chunker, map_concurrent
+
+PAGE_SIZE = 100
+DEFAULT_WORKERS = 4
+DEFAULT_TIMEOUT = 30.0
+FAVORITES_BATCH_SIZE = 50
+
+# Most barcodes / ISRCs the v2 catalogue filters take per call
+IDENTIFIER_BATCH_SIZE = 20
+
+# The multi-ID form field for each favorites endpoint
+_FAVORITE_FIELDS = {"artists": "artistIds", "albums": "albumIds"}
+
+
+def failures(items: Iterable, results: List) -> Dict:
+    """item -> "ErrorType: message" for every slot of a bulk result that failed."""
+    return {
+        item: f"{type(result).__name__}: {result}"
+        for item, result in zip(items, results)
+        if isinstance(result, Exception)
+    }
+
+
+def _included(resp: Dict) -> Dict[tuple, Dict]:
+    # JSON:API responses put related resources in "included", keyed by type and ID
+    return {(item["type"], item["id"]): item for item in resp.get("included", [])}
+
+
+def _related(resource: Dict, included: Dict[tuple, Dict], kind: str) -> Optional[Dict]:
+    """The first related resource of this kind, e.g. a track's album."""
+    for ref in resource.get("relationships", {}).get(kind, {}).get("data", []):
+        if (ref["type"], ref["id"]) in included:
+            return included[(ref["type"], ref["id"])]
+    return None
+
+
+def with_timeout(request: Callable, timeout: float) -> Callable:
+    # tidalapi never passes a timeout, so a stalled connection would hang forever
+    def wrapper(*args, **kwargs):
+        kwargs.setdefault("timeout", timeout)
+        return request(*args, **kwargs)
+    return wrapper
+
+
+class TidalClient:
+    def __init__(
+        self,
+        session,
+        limiter: Optional[RateLimiter] = None,
+        cache: Optional[ResponseCache] = None,
+        workers: int = DEFAULT_WORKERS,
+        timeout: float = DEFAULT_TIMEOUT,
+        metrics: Optional[Metrics] = None,
+        login=None,
+    ):
+        self.session = session
+        # A sessions.TidalLogin keeps the token fresh across worker sessions on long runs
+        self.login = login
+        self.limiter = limiter or RateLimiter(rate=5)
+        self.cache = cache
+        self.workers = workers
+        self.timeout = timeout
+        self.metrics = metrics
+        self._sessions: "queue.Queue" = queue.Queue()
+
+    def call(self, fn, *args, **kwargs):
+        return self.limiter.call(fn, *args, **kwargs)
+
+    def cached(self, endpoint: str, fn, *args, **kwargs):
+        if self.cache is None:
+            return fn(*args, **kwargs)
+        return self.cache.fetch(endpoint, fn, *args, **kwargs)
+
+    def _new_session(self):
+        if self.login is not None:
+            self.login.fresh()
+        session = tidalapi.Session(self.session.config)
+        session.request_session.request = with_timeout(session.request_session.request, self.timeout)
+        if self.metrics is not None:
+            self.metrics.instrument(session.request_session, "tidal", self.limiter)
+        ok = self.call(
+            session.load_oauth_session,
+            self.session.token_type,
+            self.session.access_token,
+            self.session.refresh_token,
+            self.session.expiry_time,
+        )
+        if not ok:
+            raise RuntimeError("Couldn't start a Tidal worker session from the main session's token")
+        return session
+
+    @contextmanager
+    def worker_session(self):
+        """Checks a session out of the pool (logging a new one in if they're all busy)."""
+        try:
+            session = self._sessions.get_nowait()
+        except queue.Empty:
+            session = self._new_session()
+        try:
+            if self.login is not None:
+                self.login.fresh(session)
+            yield session
+        finally:
+            self._sessions.put(session)
+
+    ##############################
+    # Library
+    ##############################
+
+    def _favorites(self, kind: str, known: Optional[set]) -> List:
+        # Newest first, so that given the IDs already known we can stop at the first of them
+        with self.worker_session() as session:
+            parse = session.parse_artist if kind == "artists" else session.parse_album
+            params = {"order": "DATE", "orderDirection": "DESC"}
+            items = iter_offset_items(
+                lambda limit, offset: self.call(
+                    session.request.map_request,
+                    f"{session.user.favorites.base_url}/{kind}",
+                    params={**params, "limit": limit, "offset": offset},
+                    parse=parse,
+                ),
+                PAGE_SIZE,
+                prefetch=not known,
+            )
+            favorites = []
+            for item in items:
+                if known and item.id in known:
+                    break
+                favorites.append(item)
+            return favorites
+
+    def favorite_artists(self, known: Optional[set] = None) -> List[Dict]:
+        """Favorite artists, newest first, up to the first one in `known` (if given)."""
+        return [{
+            "id": artist.id,
+            "name": artist.name,
+            "added_at": artist.user_date_added.isoformat() if artist.user_date_added else None,
+        } for artist in self._favorites("artists", known)]
+
+    def favorite_albums(self, known: Optional[set] = None) -> List[Dict]:
+        """Favorite albums, newest first, up to the first one in `known` (if given)."""
+        return [{
+            "id": album.id,
+            "name": album.name,
+            "artist_id": album.artist.id,
+            "artist_name": album.artist.name,
+            "added_at": album.user_date_added.isoformat() if album.user_date_added else None,
+        } for album in self._favorites("albums", known)]
+
+    def add_favorite_artist(self, artist_id: int) -> bool:
+        with self.worker_session() as session:
+            return self.call(session.user.favorites.add_artist, artist_id)
+
+    def add_favorite_album(self, album_id: int) -> bool:
+        with self.worker_session() as session:
+            return self.call(session.user.favorites.add_album, album_id)
+
+    def _post_favorites(self, kind: str, ids: List[int]) -> bool:
+        # tidalapi's add_album / add_artist only send one ID, so post the list ourselves
+        with self.worker_session() as session:
+            response = self.call(
+                session.request.request,
+                "POST",
+                f"{session.user.favorites.base_url}/{kind}",
+                data={_FAVORITE_FIELDS[kind]: ",".join(str(item_id) for item_id in ids)},
+            )
+            return response.ok
+
+    def _add_favorites(self, kind: str, ids: Iterable[int], add_one: Callable, batch_size: int, skip_existing: bool, workers: Optional[int]) -> List:
+        ids = [int(item_id) for item_id in ids]
+        existing = set()
+        if skip_existing:
+            existing = {item["id"] for item in (self.favorite_artists() if kind == "artists" else self.favorite_albums())}
+
+        todo = list(dict.fromkeys(item_id for item_id in ids if item_id not in existing))
+        batches = list(chunker(todo, batch_size))
+
+        written = {}
+        rejected = []
+        for batch, ok in zip(batches, self.map(lambda batch: self._post_favorites(kind, batch), batches, workers=workers)):
+            if ok is True:
+                written.update((item_id, True) for item_id in batch)
+            else:
+                rejected.extend(batch)
+
+        # Rejected batches go again one ID at a time, to find out which IDs are
+        # the problem. A second pass rather than a map inside the first, so a
+        # call never has more than `workers` sessions checked out.
+        written.update(zip(rejected, self.map(add_one, rejected, workers=workers)))
+
+        # None for IDs that were already favorites
+        return [written.get(item_id) for item_id in ids]
+
+    ##############################
+    # Catalog
+    ##############################
+
+    # tidalapi returns model objects, so these convert to plain dicts that can be cached
+    def _search_artist(self, name: str) -> List[Dict]:
+        with self.worker_session() as session:
+            search_result = self.call(session.search, name, models=[tidalapi.artist.Artist])
+            return [{"id": artist.id, "name": artist.name} for artist in search_result["artists"]]
+
+    def search_artist(self, name: str) -> List[Dict]:
+        return self.cached("tidal.search", self._search_artist, name)
+
+    def _fetch_artist_albums(self, artist_id: int) -> Dict:
+        with self.worker_session() as session:
+            artist = self.call(session.artist, artist_id)
+            albums = iter_offset_items(lambda limit, offset: self.call(artist.get_albums, limit=limit, offset=offset), PAGE_SIZE)
+            return {
+                "artist_name": artist.name,
+                # explicit and release_date pick between editions (see editions.py)
+                "albums": [{
+                    "id": album.id,
+                    "name": album.name,
+                    "explicit": album.explicit,
+                    "release_date": album.release_date.date().isoformat() if album.release_date else None,
+                } for album in albums],
+            }
+
+    def artist_albums(self, artist_id: int) -> Dict:
+        """The artist's full discography, as {"artist_name": ..., "albums": [...]}."""
+        return self.cached("tidal.discography", self._fetch_artist_albums, int(artist_id))
+
+    def _catalog_v2(self, path: str, params: Dict) -> Dict:
+        with self.worker_session() as session:
+            response = self.call(session.request.request, "GET", path, params=params, base_url=session.config.openapi_v2_location)
+            return response.json()
+
+    def _fetch_albums_by_barcodes(self, upcs: List[str]) -> Dict[str, List[Dict]]:
+        resp = self._catalog_v2("albums", {"filter[barcodeId]": upcs, "include": "artists"})
+        included = _included(resp)
+        found = {upc: [] for upc in upcs}
+        for album in resp.get("data", []):
+            artist = _related(album, included, "artists")
+            found.setdefault(album["attributes"]["barcodeId"], []).append({
+                "id": int(album["id"]),
+                "name": album["attributes"]["title"],
+                "artist_id": int(artist["id"]) if artist else None,
+                "artist_name": artist["attributes"]["name"] if artist else None,
+            })
+        return found
+
+    def _fetch_albums_by_isrcs(self, isrcs: List[str]) -> Dict[str, List[Dict]]:
+        resp = self._catalog_v2("tracks", {"filter[isrc]": isrcs, "include": "albums,artists"})
+        included = _included(resp)
+        found = {isrc: [] for isrc in isrcs}
+        for track in resp.get("data", []):
+            album, artist = _related(track, included, "albums"), _related(track, included, "artists")
+            if album is None:
+                continue
+            # The same recording can be on several albums; keep each album once
+            albums = found.setdefault(track["attributes"]["isrc"], [])
+            if all(existing["id"] != int(album["id"]) for existing in albums):
+                albums.append({
+                    "id": int(album["id"]),
+                    "name": album["attributes"]["title"],
+                    "artist_id": int(artist["id"]) if artist else None,
+                    "artist_name": artist["attributes"]["name"] if artist else None,
+                })
+        return found
+
+    def _lookup_codes(self, endpoint: str, codes: Iterable[str], fetch: Callable) -> List:
+        # Cached per code, but the misses are fetched IDENTIFIER_BATCH_SIZE at a time
+        codes = [str(code) for code in codes]
+        results, misses = {}, []
+        for code in dict.fromkeys(codes):
+            hit, value = self.cache.get(endpoint, code) if self.cache is not None else (False, None)
+            if hit:
+                results[code] = value
+            else:
+                misses.append(code)
+
+        batches = list(chunker(misses, IDENTIFIER_BATCH_SIZE))
+        for batch, found in zip(batches, self.map(fetch, batches)):
+            for code in batch:
+                if isinstance(found, Exception):
+                    results[code] = found
+                    continue
+                results[code] = found.get(code, [])
+                if self.cache is not None:
+                    self.cache.set(endpoint, results[code], code)
+
+        return [results[code] for code in codes]
+
+    def albums_by_barcodes(self, upcs: Iterable[str]) -> List:
+        """For each UPC, the albums with that barcode (usually one, empty if Tidal doesn't have it)."""
+        return self._lookup_codes("tidal.barcode", upcs, self._fetch_albums_by_barcodes)
+
+    def albums_by_isrcs(self, isrcs: Iterable[str]) -> List:
+        """For each ISRC, the albums with a track with that ISRC."""
+        return self._lookup_codes("tidal.isrc", isrcs, self._fetch_albums_by_isrcs)
+
+    ##############################
+    # Bulk
+    ##############################
+
+    def map(self, fn: Callable, items: Iterable, workers: Optional[int] = None) -> List:
+        """fn over items on the worker pool (`workers` threads, default self.workers). Results in input order, exceptions in failed slots."""
+        return map_concurrent(fn, items, workers=workers or self.workers, return_exceptions=True)
+
+    async def amap(self, fn: Callable, items: Iterable) -> List:
+        semaphore = asyncio.Semaphore(self.workers)
+
+        async def run(item):
+            async with semaphore:
+                return await asyncio.to_thread(fn, item)
+
+        return await asyncio.gather(*(run(item) for item in items), return_exceptions=True)
+
+    def search_artists(self, names: Iterable[str]) -> List:
+        return self.map(self.search_artist, names)
+
+    def artists_albums(self, artist_ids: Iterable[int]) -> List:
+        return self.map(self.artist_albums, artist_ids)
+
+    def add_favorite_artists(
+        self, artist_ids: Iterable[int], batch_size: int = FAVORITES_BATCH_SIZE, skip_existing: bool = True, workers: Optional[int] = None,
+    ) -> List:
+        """
+        Favorites the artists, batch_size per request, on `workers` threads
+        (default self.workers; 1 when the caller already runs these calls in
+        parallel). Per artist: True if added, None if it was already a
+        favorite, or the exception if it failed.
+        """
+        return self._add_favorites("artists", artist_ids, self.add_favorite_artist, batch_size, skip_existing, workers)
+
+    def add_favorite_albums(
+        self, album_ids: Iterable[int], batch_size: int = FAVORITES_BATCH_SIZE, skip_existing: bool = True, workers: Optional[int] = None,
+    ) -> List:
+        """Same as add_favorite_artists, for albums."""
+        return self._add_favorites("albums", album_ids, self.add_favorite_album, batch_size, skip_existing, workers)
+
+    async def asearch_artists(self, names: Iterable[str]) -> List:
+        return await self.amap(self.search_artist, names)
+
+    async def aartists_albums(self, artist_ids: Iterable[int]) -> List:
+        return await self.amap(self.artist_albums, artist_ids)
+
+    async def aadd_favorite_artists(self, artist_ids: Iterable[int], **kwargs) -> List:
+        # Already batched and parallel, so just keep it off the event loop
+        return await asyncio.to_thread(self.add_favorite_artists, list(artist_ids), **kwargs)
+
+    async def aadd_favorite_albums(self, album_ids: Iterable[int], **kwargs) -> List:
+        return await asyncio.to_thread(self.add_favorite_albums, list(album_ids), **kwargs)
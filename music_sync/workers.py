@@ -0,0 +1,47 @@
+"""
+Bounded worker pool for running API calls concurrently.
+
+Pair with a shared `RateLimiter` so the pool size only bounds how many requests
+are in flight, while the limiter decides how fast they go out.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, List
+
+DEFAULT_WORKERS = 8
+
+
+def chunker(seq, size):
+    return (seq[pos:pos + size] for pos in range(0, len(seq), size))
+
+
+def map_concurrent(
+    fn: Callable,
+    items: Iterable,
+    workers: int = DEFAULT_WORKERS,
+    return_exceptions: bool = False,
+) -> List:
+    """
+    Like `[fn(item) for item in items]`, but on a thread pool. Results come back
+    in input order. With return_exceptions=True a failed item's exception is put
+    in its slot instead of being raised.
+    """
+    items = list(items)
+    if not items:
+        return []
+
+    with ThreadPoolExecutor(max_workers=min(workers, len(items))) as pool:
+        futures = [pool.submit(fn, item) for item in items]
+
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                if not return_exceptions:
+                    for f in futures:
+                        f.cancel()
+                    raise
+                results.append(e)
+
+    return results